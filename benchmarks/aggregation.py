@@ -0,0 +1,77 @@
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import vectorized
+from benchmarks.stats import best_of
+from categories import CATEGORIES
+from rollup import interval_minutes_by_day
+from timeutils import get_local_tz
+
+
+# count интервалов одного пользователя подряд, с паузами, заканчиваются час назад
+def make_rows(count, seed=1):
+    rnd = random.Random(seed)
+    lengths = [rnd.randint(5, 180) * 60 + rnd.randint(0, 59) for _ in range(count)]
+    gaps = [rnd.choice((0, 0, rnd.randint(1, 120) * 60)) for _ in range(count)]
+    ts = int(time.time()) - 3600 - sum(lengths) - sum(gaps)
+    rows = []
+    for length, gap in zip(lengths, gaps):
+        rows.append((1, rnd.choice(CATEGORIES), ts, ts + length))
+        ts += length + gap
+    return rows
+
+
+# Как до векторного пути: каждый интервал режется по полуночи в Python
+def loop_aggregate(rows, tz):
+    totals = {}
+    for user_id, category, start_ts, end_ts in rows:
+        for local_date, minutes in interval_minutes_by_day(start_ts, end_ts, tz):
+            key = (user_id, local_date, category)
+            totals[key] = totals.get(key, 0) + minutes
+    return {key: minutes for key, minutes in totals.items() if minutes}
+
+
+def numpy_aggregate(rows, tz):
+    return {(user_id, local_date, category): minutes
+            for user_id, local_date, category, minutes in vectorized.rollup_rows(vectorized.from_rows(rows), tz)}
+
+
+# Матрица дней x категорий и время без трекинга за последний год
+def numpy_range(rows, tz):
+    intervals = vectorized.from_rows(rows)
+    today = datetime.now(tz).date()
+    edges = vectorized.day_edges(today - timedelta(days=365), today, tz)
+    matrix = vectorized.minutes_by_day(intervals, edges)
+    return matrix, vectorized.untracked_by_day(matrix, edges, int(time.time()))
+
+
+def main(sizes, repeat):
+    tz = get_local_tz()
+    print(f"{'intervals':>10}{'loop ms':>12}{'numpy ms':>12}{'speedup':>10}{'year range ms':>15}")
+    for size in sizes:
+        rows = make_rows(size)
+        expected = loop_aggregate(rows, tz)
+        if numpy_aggregate(rows, tz) != expected:
+            raise SystemExit(f"numpy result differs from the loop for {size} intervals")
+        matrix, _ = numpy_range(rows, tz)
+        year_ago = (datetime.now(tz).date() - timedelta(days=365)).isoformat()
+        if int(matrix.sum()) != sum(minutes for key, minutes in expected.items() if key[1] >= year_ago):
+            raise SystemExit(f"year matrix differs from the loop for {size} intervals")
+        loop = best_of(lambda: loop_aggregate(rows, tz), repeat)
+        vector = best_of(lambda: numpy_aggregate(rows, tz), repeat)
+        year = best_of(lambda: numpy_range(rows, tz), repeat)
+        print(f"{size:>10}{loop * 1000:>12.1f}{vector * 1000:>12.1f}{loop / vector:>9.1f}x{year * 1000:>15.1f}")
+
+
+# python -m benchmarks.aggregation [--sizes 1000 10000 100000]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Агрегация по дням: цикл Python против NumPy")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    np.seterr(all="raise")
+    main(args.sizes, args.repeat)
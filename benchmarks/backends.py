@@ -0,0 +1,294 @@
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, urlunsplit
+
+from benchmarks.stats import Samples
+from categories import CATEGORIES
+from intervals import OverlapError
+from range_stats import UNTRACKED
+from storage import Storage
+from storage_base import DATABASE_URL
+from timeutils import DAYS_TRANSLATION, get_tz, local_date, local_midnight_ts, ts_to_utc_iso
+from transfer import parse_record
+
+POLICIES = ("trim", "reject", "merge")
+A, B, C = CATEGORIES[:3]
+
+
+def _set_policy(storage, policy):
+    if isinstance(storage, Storage):
+        storage.intervals.policy = policy
+        storage.intervals.clear()
+    else:
+        storage.policy = policy
+
+
+# Записанные части или ("overlap", конфликты)
+async def _outcome(coro):
+    try:
+        return await coro
+    except OverlapError as e:
+        return "overlap", sorted(e.conflicts, key=repr)
+
+
+def _range(stats):
+    return {"totals": stats.totals, "days": {day.isoformat(): minutes for day, minutes in stats.days.items()},
+            "untracked": {day.isoformat(): minutes for day, minutes in stats.untracked_by_day.items()}}
+
+
+# Один и тот же сценарий через интерфейс storage_base.StorageBackend: политики
+# пересечений, изменение границ, импорт/экспорт, статистика, пояса, забытые
+# сессии, итоги дня и FSM. Из результата убраны id записей и «Без трекинга»
+# за сегодня (зависит от секунды вызова) — остальное у реализаций должно совпадать.
+async def conformance(storage):
+    result = {}
+    tz = get_tz()
+    today = datetime.now(tz).date()
+    first_day = today - timedelta(days=4)
+
+    def at(days_ago, hour, minute=0):
+        return local_midnight_ts(tz, today - timedelta(days=days_ago)) + hour * 3600 + minute * 60
+
+    for offset, policy in enumerate(POLICIES):
+        _set_policy(storage, policy)
+        user_id = 1000 + offset
+        steps = [
+            (A, at(3, 9), at(3, 10)),
+            (B, at(3, 9, 30), at(3, 11)),  # Начало пересекает A
+            (A, at(3, 10, 30), at(3, 12)),  # Пересекает B
+            (A, at(3, 12), at(3, 13)),  # Стык с A: merge склеивает
+            (C, at(3, 23), at(2, 1)),  # Через полночь
+            (B, at(3, 9, 15), at(3, 9, 45)),  # Целиком внутри занятого
+            (C, at(2, 22), at(2, 22, 30)),
+        ]
+        for index, (category, start_ts, end_ts) in enumerate(steps):
+            result[f"{policy}/add/{index}"] = await _outcome(
+                storage.add_tracking(user_id, category, ts_to_utc_iso(start_ts), ts_to_utc_iso(end_ts)))
+
+        last = await storage.get_last_tracking(user_id)
+        result[f"{policy}/last"] = last[1:]
+        result[f"{policy}/update_start"] = await _outcome(
+            storage.update_start_time(user_id, last[0], ts_to_utc_iso(at(2, 21, 30))))
+        result[f"{policy}/update_end"] = await _outcome(storage.update_end_time(user_id, last[0], ts_to_utc_iso(at(2, 23, 59))))
+        result[f"{policy}/update_over"] = await _outcome(storage.update_start_time(user_id, last[0], ts_to_utc_iso(at(3, 22))))
+        result[f"{policy}/update_missing"] = await storage.update_end_time(user_id, 10 ** 9, ts_to_utc_iso(at(2, 23)))
+
+        now = datetime.now(tz)
+        records = [{"category": category, "start_time": f"{day:%d.%m.%Y} {start}", "end_time": f"{day:%d.%m.%Y} {end}"}
+                   for day in (today - timedelta(days=1), today - timedelta(days=4))
+                   for category, start, end in ((A, "07:00", "07:45"), (B, "08:00", "09:10"), (A, "23:00", "23:59"))]
+        rows = [parse_record(record, now, tz) for record in records]
+        result[f"{policy}/import"] = await storage.import_logs(user_id, rows + rows[:2])  # Повторы внутри файла
+        result[f"{policy}/import_again"] = await storage.import_logs(user_id, rows)
+
+        exported, after_id = [], 0
+        while chunk := await storage.export_chunk(user_id, after_id, 4):
+            exported += chunk
+            after_id = chunk[-1][0]
+        result[f"{policy}/export"] = sorted(row[1:] for row in exported)
+
+        result[f"{policy}/range"] = _range(await storage.get_range_stats(user_id, first_day, today))
+        weekly = await storage.get_weekly_stats(user_id)
+        weekly.get(DAYS_TRANSLATION[today.strftime("%A")], {}).pop(UNTRACKED, None)
+        result[f"{policy}/weekly"] = weekly
+
+        # Идущий трекинг занимает время до конца нового интервала
+        await storage.start_tracking(user_id, C)
+        now_ts = int(time.time())
+        result[f"{policy}/active"] = await storage.check_active_tracking(user_id)
+        added = await _outcome(storage.add_tracking(user_id, A, ts_to_utc_iso(now_ts - 600), ts_to_utc_iso(now_ts + 60)))
+        result[f"{policy}/add_over_active"] = (added[0], len(added[1])) if added[0] == "overlap" else len(added)
+        result[f"{policy}/stop"] = await storage.stop_tracking(user_id)
+        result[f"{policy}/stop_again"] = await storage.stop_tracking(user_id)
+        result[f"{policy}/inactive"] = await storage.check_active_tracking(user_id)
+        result[f"{policy}/daily"] = sorted((category, minutes) for category, minutes
+                                           in await storage.get_daily_stats(user_id) if category != UNTRACKED)
+
+    # Смена пояса переносит минуты на другие местные даты
+    await storage.set_timezone(1000, "America/New_York")
+    ny_today = datetime.now(get_tz("America/New_York")).date()
+    result["tz/name"] = storage.tz_name(1000)
+    result["tz/range"] = _range(await storage.get_range_stats(1000, ny_today - timedelta(days=4),
+                                                              ny_today - timedelta(days=1)))
+    await storage.set_timezone(1000, None)
+    result["tz/reset"] = (storage.tz_name(1000), _range(await storage.get_range_stats(1000, first_day, today))["days"])
+
+    bulk = await storage.get_range_stats_bulk([1000, 1001, 1002, 1999], first_day, today)
+    result["bulk"] = {user_id: stats.totals for user_id, stats in bulk.items()}
+
+    for user_id in (2000, 2001, 2002):
+        await storage.start_tracking(user_id, B)
+    await asyncio.sleep(2.1)  # start_ts — целые секунды
+    result["stale"] = sorted(await storage.close_stale_sessions(1))
+    result["stale_logged"] = [row[1] for row in await storage.export_chunk(2000, 0, 10)]
+    result["stale_inactive"] = await storage.check_active_tracking(2000)
+
+    for user_id, hour in ((3000, 0), (3001, 0), (3002, None), (3003, 23)):
+        await storage.set_digest(user_id, hour)
+    await storage.set_timezone(3001, "Europe/Moscow")
+    result["digest/zones"] = sorted(await storage.digest_timezones(), key=repr)
+    result["digest/due"] = await storage.due_digests(None, 23, today)
+    result["digest/due_moscow"] = await storage.due_digests("Europe/Moscow", 12, today)
+    await storage.mark_digests([3000], today, disabled=[3003])
+    result["digest/due_after"] = await storage.due_digests(None, 23, today)
+    result["digest/zones_after"] = sorted(await storage.digest_timezones(), key=repr)
+
+    now_ts = int(time.time())
+    await storage.fsm_save([("a", "S:one", '{"x": 1}', now_ts + 60), ("b", None, "{}", now_ts - 1)], [])
+    # Срок хранения — из базы, сравнивается относительно now_ts
+    result["fsm/load"] = [_fsm_relative(await storage.fsm_load(key, now_ts), now_ts) for key in ("a", "b", "c")]
+    await storage.fsm_save([("a", "S:two", "{}", now_ts + 60)], ["b"])
+    result["fsm/update"] = _fsm_relative(await storage.fsm_load("a", now_ts), now_ts)
+    result["fsm/expired"] = await storage.fsm_delete_expired(now_ts + 120)
+    result["fsm/after"] = _fsm_relative(await storage.fsm_load("a", now_ts), now_ts)
+    _set_policy(storage, "trim")
+    return {key: _plain(value) for key, value in result.items()}
+
+
+# Кортежи и записи asyncpg — в списки, чтобы сравнивать значения, а не типы
+def _plain(value):
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return value
+
+
+# Запись FSM с оставшимся сроком вместо абсолютного: бэкенды проверяются в разные секунды
+def _fsm_relative(record, now_ts):
+    return None if record is None else (*record[:2], record[2] - now_ts)
+
+
+# История пользователей 1..users: logs интервалов каждому, через импорт
+async def seed(storage, users, logs, rnd):
+    tz = get_tz()
+    first_ts = int(time.time()) - logs * 3 * 3600
+    for user_id in range(1, users + 1):
+        rows = []
+        for index in range(logs):
+            start_ts = first_ts + index * 3 * 3600 + rnd.randint(0, 3600)
+            end_ts = start_ts + rnd.randint(600, 7200)
+            rows.append((rnd.choice(CATEGORIES), local_date(end_ts, tz), ts_to_utc_iso(start_ts), ts_to_utc_iso(end_ts),
+                         round((end_ts - start_ts) / 60), start_ts, end_ts))
+        await storage.import_logs(user_id, rows)
+
+
+async def timings(storage, users, number, rnd):
+    today = datetime.now(get_tz()).date()
+    now_ts = int(time.time())
+    some_users = list(range(1, users + 1))
+
+    async def add_tracking(user_id):
+        start_ts = now_ts - rnd.randint(1, 90) * 86400
+        try:
+            await storage.add_tracking(user_id, A, ts_to_utc_iso(start_ts), ts_to_utc_iso(start_ts + 1800))
+        except OverlapError:
+            pass
+
+    async def start_stop(user_id):
+        await storage.start_tracking(user_id, B)
+        await storage.stop_tracking(user_id)
+
+    cases = [
+        ("check_active_tracking", storage.check_active_tracking),
+        ("start + stop", start_stop),
+        ("add_tracking (trim)", add_tracking),
+        ("get_daily_stats", storage.get_daily_stats),
+        ("get_weekly_stats", storage.get_weekly_stats),
+        ("range stats, month", lambda user_id: storage.get_range_stats(user_id, today - timedelta(days=30), today)),
+        ("range stats, year", lambda user_id: storage.get_range_stats(user_id, today - timedelta(days=364), today)),
+    ]
+    result = {}
+    for name, fn in cases:
+        samples = Samples()
+        for _ in range(number):
+            started = time.perf_counter()
+            await fn(rnd.choice(some_users))
+            samples.add(time.perf_counter() - started)
+        result[name] = samples.summary()["p50"]
+
+    samples = Samples()
+    for _ in range(max(1, number // 10)):
+        started = time.perf_counter()
+        await storage.get_range_stats_bulk(some_users, today - timedelta(days=30), today)
+        samples.add(time.perf_counter() - started)
+    result[f"range stats bulk, {users} users"] = samples.summary()["p50"]
+
+    # Все пользователи одновременно: очередь потока записи против пула соединений
+    started = time.perf_counter()
+    await asyncio.gather(*(start_stop(user_id) for user_id in some_users))
+    result[f"{users} concurrent start + stop"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+
+# Временная база на сервере из dsn: сценарий не трогает существующие данные
+@contextlib.asynccontextmanager
+async def scratch_database(dsn):
+    import asyncpg
+    name = f"bench_backends_{os.getpid()}"
+    admin = await asyncpg.connect(dsn)
+    await admin.execute(f'CREATE DATABASE "{name}"')
+    try:
+        yield urlunsplit(urlsplit(dsn)._replace(path="/" + name))
+    finally:
+        await admin.execute(f'DROP DATABASE "{name}"')
+        await admin.close()
+
+
+async def run_backend(storage, users, logs, number):
+    rnd = random.Random(1)
+    await storage.start()
+    try:
+        checks = await conformance(storage)
+        await seed(storage, users, logs, rnd)
+        return checks, await timings(storage, users, number, rnd)
+    finally:
+        await storage.close()
+
+
+async def main(pg, users, logs, number):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        results["sqlite"] = await run_backend(Storage(os.path.join(tmp, "backends.db")), users, logs, number)
+    if pg:
+        from pg_storage import PostgresStorage
+        async with scratch_database(pg) as dsn:
+            results["postgres"] = await run_backend(PostgresStorage(dsn), users, logs, number)
+    else:
+        print("PostgreSQL: no --pg or DATABASE_URL, running SQLite only\n")
+
+    names = list(results)
+    print(f"{'operation, p50 ms':<36}" + "".join(f"{name:>12}" for name in names))
+    for case in results["sqlite"][1]:
+        print(f"{case:<36}" + "".join(f"{results[name][1][case]:>12.3f}" for name in names))
+
+    checks = results["sqlite"][0]
+    for name in names[1:]:
+        mismatched = [key for key in checks if checks[key] != results[name][0].get(key)]
+        for key in mismatched:
+            print(f"\n{key}:\n  sqlite:  {checks[key]}\n  {name}: {results[name][0].get(key)}")
+        if mismatched:
+            raise SystemExit(f"{name}: {len(mismatched)} of {len(checks)} checks differ from sqlite")
+        print(f"\n{name}: all {len(checks)} conformance checks match sqlite")
+
+
+# python -m benchmarks.backends [--pg postgresql://user@host/db] [--users 50 --logs 1000 --number 200]
+# Один сценарий и одни замеры для SQLite (временный файл) и PostgreSQL: в базе
+# из --pg создаётся и после удаляется временная база. Без --pg и DATABASE_URL
+# проверяется только SQLite; те же сценарии с проверками результатов — в
+# tests/test_storage_backends.py (python -m pytest). Локальный сервер для замеров, например:
+#   docker run --rm -p 5432:5432 -e POSTGRES_HOST_AUTH_METHOD=trust postgres:16
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Хранилища SQLite и PostgreSQL: совместимость и задержки операций")
+    parser.add_argument("--pg", default=DATABASE_URL, help="DSN PostgreSQL (по умолчанию DATABASE_URL)")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--logs", type=int, default=1000, help="интервалов в истории каждого пользователя")
+    parser.add_argument("--number", type=int, default=200, help="вызовов каждой операции")
+    args = parser.parse_args()
+    asyncio.run(main(args.pg, args.users, args.logs, args.number))
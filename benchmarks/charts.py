@@ -0,0 +1,81 @@
+import argparse
+import io
+import random
+
+import chart_render
+from benchmarks.stats import best_of
+from categories import CATEGORIES, chart_label
+from chart_render import UNTRACKED_LABEL, autopct_func
+from matplotlib import colormaps
+from matplotlib.figure import Figure
+
+
+# Как до шаблонов: новая фигура на каждый вызов, легенда и bbox_inches='tight', полноцветный PNG
+def legacy_pie(categories, durations, fmt="png", dpi=100):
+    fig = Figure(figsize=(8, 8))
+    ax = fig.subplots()
+    wedges, texts, autotexts = ax.pie(durations, autopct=autopct_func, startangle=90,
+                                      colors=colormaps["Paired"].colors)
+    ax.legend(wedges, categories, title="Категории", loc="lower center", fontsize=10, bbox_to_anchor=(0.5, -0.3),
+              ncol=3)
+    ax.axis('equal')
+    ax.set_title('Распределение времени по категориям за день')
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt, dpi=dpi, bbox_inches='tight')
+    return buf.getvalue()
+
+
+# Тот же шаблон столбцов, но собранный заново на каждый вызов: цена сборки фигуры
+def fresh_stacked(days, categories, minutes, fmt="png", dpi=80):
+    template = chart_render.StackedTemplate(dpi)
+    template.update(days, categories, minutes)
+    return chart_render._encode(template.canvas, fmt)
+
+
+# Данные как у активного пользователя: день, неделя, месяц, год
+def make_data(seed=1):
+    rnd = random.Random(seed)
+    labels = [chart_label(category) for category in CATEGORIES[:6]]
+    day_minutes = [rnd.randint(20, 480) for _ in labels]
+    day = (labels + [UNTRACKED_LABEL], day_minutes + [max(0, 1440 - sum(day_minutes))])
+
+    def series(count):
+        days = [f"{index % 28 + 1:02d}.{index // 28 % 12 + 1:02d}" for index in range(count)]
+        minutes = [[rnd.randint(0, 240) for _ in days] for _ in labels]
+        untracked = [1440 - sum(column) for column in zip(*minutes)]
+        return days, labels + [UNTRACKED_LABEL], minutes + [untracked]
+
+    return day, series(7), series(31), series(365)
+
+
+def main(repeat, number):
+    day, week, month, year = make_data()
+    cases = [("pie, savefig PNG (before)", legacy_pie, day, "png", 100)]
+    for fmt in ("png", "webp"):
+        for dpi in (100, 80):
+            cases.append((f"pie, template {fmt} {dpi} dpi", chart_render.render_daily_pie, day, fmt, dpi))
+    cases += [
+        ("week bars, new figure", fresh_stacked, week, "png", 80),
+        ("week bars, template png", chart_render.render_stacked_days, week, "png", 80),
+        ("week bars, template webp", chart_render.render_stacked_days, week, "webp", 80),
+        ("month bars, template png", chart_render.render_stacked_days, month, "png", 80),
+        ("year trend, template png", chart_render.render_trend, year, "png", 80),
+        ("year trend, template webp", chart_render.render_trend, year, "webp", 80),
+    ]
+    print(f"{'chart':<30}{'ms':>8}{'KiB':>8}{'pixels':>12}")
+    for name, fn, data, fmt, dpi in cases:
+        fn(*data, fmt=fmt, dpi=dpi)  # Шрифты и шаблон — до замера, как после прогрева в боте
+        elapsed = best_of(lambda: fn(*data, fmt=fmt, dpi=dpi), repeat, number) / number
+        image = fn(*data, fmt=fmt, dpi=dpi)
+        width, height = chart_render.Image.open(io.BytesIO(image)).size
+        print(f"{name:<30}{elapsed * 1000:>8.1f}{len(image) / 1024:>8.1f}{f'{width}x{height}':>12}")
+
+
+# python -m benchmarks.charts [--repeat 5 --number 5]
+# Время — одна отрисовка в процессе отрисовки (без очереди пула), KiB — байты для загрузки в Telegram
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Графики: время отрисовки и размер картинки")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=5)
+    args = parser.parse_args()
+    main(args.repeat, args.number)
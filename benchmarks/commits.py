@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.stats import Samples
+from storage import Storage
+
+# Варианты потока записи: (synchronous, записей в группе, ожидание группы, с)
+MODES = {
+    "NORMAL, commit per write": ("NORMAL", 1, 0.0),
+    "FULL, commit per write": ("FULL", 1, 0.0),
+    "FULL, group commit": ("FULL", 64, 0.0),
+    "FULL, group commit, 2 ms wait": ("FULL", 64, 0.002),
+}
+
+
+# users пользователей одновременно начинают и завершают трекинг rounds раз
+async def run_mode(path, synchronous, group_size, group_wait, users, rounds):
+    storage = Storage(path, synchronous=synchronous, group_size=group_size, group_wait=group_wait)
+    await storage.start()
+    commits_before = storage.commits
+    latency = Samples()
+
+    async def user(user_id):
+        for _ in range(rounds):
+            started = time.perf_counter()
+            await storage.start_tracking(user_id, "bench")
+            latency.add(time.perf_counter() - started)
+            started = time.perf_counter()
+            await storage.stop_tracking(user_id)
+            latency.add(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(user_id) for user_id in range(1, users + 1)))
+    elapsed = time.perf_counter() - started
+    commits = storage.commits - commits_before
+    await storage.close()
+    return {"writes/s": latency.count / elapsed, "commits/s": commits / elapsed,
+            "writes/commit": latency.count / commits, "p50 ms": latency.summary()["p50"],
+            "p99 ms": latency.summary()["p99"]}
+
+
+# Дочерний процесс для --crash: печатает номер пользователя после каждого подтверждённого stop_tracking
+async def crash_child(path):
+    storage = Storage(path)
+    await storage.start()
+    user_id = 0
+
+    async def user():
+        nonlocal user_id
+        while True:
+            user_id += 1
+            current = user_id
+            await storage.start_tracking(current, "bench")
+            await storage.stop_tracking(current)
+            print(current, flush=True)
+
+    await asyncio.gather(*(user() for _ in range(32)))
+
+
+# Убивает процесс посреди записей и проверяет, что всё подтверждённое есть в базе
+def crash_check(path, seconds=1.0):
+    child = subprocess.Popen([sys.executable, "-m", "benchmarks.commits", "--crash-child", path],
+                             stdout=subprocess.PIPE, text=True)
+    first = child.stdout.readline()  # Ждём, пока дочерний процесс начнёт писать
+    time.sleep(seconds)
+    child.send_signal(signal.SIGKILL)
+    acknowledged = {int(line) for line in (first + child.stdout.read()).split()}
+    child.wait()
+    conn = sqlite3.connect(path)  # Открытие базы восстанавливает зафиксированное из WAL
+    stored = {row[0] for row in conn.execute("SELECT user_id FROM time_logs WHERE category = 'bench'")}
+    conn.close()
+    missing = acknowledged - stored
+    print(f"crash check: {len(acknowledged)} acknowledged writes, {len(missing)} missing after SIGKILL")
+    if missing:
+        raise SystemExit(f"acknowledged but lost: {sorted(missing)[:10]}")
+
+
+def main(users, rounds):
+    print(f"{'mode':<28}{'writes/s':>10}{'commits/s':>11}{'writes/commit':>15}{'p50 ms':>9}{'p99 ms':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, (synchronous, group_size, group_wait) in MODES.items():
+            path = os.path.join(tmp, f"{group_size}-{synchronous}.db")
+            result = asyncio.run(run_mode(path, synchronous, group_size, group_wait, users, rounds))
+            print(f"{name:<28}{result['writes/s']:>10.0f}{result['commits/s']:>11.0f}{result['writes/commit']:>15.1f}"
+                  f"{result['p50 ms']:>9.2f}{result['p99 ms']:>9.2f}")
+        crash_check(os.path.join(tmp, "crash.db"))
+
+
+# python -m benchmarks.commits [--users 100 --rounds 20]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Фиксации в секунду: по одной на запись и групповая")
+    parser.add_argument("--users", type=int, default=100, help="пользователей одновременно")
+    parser.add_argument("--rounds", type=int, default=20, help="пар start/stop на пользователя")
+    parser.add_argument("--crash-child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.crash_child:
+        asyncio.run(crash_child(args.crash_child))
+    else:
+        main(args.users, args.rounds)
@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from categories import CATEGORIES
+from scheduler import DIGEST_BATCH, digest_text, send_digests
+from storage import Storage
+from timeutils import get_local_tz
+
+
+# Принимает сообщения вместо Telegram
+class NullBot:
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+
+
+def _seed(conn, users, today, hour):
+    conn.executemany("INSERT INTO daily_rollup (user_id, local_date, category, minutes) VALUES (?, ?, ?, ?)",
+                     [(user_id, today.strftime("%Y-%m-%d"), category, 30 + user_id % 90)
+                      for user_id in range(1, users + 1) for category in CATEGORIES[:3]])
+    conn.executemany("INSERT INTO users (user_id, digest_hour) VALUES (?, ?)",
+                     [(user_id, hour) for user_id in range(1, users + 1)])
+
+
+# До пакетного пути: запрос статистики на каждого пользователя
+async def per_user(storage, bot, users, today):
+    for user_id in range(1, users + 1):
+        stats = await storage.get_range_stats(user_id, today, today)
+        await bot.send_message(user_id, digest_text(stats))
+
+
+async def run(users):
+    now = datetime.now(get_local_tz())
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(os.path.join(tmp, "digests.db"))
+        await storage.start()
+        await storage.write(_seed, users, now.date(), now.hour)
+
+        bot = NullBot()
+        started = time.perf_counter()
+        await per_user(storage, bot, users, now.date())
+        loop_time = time.perf_counter() - started
+
+        bot = NullBot()
+        started = time.perf_counter()
+        sent = await send_digests(bot, storage)
+        bulk_time = time.perf_counter() - started
+        await storage.close()
+    if sent != users:
+        raise SystemExit(f"sent {sent} digests to {users} users")
+    return loop_time, bulk_time
+
+
+def main(sizes):
+    print(f"{'users':>8}{'per user s':>12}{'bulk s':>9}{'reads':>16}{'speedup':>10}")
+    for users in sizes:
+        loop_time, bulk_time = asyncio.run(run(users))
+        batches = -(-users // DIGEST_BATCH)
+        print(f"{users:>8}{loop_time:>12.2f}{bulk_time:>9.2f}{f'{users} -> {batches * 2 + 2}':>16}"
+              f"{loop_time / bulk_time:>9.1f}x")
+
+
+# python -m benchmarks.digests [--sizes 1000 10000 100000]
+# Отправка здесь мгновенная: в боте её скорость задаёт лимит Telegram (outbox.py)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Итоги дня: запрос на пользователя против пачек")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+    main(args.sizes)
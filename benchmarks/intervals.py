@@ -0,0 +1,92 @@
+import argparse
+import random
+import sqlite3
+
+from benchmarks.stats import best_of
+from intervals import UserIntervals
+
+QUERIES = 1000
+
+
+# count интервалов одного пользователя без пересечений: (id, категория, start_ts, end_ts)
+def make_rows(count, seed=1):
+    rnd = random.Random(seed)
+    rows = []
+    ts = 1_700_000_000
+    for row_id in range(1, count + 1):
+        length = rnd.randint(5, 180) * 60
+        rows.append((row_id, "A", ts, ts + length))
+        ts += length + rnd.choice((0, rnd.randint(1, 120) * 60))
+    return rows
+
+
+def make_queries(rows, seed=2):
+    rnd = random.Random(seed)
+    first, last = rows[0][2], rows[-1][3]
+    queries = []
+    for _ in range(QUERIES):
+        start = rnd.randint(first, last)
+        queries.append((start, start + rnd.randint(10, 240) * 60))
+    return queries
+
+
+# До индекса: перебор всех интервалов пользователя
+def scan(rows, queries):
+    return [[row[0] for row in rows if row[2] < end and row[3] > start] for start, end in queries]
+
+
+def indexed(index, queries):
+    return [[index.ids[k] for k in index.overlapping(start, end)] for start, end in queries]
+
+
+# Тот же запрос к SQLite по idx_time_logs_user_start_ts (без индекса в памяти)
+def sql(conn, queries):
+    return [[row[0] for row in conn.execute(
+        "SELECT id FROM time_logs WHERE user_id = 1 AND start_ts < ? AND end_ts > ? ORDER BY start_ts",
+        (end, start))] for start, end in queries]
+
+
+def make_db(rows):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE time_logs (id INTEGER PRIMARY KEY, user_id INTEGER, category TEXT, "
+                 "start_ts INTEGER, end_ts INTEGER)")
+    conn.execute("CREATE INDEX idx_time_logs_user_start_ts ON time_logs (user_id, start_ts)")
+    conn.executemany("INSERT INTO time_logs VALUES (?, 1, ?, ?, ?)", rows)
+    return conn
+
+
+def main(sizes, repeat):
+    print(f"{'intervals':>10}{'load ms':>10}{'scan µs':>10}{'sql µs':>10}{'index µs':>10}{'insert µs':>11}")
+    for size in sizes:
+        rows = make_rows(size)
+        queries = make_queries(rows)
+        index = UserIntervals(rows)
+        conn = make_db(rows)
+        expected = scan(rows, queries)
+        if indexed(index, queries) != expected or sql(conn, queries) != expected:
+            raise SystemExit(f"overlap results differ for {size} intervals")
+
+        load = best_of(lambda: UserIntervals(rows), repeat)
+        per_query = 1e6 / QUERIES
+        scan_time = best_of(lambda: scan(rows, queries), repeat) * per_query
+        sql_time = best_of(lambda: sql(conn, queries), repeat) * per_query
+        index_time = best_of(lambda: indexed(index, queries), repeat) * per_query
+
+        # Вставка и удаление записи в середину истории (как при добавлении в прошлом)
+        middle = rows[size // 2]
+
+        def insert_remove():
+            index.insert(0, "B", middle[2], middle[2] + 1)
+            index.remove(0, middle[2])
+
+        insert = best_of(insert_remove, repeat, number=100) * 1e6
+        print(f"{size:>10}{load * 1000:>10.1f}{scan_time:>10.1f}{sql_time:>10.1f}{index_time:>10.2f}{insert:>11.1f}")
+
+
+# python -m benchmarks.intervals [--sizes 1000 10000 100000]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Поиск пересечений: перебор, SQLite и индекс в памяти")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    main(args.sizes, args.repeat)
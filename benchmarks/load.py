@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.stats import Samples, compare, wrap_timed
+
+# Бот требует токен при импорте; сеть при этом не используется
+os.environ.setdefault("BOT_TOKEN", "123456:benchmark")
+
+import bot as app  # noqa: E402
+import rollup  # noqa: E402
+from aiogram import Bot  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+from fake_telegram import FakeSession, FakeTelegramClient  # noqa: E402
+from timeutils import get_tz  # noqa: E402
+
+# Доли действий в нагрузке
+WORKLOAD = {
+    "start": 30,
+    "stop": 15,
+    "add": 10,
+    "edit": 10,
+    "stats_day": 25,
+    "stats_week": 10,
+}
+
+
+# Нагрузочный тест: тысячи имитируемых пользователей гоняют настоящий
+# диспетчер bot.dp, Bot API заменён FakeSession, база — временный файл.
+class LoadBenchmark:
+    def __init__(self, users, actions, concurrency, seed_days, api_latency, seed=1):
+        self.users = users
+        self.actions = actions
+        self.concurrency = concurrency
+        self.seed_days = seed_days
+        self.random = random.Random(seed)
+        self.session = FakeSession(latency=api_latency)
+        self.bot = Bot(token=os.environ["BOT_TOKEN"], session=self.session)
+        self.client = FakeTelegramClient()
+        self.latency = Samples()
+        self.per_action = {name: Samples() for name in WORKLOAD}
+        self.db = Samples()
+        self.render = Samples()
+        self.gaps = {}  # user_id -> свободные часы [start_ts], оставленные в истории
+        self.history_start = 0
+
+    async def _feed(self, raw):
+        update = Update.model_validate(raw, context={"bot": self.bot})
+        started = time.perf_counter()
+        await app.dp.feed_update(self.bot, update)
+        elapsed = time.perf_counter() - started
+        self.latency.add(elapsed)
+        return elapsed
+
+    async def _text(self, user_id, text):
+        return await self._feed(self.client.message_update(user_id, text))
+
+    async def _button(self, user_id, data):
+        return await self._feed(self.client.callback_update(user_id, data))
+
+    # Шаги одного действия; возвращает суммарное время обработки
+    async def _action(self, user_id, name):
+        if name == "start":
+            return (await self._text(user_id, "⏺ Начать трекинг")
+                    + await self._text(user_id, self.random.choice(app.CATEGORIES)))
+        if name == "stop":
+            return await self._text(user_id, "⏹ Завершить трекинг")
+        if name == "stats_day":
+            return await self._text(user_id, "📅 Статистика за день")
+        if name == "stats_week":
+            return await self._text(user_id, "📊 Статистика за неделю")
+        if name == "add":
+            # Только в свободное время: иначе политика пересечений отклоняет или
+            # обрезает почти каждое добавление и замер идёт по пути отказа
+            start = datetime.fromtimestamp(self._free_slot(user_id), get_tz())
+            end = start + timedelta(minutes=45)
+            code = self.random.choice(list(app.CATEGORY_MAPPING))
+            return (await self._text(user_id, "➕ Добавить трекинг")
+                    + await self._button(user_id, f"track_{code}")
+                    + await self._text(user_id, f"{start.day}.{start.month:02d} {start.hour}:{start.minute:02d}")
+                    + await self._text(user_id, f"{end.day}.{end.month:02d} {end.hour}:{end.minute:02d}"))
+        if name == "edit":
+            elapsed = await self._text(user_id, "✏ Изменить трекинг")
+            markup = self.session.markups.get(user_id)
+            if markup is None or not hasattr(markup, "inline_keyboard"):
+                return elapsed
+            button = self.random.choice(markup.inline_keyboard)[0]
+            elapsed += await self._button(user_id, button.callback_data)
+            return elapsed + await self._text(user_id, f"{self.random.randint(0, 23)}:{self.random.randint(0, 59):02d}")
+        raise ValueError(name)
+
+    async def _user(self, user_id, semaphore):
+        names = list(WORKLOAD)
+        weights = list(WORKLOAD.values())
+        async with semaphore:
+            await self._text(user_id, "/start")
+            for name in self.random.choices(names, weights, k=self.actions):
+                self.per_action[name].add(await self._action(user_id, name))
+
+    # Начало свободного часа пользователя: сначала промежутки из истории, потом
+    # часы перед её началом. Каждый час выдаётся один раз, добавления не пересекаются.
+    def _free_slot(self, user_id):
+        gaps = self.gaps.setdefault(user_id, [])
+        if gaps:
+            return gaps.pop(0)
+        self.history_start -= 3600
+        return self.history_start
+
+    # История за seed_days дней, чтобы запросы работали не по пустой базе.
+    # После примерно каждого третьего интервала остаётся свободный час для «add».
+    def _seed(self, conn, first_user):
+        now = int(time.time())
+        rows = []
+        for user_id in range(first_user, first_user + self.users):
+            ts = now - self.seed_days * 86400
+            ts -= ts % 3600
+            while ts < now - 3600:
+                length = self.random.randint(15, 180) * 60
+                category = self.random.choice(app.CATEGORIES)
+                start = datetime.fromtimestamp(ts, timezone.utc).isoformat()
+                end = datetime.fromtimestamp(ts + length, timezone.utc).isoformat()
+                rows.append((user_id, category, start[:10], start, end, length // 60, ts, ts + length))
+                ts += length
+                if self.random.random() < 1 / 3 and ts < now - 3 * 3600:
+                    self.gaps.setdefault(user_id, []).append(ts)
+                    ts += 3600
+        conn.executemany(
+            "INSERT INTO time_logs (user_id, category, date, start_time, end_time, duration, start_ts, end_ts) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        rollup.rebuild(conn)
+        return len(rows)
+
+    async def run(self, db_path, first_user=100000):
+        app.storage.path = db_path
+        await app.on_startup()
+        wrap_timed(app.storage, "read", self.db)
+        wrap_timed(app.storage, "write", self.db)
+        wrap_timed(app.renderer, "render", self.render)
+        # Свободные часы до истории (и до вчерашнего дня, если истории нет)
+        self.history_start = int(time.time()) - max(self.seed_days, 1) * 86400
+        self.history_start -= self.history_start % 3600
+        try:
+            seeded = await app.storage.write(self._seed, first_user) if self.seed_days else 0
+            self.db.clear()
+            semaphore = asyncio.Semaphore(self.concurrency)
+            started = time.perf_counter()
+            await asyncio.gather(*(self._user(user_id, semaphore)
+                                   for user_id in range(first_user, first_user + self.users)))
+            wall = time.perf_counter() - started
+        finally:
+            await app.on_shutdown()
+        return {
+            "config": {
+                "users": self.users,
+                "actions_per_user": self.actions,
+                "concurrency": self.concurrency,
+                "seed_days": self.seed_days,
+                "seeded_rows": seeded,
+                "api_latency_ms": self.session.latency * 1000,
+            },
+            "updates": self.latency.count,
+            "wall_s": round(wall, 3),
+            "throughput_updates_per_s": round(self.latency.count / wall, 1),
+            "latency_ms": self.latency.summary(),
+            "per_action_ms": {name: samples.summary() for name, samples in self.per_action.items()},
+            "db_ms": self.db.summary(),
+            "render_ms": self.render.summary(),
+            "api_calls": dict(self.session.calls),
+            "api_calls_per_update": round(sum(self.session.calls.values()) / max(self.latency.count, 1), 2),
+        }
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# python -m benchmarks.load --users 2000 --actions 10 [--compare benchmarks/results/old.json]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота без сети")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--actions", type=int, default=10, help="действий на пользователя")
+    parser.add_argument("--concurrency", type=int, default=200, help="пользователей одновременно")
+    parser.add_argument("--seed-days", type=int, default=7, help="дней истории у каждого пользователя")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, мс")
+    parser.add_argument("--output", default=None, help="куда сохранить JSON (по умолчанию benchmarks/results/)")
+    parser.add_argument("--compare", default=None, help="JSON прошлого запуска для сравнения")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    benchmark = LoadBenchmark(args.users, args.actions, args.concurrency, args.seed_days, args.api_latency / 1000)
+    with tempfile.TemporaryDirectory() as tmp:
+        result = asyncio.run(benchmark.run(os.path.join(tmp, "bench.db")))
+    result["revision"] = _git_revision()
+    result["timestamp"] = datetime.now().isoformat(timespec="seconds")
+
+    output = args.output or os.path.join("benchmarks", "results", f"load-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(f"updates: {result['updates']}  throughput: {result['throughput_updates_per_s']}/s")
+    print(f"latency ms: {result['latency_ms']}")
+    print(f"db ms: {result['db_ms']}")
+    print(f"render ms: {result['render_ms']}")
+    print(f"api calls: {result['api_calls']}  per update: {result['api_calls_per_update']}")
+    print(f"saved to {output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), result)
@@ -0,0 +1,101 @@
+import argparse
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.filters import Command, StateFilter
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+
+from categories import CATEGORIES
+from fake_telegram import FakeSession, FakeTelegramClient
+from routing import MessageRoutes
+
+BUTTONS = ["⏺ Начать трекинг", "⬅ Назад", "⏹ Завершить трекинг", "📊 Статистика", "➕ Добавить трекинг",
+           "✏ Изменить трекинг", "📅 Статистика за день", "📊 Статистика за неделю"]
+STATES = ["waiting_for_new_tracking_start_time", "waiting_for_new_tracking_end_time",
+          "waiting_for_new_start_time", "waiting_for_new_end_time"]
+
+
+async def _noop(message, state=None):
+    pass
+
+
+def _handler(name):
+    async def handler(message):
+        pass
+    handler.__name__ = name
+    return handler
+
+
+def _state_handler(name):
+    async def handler(message, state):
+        pass
+    handler.__name__ = name
+    return handler
+
+
+# Диспетчер как в bot.py до таблицы маршрутов: lambda-фильтр на каждую кнопку,
+# список категорий, затем StateFilter
+def filter_chain():
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.message.register(_noop, Command("start"))
+    for text in BUTTONS:
+        dp.message.register(_handler(text), lambda message, text=text: message.text == text)
+    dp.message.register(_handler("category"), lambda message: message.text in CATEGORIES)
+    for state in STATES:
+        dp.message.register(_state_handler(state), StateFilter(state))
+    return dp
+
+
+def route_table():
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.message.register(_noop, Command("start"))
+    routes = MessageRoutes()
+    dp.message.register(routes.handle, routes.resolve)
+    for text in BUTTONS:
+        routes.text(text)(_handler(text))
+    routes.text(*CATEGORIES)(_handler("category"))
+    for state in STATES:
+        routes.state(state)(_state_handler(state))
+    return dp
+
+
+# Смесь сообщений: кнопки, категории и ввод времени у пользователей в состоянии FSM
+def _updates(bot, count):
+    client = FakeTelegramClient()
+    texts = BUTTONS + CATEGORIES + ["14:30"] * 4
+    return [Update.model_validate(client.message_update(1000 + i % 100, texts[i % len(texts)]),
+                                  context={"bot": bot}) for i in range(count)]
+
+
+async def _measure(dp, bot, updates, repeat):
+    for user_id in range(1000, 1100, 4):
+        key = StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id)
+        await dp.storage.set_state(key, STATES[user_id % len(STATES)])
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for update in updates:
+            await dp.feed_update(bot, update)
+        best = min(best, (time.perf_counter() - started) / len(updates))
+    return best
+
+
+async def main(count, repeat):
+    bot = Bot(token="123456:benchmark", session=FakeSession())
+    updates = _updates(bot, count)
+    old = await _measure(filter_chain(), bot, updates, repeat)
+    new = await _measure(route_table(), bot, updates, repeat)
+    print(f"filter chain: {old * 1e6:.1f} us/update")
+    print(f"route table:  {new * 1e6:.1f} us/update  ({(new - old) / old * 100:+.1f}%)")
+
+
+# python -m benchmarks.routing [--updates 20000]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Стоимость маршрутизации сообщения: цепочка фильтров против таблицы")
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.updates, args.repeat))
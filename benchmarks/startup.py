@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Код, который выполняется в отдельном интерпретаторе: холодный импорт бота
+# и, при необходимости, первый график. Печатает JSON с замерами.
+CHILD = r"""
+import json, os, sys, time
+started = time.perf_counter()
+{preload}
+import bot
+imported = time.perf_counter() - started
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+result = {{"import_s": imported, "rss_mb": rss_mb(), "matplotlib_loaded": "matplotlib" in sys.modules}}
+if {chart}:
+    import asyncio
+
+    async def first_chart():
+        bot.renderer.start()
+        if {warm_up}:
+            await bot.renderer.warm_up()
+        started = time.perf_counter()
+        png = await bot.renderer.render(("bench",), "render_daily_pie", ["Сон", "Работа"], [480, 300])
+        bot.renderer.close()
+        return time.perf_counter() - started, png is not None
+
+    result["first_chart_s"], result["chart_ok"] = asyncio.run(first_chart())
+print(json.dumps(result))
+"""
+
+# Варианты: как было (pyplot импортируется вместе с ботом) и как стало
+VARIANTS = {
+    "eager (matplotlib.pyplot at import)": {"preload": "import matplotlib.pyplot", "chart": False, "warm_up": False},
+    "lazy": {"preload": "", "chart": False, "warm_up": False},
+    "lazy, first chart cold": {"preload": "", "chart": True, "warm_up": False},
+    "lazy, first chart after warm-up": {"preload": "", "chart": True, "warm_up": True},
+}
+
+
+def run_child(variant):
+    env = dict(os.environ, BOT_TOKEN=os.environ.get("BOT_TOKEN", "123456:benchmark"))
+    output = subprocess.check_output([sys.executable, "-c", CHILD.format(**variant)], env=env, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(repeat):
+    print(f"{'variant':<38}{'import ms':>11}{'RSS MB':>9}{'first chart ms':>16}")
+    for name, variant in VARIANTS.items():
+        runs = [run_child(variant) for _ in range(repeat)]
+        best = min(runs, key=lambda run: run["import_s"])
+        chart = min((run["first_chart_s"] for run in runs), default=None) if variant["chart"] else None
+        chart_text = f"{chart * 1000:.0f}" if chart is not None else "-"
+        print(f"{name:<38}{best['import_s'] * 1000:>11.0f}{best['rss_mb']:>9.1f}{chart_text:>16}")
+
+
+# python -m benchmarks.startup [--repeat 5]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Время импорта бота, память и первый график")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    main(args.repeat)
@@ -0,0 +1,80 @@
+import functools
+import time
+
+
+# Набор замеров в секундах; summary() отдаёт миллисекунды
+class Samples:
+    def __init__(self):
+        self.values = []
+
+    def add(self, seconds):
+        self.values.append(seconds)
+
+    def clear(self):
+        self.values.clear()
+
+    @property
+    def count(self):
+        return len(self.values)
+
+    def percentile(self, p):
+        if not self.values:
+            return 0.0
+        ordered = sorted(self.values)
+        index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self):
+        total = sum(self.values)
+        return {
+            "count": self.count,
+            "total": round(total * 1000, 1),
+            "mean": round(total / self.count * 1000, 3) if self.values else 0.0,
+            "p50": round(self.percentile(50) * 1000, 3),
+            "p95": round(self.percentile(95) * 1000, 3),
+            "p99": round(self.percentile(99) * 1000, 3),
+            "max": round(max(self.values) * 1000, 3) if self.values else 0.0,
+        }
+
+
+# Подменяет асинхронный метод объекта обёрткой, которая пишет время вызова в samples
+def wrap_timed(obj, name, samples):
+    original = getattr(obj, name)
+
+    @functools.wraps(original)
+    async def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await original(*args, **kwargs)
+        finally:
+            samples.add(time.perf_counter() - started)
+
+    setattr(obj, name, timed)
+
+
+# Время выполнения синхронной функции: лучший результат из repeat запусков, секунд
+def best_of(fn, repeat=5, number=1):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+
+# Печатает изменение основных метрик между двумя результатами load.py
+def compare(old, new):
+    rows = [
+        ("throughput/s", old["throughput_updates_per_s"], new["throughput_updates_per_s"]),
+        ("latency p50 ms", old["latency_ms"]["p50"], new["latency_ms"]["p50"]),
+        ("latency p95 ms", old["latency_ms"]["p95"], new["latency_ms"]["p95"]),
+        ("latency p99 ms", old["latency_ms"]["p99"], new["latency_ms"]["p99"]),
+        ("db total ms", old["db_ms"]["total"], new["db_ms"]["total"]),
+        ("render total ms", old["render_ms"]["total"], new["render_ms"]["total"]),
+        ("api calls", sum(old["api_calls"].values()), sum(new["api_calls"].values())),
+    ]
+    print(f"{'metric':<18}{'old (' + str(old.get('revision')) + ')':>18}{'new (' + str(new.get('revision')) + ')':>18}{'change':>10}")
+    for name, before, after in rows:
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{name:<18}{before:>18}{after:>18}{change:>10}")
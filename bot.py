@@ -1,48 +1,35 @@
+import argparse
 import asyncio
 import logging
 import os
-import io
+import time
 from aiogram import Bot, Dispatcher, types, filters
-from aiogram.types import CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, BufferedInputFile, InlineKeyboardMarkup, \
-    InlineKeyboardButton
-from aiogram.filters import Command, StateFilter
+from aiogram.types import CallbackQuery, BufferedInputFile, FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram import F
 from dotenv import load_dotenv
 from datetime import datetime
-import sqlite3
-import matplotlib.pyplot as plt
+import metrics
+from storage_base import open_storage
+from fsm_storage import DatabaseFSMStorage
+from replies import Reply
+from categories import CATEGORIES, CATEGORY_MAPPING
+from keyboards import CATEGORY_MENU, STATS_MENU, TRACK_CATEGORY_MENU, KeyboardSession, main_menu
+from routing import MessageRoutes
+from range_stats import DAILY_BREAKDOWN_DAYS, format_stats, parse_period
+from transfer import FORMATS, IMPORT_MAX_BYTES, export_to_file, import_file
+from outbox import SendScheduler, SendSchedulerMiddleware
+from intervals import OverlapError
+from scheduler import ACTIVE_RESYNC_INTERVAL, AUTO_CLOSE_INTERVAL, DIGEST_HOUR, DIGEST_INTERVAL, Scheduler, close_stale_sessions, send_digests
+from charts import CHART_CACHE_STEP, CHART_WARMUP, ChartCache, ChartRenderer, chart_filename, day_series
+from webhook import run_webhook
+from timeutils import find_tz, from_utc_iso, from_utc_to_tz, local_time_to_utc
 import re
+import tempfile
 import pytz
 
-conn = sqlite3.connect("database.db")  # Подключаемся к базе (файл database.db)
-cursor = conn.cursor()
-
-# Создаём таблицы
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS time_logs (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    category TEXT,
-    date TEXT,
-    start_time TEXT,
-    end_time TEXT,
-    duration INTEGER  -- Длительность в минутах
-)
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS time_tracking (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    category TEXT,
-    start_time TEXT
-)
-""")
-
-conn.commit()  # Сохраняем изменения
-
 # Загружаем токен из переменных среды
 load_dotenv()
 TOKEN = os.getenv('BOT_TOKEN')
@@ -51,65 +38,36 @@ TOKEN = os.getenv('BOT_TOKEN')
 if not TOKEN:
     raise ValueError("BOT_TOKEN is not set in environment variables!")
 
+# Локальный сервер Bot API или заглушка из fake_telegram.py (для проверки без сети)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # polling или webhook
+
 # Настраиваем бота
-bot = Bot(token=TOKEN)
-dp = Dispatcher()
-
-
-CATEGORIES = ["😴 Сон", "🛁 Уход за собой", "💼 Работа", "🏋️‍ Спорт и Здоровье", "👨‍👩‍👧‍👦 Семья и друзья",
-              "🚗 Логистика", "🏡 Домашние дела", "🎮 Развлечения", "📚 Личное развитие", "🐌 Прокрастинация"]
-
-# Словарь для перевода дней недели
-DAYS_TRANSLATION = {
-    "Monday": "Понедельник",
-    "Tuesday": "Вторник",
-    "Wednesday": "Среда",
-    "Thursday": "Четверг",
-    "Friday": "Пятница",
-    "Saturday": "Суббота",
-    "Sunday": "Воскресенье",
-}
-
-CATEGORY_MAPPING = {
-    "selfcare": "🛁 Уход за собой",
-    "work": "💼 Работа",
-    "sport": "🏋️‍ Спорт и Здоровье",
-    "family": "👨‍👩‍👧‍👦 Семья и друзья",
-    "sleep": "😴 Сон",
-    "home": "🏡 Домашние дела",
-    "learning": "📚 Личное развитие",
-    "fun": "🎮 Развлечения",
-    "lazy": "🐌 Прокрастинация",
-    "logistics": "🚗 Логистика"
-}
-
-
-# Переводит datetime Python в строку UTC ISO 8601
-def to_utc_iso(dt):
-    dt_utc = dt.astimezone(pytz.utc)  # Приводим к UTC
-    return dt_utc.isoformat()  # Преобразуем в ISO формат
-
-
-# Переводит строку UTC ISO 8601 в datetime UTC
-def from_utc_iso(utc_str):
-    dt_utc = datetime.fromisoformat(utc_str).replace(tzinfo=pytz.utc)  # Приводим к UTC
-    return dt_utc
-
-
-# Переводит datetime UTC в datetime с локальным часовым поясом
-def from_utc_to_tz(dt):
-    local_tz = os.getenv("TZ", "Asia/Dubai")  # Получаем локальный часовой пояс из переменной среды
-    return dt.astimezone(pytz.timezone(local_tz))  # Переводим в локальный часовой пояс
-
-
-# Переводит местное время в UTC
-def local_time_to_utc(dt):
-    local_tz = os.getenv("TZ", "Asia/Dubai")  # Получаем локальный часовой пояс
-    local_zone = pytz.timezone(local_tz)
-    dt = local_zone.localize(dt)
-    # Переводим в UTC
-    utc_dt = dt.astimezone(pytz.utc)
-    return utc_dt
+session = KeyboardSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else KeyboardSession()
+bot = Bot(token=TOKEN, session=session)
+storage = open_storage()  # SQLite или PostgreSQL по DATABASE_URL
+# Состояния FSM хранятся в той же базе и переживают перезапуск
+fsm_storage = DatabaseFSMStorage(storage)
+dp = Dispatcher(storage=fsm_storage)
+# Все отправки идут через очередь с лимитами Telegram (общим и на чат)
+outbox = SendScheduler()
+bot.session.middleware(SendSchedulerMiddleware(outbox))
+metrics.setup(dp, bot)
+renderer = ChartRenderer()
+chart_cache = ChartCache()
+# Фоновые задачи: закрытие забытых сессий и итоги дня
+scheduler = Scheduler()
+
+for _name, _gauge in storage.gauges().items():
+    metrics.metrics.gauge(_name, _gauge)
+metrics.metrics.gauge("bot_chart_cache_hits_total", lambda: chart_cache.hits)
+metrics.metrics.gauge("bot_chart_cache_misses_total", lambda: chart_cache.misses)
+metrics.metrics.gauge("bot_chart_cache_bytes", lambda: chart_cache.size)
+metrics.metrics.gauge("bot_chart_renders_rejected_total", lambda: renderer.rejected)
+metrics.metrics.gauge("bot_chart_renders_timed_out_total", lambda: renderer.timeouts)
+metrics.metrics.gauge("bot_chart_renders_coalesced_total", lambda: renderer.coalesced)
+metrics.metrics.gauge("bot_send_queue_depth", lambda: outbox.depth)
+metrics.metrics.gauge("bot_scheduler_failures_total", lambda: scheduler.failures)
 
 
 # Функция для удаления эмодзи из строки.
@@ -117,251 +75,219 @@ def remove_emojis(text):
     return re.sub(r'[^\w\s,]', '', text)
 
 
-# Функция для форматирования процентов. Скрывает проценты < 1%
-def autopct_func(pct, allvalues):
-    if pct < 1:
-        return ''
-    else:
-        return f'{pct:.0f}%'  # Округляем до целого числа
+# Секунды эпохи -> местное время пользователя для сообщений
+def format_ts(ts, tz=None):
+    return from_utc_to_tz(datetime.fromtimestamp(ts, pytz.utc), tz).strftime("%d.%m.%Y %H:%M")
 
 
-# Функция для создания главного меню
-def get_main_menu(has_active_tracking: bool):
-    keyboard = []
-    if has_active_tracking:
-        keyboard.append([
-            KeyboardButton(text="⏺ Начать трекинг"),KeyboardButton(text="⏹ Завершить трекинг")
-        ])
-    else:
-        keyboard.append([
-            KeyboardButton(text="⏺ Начать трекинг")
-        ])
-    keyboard.append([
-        KeyboardButton(text="➕ Добавить трекинг"), KeyboardButton(text="✏ Изменить трекинг")
-    ])
-    keyboard.append([KeyboardButton(text="📊 Статистика")])
+# Сообщение о пересечении с уже записанными интервалами (intervals.OverlapError)
+def overlap_text(error, tz=None):
+    lines = ["⚠ Это время пересекается с уже записанным:"]
+    for category, start_ts, end_ts in error.conflicts[:5]:
+        end_text = format_ts(end_ts, tz) if end_ts is not None else "сейчас (идёт трекинг)"
+        lines.append(f"• {category}: {format_ts(start_ts, tz)} – {end_text}")
+    return "\n".join(lines)
 
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
 
+# Обработчик команды /start
+@dp.message(Command("start"))
+async def start_command(message: types.Message):
+    user_id = message.from_user.id
+    has_active_tracking = await storage.check_active_tracking(user_id)
+    await message.answer("Выберите действие:", reply_markup=main_menu(has_active_tracking))
 
-# Проверяет наличие активного треккинга
-def check_active_tracking(user_id):
-    cursor.execute("SELECT COUNT(*) FROM time_tracking WHERE user_id = ?", (user_id,))
-    count = cursor.fetchone()[0]
-    return count > 0
-
-
-# Создает меню категорий
-def get_category_menu(categories):
-    keyboard = []
-    # Группируем по две кнопки в ряд
-    for i in range(0, len(categories), 2):
-        row = categories[i:i + 2]  # Берём 2 элемента
-        keyboard.append([KeyboardButton(text=cat) for cat in row])  # Создаём строку
-
-    # Добавляем кнопку "Назад" в отдельную строку
-    keyboard.append([KeyboardButton(text="⬅ Назад")])
 
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+# Выгрузка истории: /export или /export json
+@dp.message(Command("export"))
+async def export_command(message: types.Message, command: CommandObject):
+    fmt = (command.args or "csv").strip().lower()
+    if fmt not in FORMATS:
+        await message.answer("Формат выгрузки: /export csv или /export json")
+        return
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        count = await export_to_file(storage, message.from_user.id, path, fmt)
+        if not count:
+            await message.answer("У тебя пока нет записей для выгрузки.")
+        else:
+            # Файл отправляется с диска по частям, в память целиком не читается
+            await message.answer_document(FSInputFile(path, filename=f"time_logs.{fmt}"),
+                                          caption=f"📤 Записей: {count}")
+    finally:
+        os.remove(path)
 
 
-# Создает меню статистики
-def get_stats_menu():
-    keyboard = [[KeyboardButton(text="📅 Статистика за день"), KeyboardButton(text="📊 Статистика за неделю")],
-                [KeyboardButton(text="⬅ Назад")]]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+# Загрузка истории из файла CSV/JSON: файл с подписью /import или /import, затем файл
+@dp.message(Command("import"))
+async def import_command(message: types.Message, state: FSMContext):
+    if message.document:
+        await import_document(message, state)
+        return
+    await message.answer("Пришли файл .csv или .json с колонками category, start_time, end_time "
+                         "(как в /export). Время — ISO 8601 или DD.MM.YYYY HH:MM по местному времени.")
+    await state.set_state("waiting_for_import_file")
 
 
-# Обработчик команды /start
-@dp.message(Command("start"))
-async def start_command(message: types.Message):
-    user_id = message.from_user.id
-    has_active_tracking = check_active_tracking(user_id)
-    await message.answer("Выберите действие:", reply_markup=get_main_menu(has_active_tracking))
+# Статистика за период: /stats month|quarter|year|week или /stats 01.01-31.03
+@dp.message(Command("stats"))
+async def stats_command(message: types.Message, command: CommandObject):
+    today = datetime.now(storage.tz(message.from_user.id)).date()
+    try:
+        first_day, last_day = parse_period(command.args, today)
+    except ValueError as e:
+        await message.answer(f"{e}. Например: /stats month или /stats 01.01-31.03")
+        return
+    await send_range_stats(message, first_day, last_day)
 
 
-def start_tracking(user_id, category):
-    now = to_utc_iso(datetime.now())  # Записываем текущее время в ISO формате
-    cursor.execute("INSERT INTO time_tracking (user_id, category, start_time) VALUES (?, ?, ?)",
-                   (user_id, category, now))
-    conn.commit()
+# Итоги дня: /digest — присылать в DIGEST_HOUR, /digest 21 — в 21:00, /digest off — не присылать
+@dp.message(Command("digest"))
+async def digest_command(message: types.Message, command: CommandObject):
+    arg = (command.args or "").strip().lower()
+    if arg in ("off", "выкл", "нет"):
+        await storage.set_digest(message.from_user.id, None)
+        await message.answer("Итоги дня больше не будут приходить.")
+        return
+    try:
+        hour = int(arg) if arg else DIGEST_HOUR
+        if not 0 <= hour <= 23:
+            raise ValueError
+    except ValueError:
+        await message.answer("Час — число от 0 до 23. Например: /digest 21 или /digest off")
+        return
+    await storage.set_digest(message.from_user.id, hour)
+    await message.answer(f"🌙 Итоги дня будут приходить в {hour}:00. Отключить: /digest off")
 
 
-def stop_tracking(user_id):
-    cursor.execute("SELECT category, start_time FROM time_tracking WHERE user_id = ? ORDER BY id DESC LIMIT 1",
-                   (user_id,))
-    row = cursor.fetchone()  # Берём последнюю запись
+# Часовой пояс: /tz — показать, /tz Europe/Moscow — сменить, /tz default — пояс по умолчанию
+@dp.message(Command("tz"))
+async def tz_command(message: types.Message, command: CommandObject):
+    user_id = message.from_user.id
+    arg = (command.args or "").strip()
+    if arg:
+        reset = arg.lower() in ("default", "сброс")
+        name = None if reset else find_tz(arg)
+        if name is None and not reset:
+            await message.answer("Не знаю такого пояса. Укажи его как Регион/Город, например: /tz Europe/Moscow")
+            return
+        # Даты прошлых записей и дневные итоги пересчитываются в новом поясе
+        await storage.set_timezone(user_id, name)
+    tz = storage.tz(user_id)
+    text = f"🌍 Часовой пояс: {tz.zone} (сейчас {datetime.now(tz).strftime('%H:%M')})."
+    if not arg:
+        text += "\nСменить: /tz Europe/Moscow"
+    await message.answer(text)
+
+
+# Отправляет ответ с графиком. cache_key[0] — вид графика. Пока ключ не изменился,
+# график отправляется по file_id; иначе рисуется в пуле процессов. Если очередь
+# переполнена или отрисовка не уложилась в таймаут, уходит только текст.
+async def send_with_chart(message, reply, cache_key, name, *args):
+    cached = chart_cache.get(cache_key)
+    if cached is not None and cached.file_id is not None:
+        reply.attach_photo(cached.file_id)
+    else:
+        chart = cached.data if cached is not None else None
+        if chart is None:
+            chart = await renderer.render(cache_key, name, *args)
+            if chart is not None:
+                chart_cache.put(cache_key, chart)
+        if chart is not None:
+            reply.attach_photo(BufferedInputFile(chart, filename=chart_filename(cache_key[0])))
+    sent = await reply.send(message)
+    if reply.photo is not None and sent.photo:
+        chart_cache.set_file_id(cache_key, sent.photo[-1].file_id)
+    return sent
+
+
+# Шаг времени для ключа кеша графиков, в которые входит сегодняшний день
+def cache_step():
+    return int(time.time()) // (60 * CHART_CACHE_STEP)
+
+
+# Статистика за период; для нескольких дней с графиком: до месяца — столбцы по дням, дольше — динамика
+async def send_range_stats(message, first_day, last_day):
+    user_id = message.from_user.id
+    stats = await storage.get_range_stats(user_id, first_day, last_day)
+    has_active_tracking = await storage.check_active_tracking(user_id)
+    reply = Reply(format_stats(stats), parse_mode="Markdown").menu(main_menu(has_active_tracking))
+    days = (last_day - first_day).days + 1
+    if days == 1 or not stats.totals:
+        await reply.send(message)
+        return
+    today = datetime.now(storage.tz(user_id)).date()
+    cache_key = ("range", user_id, first_day, last_day, storage.data_version(user_id),
+                 cache_step() if last_day >= today else 0)
+    name = "render_stacked_days" if days <= DAILY_BREAKDOWN_DAYS else "render_trend"
+    await send_with_chart(message, reply, cache_key, name,
+                          *day_series([(f"{day:%d.%m}", values) for day, values in stats.by_day()]))
 
-    if row:
-        category, start_time = row
-        start = start_time
-        start_time = from_utc_iso(start_time)
-        now = datetime.now().astimezone(pytz.utc)
-        end = to_utc_iso(now)
-        duration = now - start_time
-        minutes = round(duration.total_seconds() / 60)
-
-        # **Сохраняем в таблицу статистики**
-        date = datetime.now().strftime("%Y-%m-%d")  # Дата в формате YYYY-MM-DD
-        cursor.execute(
-            "INSERT INTO time_logs (user_id, category, date, start_time, end_time, duration) VALUES (?, ?, ?, ?, ?, ?)",
-            (user_id, category, date, start, end, minutes))
-        conn.commit()
-
-        # Удаляем запись из `time_tracking`, чтобы активность считалась завершённой
-        cursor.execute("DELETE FROM time_tracking WHERE user_id = ?", (user_id,))
-        conn.commit()
-
-        return category, minutes
-    return None, None
-
-
-# статистика за день по категориям
-def get_daily_stats(user_id):
-    date = datetime.now().strftime("%Y-%m-%d")
-    local_tz = pytz.timezone(os.getenv("TZ", "Asia/Dubai"))
-    midnight_local = datetime.now(local_tz).replace(hour=0, minute=0, second=0, microsecond=0)
-    midnight_utc = midnight_local.astimezone(pytz.utc)
-    now_utc = datetime.now(pytz.utc)
-    total_for_now = int((now_utc - midnight_utc).total_seconds()//60)
-    cursor.execute("""
-        SELECT category, SUM(duration) FROM time_logs 
-        WHERE user_id = ? AND date = ? 
-        GROUP BY category
-    """, (user_id, date))
-
-    rows = cursor.fetchall()
-    cursor.execute("""
-            SELECT category, start_time, end_time, duration FROM time_logs 
-            WHERE user_id = ? AND date = ? ORDER BY end_time LIMIT 1
-        """, (user_id, date))
-
-    category_sleep, start_time_sleep, end_time_sleep, duration_sleep = cursor.fetchone()
-    sleep_before_midnight = 0
-
-    start_time_sleep = from_utc_iso(start_time_sleep)
-    end_time_sleep = from_utc_iso(end_time_sleep)
-
-    if category_sleep == "😴 Сон":
-        if start_time_sleep < midnight_utc < end_time_sleep:
-            sleep_before_midnight = (midnight_utc-start_time_sleep).total_seconds() / 60  # Время сна после 00:00
-            sleep_before_midnight = max(0, round(sleep_before_midnight))
-
-    total_tracked = sum(duration for _, duration in rows)
-
-    # Вычисляем "без трекинга" до текущего момента
-    untracked_minutes = total_for_now - total_tracked + sleep_before_midnight
-
-    # Добавляем "Без трекинга"
-    rows.append(("🕰 Без трекинга", untracked_minutes))
-    return rows
-
-
-# статистика за неделю по категориям
-def get_weekly_stats(user_id):
-    cursor.execute("""
-        SELECT date, category, SUM(duration) FROM time_logs 
-        WHERE user_id = ? AND date >= date('now', '-6 days')
-        GROUP BY date, category
-        ORDER BY date
-    """, (user_id,))
-
-    rows = cursor.fetchall()
-
-    # Группируем по дням недели
-    stats_by_day = {}
-    for date, category, duration in rows:
-        weekday = datetime.strptime(date, "%Y-%m-%d").strftime("%A")
-        weekday_ru = DAYS_TRANSLATION[weekday]  # Переводим на русский
-        if weekday_ru not in stats_by_day:
-            stats_by_day[weekday_ru] = {}
-        stats_by_day[weekday_ru][category] = duration
-
-    # Добавляем "Без трекинга" на каждый день
-    for weekday in stats_by_day.keys():
-        total_tracked = sum(stats_by_day[weekday].values())
-        today = DAYS_TRANSLATION[datetime.now().strftime("%A")]
-
-        if weekday != today:
-            untracked_minutes = max(1440 - total_tracked, 0)
-        else:
-            now = from_utc_to_tz(datetime.now().astimezone(pytz.utc))
-            untracked_minutes = now.hour * 60 + now.minute
-            untracked_minutes = max(untracked_minutes-total_tracked, 0)
-        stats_by_day[weekday]["🕰 Без трекинга"] = untracked_minutes
 
-    return stats_by_day
+# Остальные сообщения: кнопки и состояния FSM ищутся по словарю, а не перебором
+# фильтров. Регистрируется после команд, чтобы они работали в любом состоянии.
+routes = MessageRoutes()
+dp.message.register(routes.handle, routes.resolve)
 
 
 # Обработчик нажатия на кнопку ⏺ Начать трекинг
-@dp.message(lambda message: message.text == "⏺ Начать трекинг")
+@routes.text("⏺ Начать трекинг")
 async def start_tracking_menu(message: types.Message):
-    await message.answer("Выберите категорию:", reply_markup=get_category_menu(CATEGORIES))
+    await message.answer("Выберите категорию:", reply_markup=CATEGORY_MENU)
 
 
 # Обработчик нажатия на кнопку ⬅ Назад
-@dp.message(lambda message: message.text == "⬅ Назад")
-async def back_to_menu(message: types.Message):
+@routes.text("⬅ Назад")
+async def back_to_menu(message: types.Message, state: FSMContext):
+    await state.clear()  # «⬅ Назад» выводит из любого сценария (импорт предлагает её сам)
     user_id = message.from_user.id
-    has_active_tracking = check_active_tracking(user_id)
-    await message.answer("Главное меню:", reply_markup=get_main_menu(has_active_tracking))
+    has_active_tracking = await storage.check_active_tracking(user_id)
+    await message.answer("Главное меню:", reply_markup=main_menu(has_active_tracking))
 
 
 # Обработчик нажатия на кнопку ⏹ Завершить трекинг
-@dp.message(lambda message: message.text == "⏹ Завершить трекинг")
+@routes.text("⏹ Завершить трекинг")
 async def stop_tracking_handler(message: types.Message):
     user_id = message.from_user.id
-    category, minutes = stop_tracking(user_id)
+    category, minutes = await storage.stop_tracking(user_id)
     if category:
-        await message.answer(f"⏳ Ты потратил {minutes} мин на {category}.", parse_mode="Markdown")
+        reply = Reply(f"⏳ Ты потратил {minutes} мин на {category}.", parse_mode="Markdown")
     else:
-        await message.answer("Нет активного трекинга.")
-    has_active_tracking = check_active_tracking(user_id)
-    await message.answer("Главное меню:", reply_markup=get_main_menu(has_active_tracking))
+        reply = Reply("Нет активного трекинга.")
+    has_active_tracking = await storage.check_active_tracking(user_id)
+    await reply.menu(main_menu(has_active_tracking)).send(message)
 
 
 # Обработчик нажатия на кнопку 📊 Статистика
-@dp.message(lambda message: message.text == "📊 Статистика")
+@routes.text("📊 Статистика")
 async def show_stats_menu(message: types.Message):
-    await message.answer("Выберите нужную статистику:", reply_markup=get_stats_menu())
+    await message.answer("Выберите нужную статистику:", reply_markup=STATS_MENU)
 
 
 # Обработчик нажатия на кнопку категории
-@dp.message(lambda message: message.text in CATEGORIES)
+@routes.text(*CATEGORIES)
 async def track_time(message: types.Message):
     user_id = message.from_user.id  # Получаем ID пользователя
     category = message.text
 
     # Проверяем, была ли активность
-    old_category, minutes = stop_tracking(user_id)
+    old_category, minutes = await storage.stop_tracking(user_id)
 
+    reply = Reply()
     if old_category:
-        await message.answer(f"⏳ Ты потратил {minutes} мин на {old_category}.")
+        reply.add(f"⏳ Ты потратил {minutes} мин на {old_category}.")
 
     # Запускаем новую активность
-    start_tracking(user_id, category)
-    await message.answer(f"✅ Начат трекинг: {category}")
-    has_active_tracking = check_active_tracking(user_id)
-    await message.answer("Главное меню:", reply_markup=get_main_menu(has_active_tracking))
+    await storage.start_tracking(user_id, category)
+    reply.add(f"✅ Начат трекинг: {category}")
+    has_active_tracking = await storage.check_active_tracking(user_id)
+    await reply.menu(main_menu(has_active_tracking)).send(message)
 
 
 # Добавляет не отмеченный трек в прошлом
-@dp.message(lambda message: message.text == "➕ Добавить трекинг")
+@routes.text("➕ Добавить трекинг")
 async def add_past_tracking(message: types.Message):
-    user_id = message.from_user.id
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🛁 Уход за собой", callback_data=f"track_selfcare_{user_id}"),
-         InlineKeyboardButton(text="💼 Работа", callback_data=f"track_work_{user_id}")],
-        [InlineKeyboardButton(text="🏋️‍ Спорт и Здоровье", callback_data=f"track_sport_{user_id}"),
-         InlineKeyboardButton(text="👨‍👩‍👧‍👦 Семья и друзья", callback_data=f"track_family_{user_id}")],
-        [InlineKeyboardButton(text="😴 Сон", callback_data=f"track_sleep_{user_id}"),
-         InlineKeyboardButton(text="🏡 Домашние дела", callback_data=f"track_home_{user_id}")],
-        [InlineKeyboardButton(text="📚 Личное развитие", callback_data=f"track_learning_{user_id}"),
-         InlineKeyboardButton(text="🎮 Развлечения", callback_data=f"track_fun_{user_id}")],
-        [InlineKeyboardButton(text="🐌 Прокрастинация", callback_data=f"track_lazy_{user_id}"),
-         InlineKeyboardButton(text="🚗 Логистика", callback_data=f"track_logistics_{user_id}")],
-    ])
-    await message.answer("Выбери категорию: ", reply_markup=keyboard)
+    await message.answer("Выбери категорию: ", reply_markup=TRACK_CATEGORY_MENU)
 
 
 # Колбэк выбора категории для добавления старого трека
@@ -370,8 +296,9 @@ async def add_past_tracking_by_category(callback: CallbackQuery, state: FSMConte
     category = callback.data.split("_")[1]
     try:
         category = CATEGORY_MAPPING.get(category)
-        user_id = callback.data.split("_")[2]
-        await callback.message.answer("Введи время и дату начала в формате DD.MM HH:MM:")
+        user_id = callback.from_user.id
+        # Заменяем сообщение с кнопками категорий, чтобы их нельзя было нажать повторно
+        await Reply(f"{category}\nВведи время и дату начала в формате DD.MM HH:MM:").edit(callback)
         await state.update_data(category=category, user_id=user_id)
         await state.set_state("waiting_for_new_tracking_start_time")
     except ValueError:
@@ -379,7 +306,7 @@ async def add_past_tracking_by_category(callback: CallbackQuery, state: FSMConte
 
 
 # Обработка времени старта трекинга в прощшлом
-@dp.message(StateFilter("waiting_for_new_tracking_start_time"))
+@routes.state("waiting_for_new_tracking_start_time")
 async def process_new_tracking_start_time(message: types.Message, state: FSMContext):
     try:
         date, hours = message.text.split()
@@ -387,7 +314,7 @@ async def process_new_tracking_start_time(message: types.Message, state: FSMCont
         day, month = map(int, date.split("."))
         now_utc = datetime.now().astimezone(pytz.utc)
         date = datetime(now_utc.year, month, day, hour, minute)
-        date_utc = local_time_to_utc(date)
+        date_utc = local_time_to_utc(date, storage.tz(message.from_user.id))
         if date_utc > now_utc:
             await message.answer("Ошибка: Время не может быть позже настоящего момента! Попробуйте еще раз.")
             return
@@ -400,7 +327,7 @@ async def process_new_tracking_start_time(message: types.Message, state: FSMCont
 
 
 # Обработка времени окончания трекинга в прошлом
-@dp.message(StateFilter("waiting_for_new_tracking_end_time"))
+@routes.state("waiting_for_new_tracking_end_time")
 async def process_new_tracking_end_time(message: types.Message, state: FSMContext):
     try:
         date, hours = message.text.split()
@@ -411,45 +338,70 @@ async def process_new_tracking_end_time(message: types.Message, state: FSMContex
         user_id = data["user_id"]
         start_time = data["start_time"]
         now = datetime.now().astimezone(pytz.utc)
-        end_time = local_time_to_utc(datetime(now.year, month, day, hour, minute))
+        tz = storage.tz(user_id)
+        end_time = local_time_to_utc(datetime(now.year, month, day, hour, minute), tz)
         if end_time > now or start_time > end_time:
             await message.answer(
                 "Ошибка: Время не может быть позже настоящего момента и раньше времени старта! Попробуйте еще раз.")
             return
         else:
-            start_time_str = from_utc_to_tz(start_time).strftime("%d.%m.%Y %H:%M")
-            end_time_str = from_utc_to_tz(end_time).strftime("%d.%m.%Y %H:%M")
             start_time_iso = start_time.isoformat()
             end_time_iso = end_time.isoformat()
-            date = end_time.strftime("%Y-%m-%d")
-            duration = round((end_time - start_time).total_seconds() / 60)
-            cursor.execute(
-                "INSERT INTO time_logs (user_id, category, date, start_time, end_time, duration) VALUES (?, ?, ?, ?, ?, ?)",
-                (user_id, category, date, start_time_iso, end_time_iso, duration),
-            )
-            conn.commit()
-            await message.answer(
-                f"Новый треккинг категории *{category}* успешно добавлен! 🎉\n"
-                f"📌 Время начала: {start_time_str}\n"
-                f"📌 Время окончания: {end_time_str}",
-                parse_mode="Markdown"
-            )
             await state.clear()
-            has_active_tracking = check_active_tracking(user_id)
-            await message.answer("Главное меню:", reply_markup=get_main_menu(has_active_tracking))
+            try:
+                pieces = await storage.add_tracking(user_id, category, start_time_iso, end_time_iso)
+            except OverlapError as e:
+                has_active_tracking = await storage.check_active_tracking(user_id)
+                await Reply(overlap_text(e, tz)).add("Трекинг не добавлен.").menu(
+                    main_menu(has_active_tracking)).send(message)
+                return
+            lines = [f"Новый треккинг категории *{category}* успешно добавлен! 🎉"]
+            if len(pieces) == 1:
+                lines.append(f"📌 Время начала: {format_ts(pieces[0][0], tz)}")
+                lines.append(f"📌 Время окончания: {format_ts(pieces[0][1], tz)}")
+            else:
+                lines.extend(f"📌 {format_ts(start_ts, tz)} – {format_ts(end_ts, tz)}" for start_ts, end_ts in pieces)
+            if pieces != [(int(start_time.timestamp()), int(end_time.timestamp()))]:
+                lines.append("⚠ Время, которое уже было занято другими записями, пропущено.")
+            has_active_tracking = await storage.check_active_tracking(user_id)
+            await Reply("\n".join(lines), parse_mode="Markdown").menu(main_menu(has_active_tracking)).send(message)
     except ValueError:
         await message.answer("Неверный формат! Попробуй еще раз (пример: 7.02 14:30).")
 
 
+# Файл для /import
+@routes.state("waiting_for_import_file")
+async def import_document(message: types.Message, state: FSMContext):
+    document = message.document
+    fmt = os.path.splitext(document.file_name or "")[1].lstrip(".").lower() if document else None
+    if fmt not in FORMATS:
+        await message.answer("Нужен файл .csv или .json. Пришли файл или нажми ⬅ Назад.")
+        return
+    await state.clear()
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await message.answer(f"Файл больше {IMPORT_MAX_BYTES // (1024 * 1024)} МБ, раздели его на части.")
+        return
+    user_id = message.from_user.id
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        await bot.download(document, destination=path)
+        report = await import_file(storage, user_id, path, fmt)
+        text = report.text()
+    except ValueError as e:
+        text = f"Не удалось прочитать файл: {e}"
+    finally:
+        os.remove(path)
+    has_active_tracking = await storage.check_active_tracking(user_id)
+    await message.answer(text, reply_markup=main_menu(has_active_tracking))
+
+
 # Меняет время старта / окончания последней деятельности
-@dp.message(lambda message: message.text == "✏ Изменить трекинг")
+@routes.text("✏ Изменить трекинг")
 async def edit_last_tracking(message: types.Message):
     user_id = message.from_user.id
     # Получаем последний трекинг пользователя
-    cursor.execute(
-        "SELECT id, category, start_time, end_time, date FROM time_logs WHERE user_id = ? ORDER BY start_time DESC LIMIT 1",
-        (user_id,))
-    last_tracking = cursor.fetchone()
+    last_tracking = await storage.get_last_tracking(user_id)
 
     if not last_tracking:
         await message.answer("У тебя пока нет записей для редактирования.")
@@ -461,8 +413,9 @@ async def edit_last_tracking(message: types.Message):
         [InlineKeyboardButton(text="Изменить начало", callback_data=f"edit_start_{tracking_id}_{date}_{end_time}")],
         [InlineKeyboardButton(text="Изменить окончание", callback_data=f"edit_end_{tracking_id}_{date}_{start_time}")]
     ])
-    start_time_text = from_utc_to_tz(from_utc_iso(start_time)).strftime("%d.%m.%Y %H:%M")
-    end_time_text = from_utc_to_tz(from_utc_iso(end_time)).strftime("%d.%m.%Y %H:%M")
+    tz = storage.tz(user_id)
+    start_time_text = from_utc_to_tz(from_utc_iso(start_time), tz).strftime("%d.%m.%Y %H:%M")
+    end_time_text = from_utc_to_tz(from_utc_iso(end_time), tz).strftime("%d.%m.%Y %H:%M")
     await message.answer(
         f"Твой последний трекинг:\n"
         f"📌 Категория: {category}\n"
@@ -479,7 +432,7 @@ async def edit_start_time(callback: CallbackQuery, state: FSMContext):
     tracking_id = callback.data.split("_")[2]
     date = callback.data.split("_")[3]
     end_time = callback.data.split("_")[4]
-    await callback.message.answer("Введи новое время начала в формате HH:MM:")
+    await Reply("Введи новое время начала в формате HH:MM:").edit(callback)
     await state.update_data(tracking_id=tracking_id, date=date, end_time=end_time)
     await state.set_state("waiting_for_new_start_time")
 
@@ -489,13 +442,13 @@ async def edit_end_time(callback: CallbackQuery, state: FSMContext):
     tracking_id = callback.data.split("_")[2]
     date = callback.data.split("_")[3]
     start_time = callback.data.split("_")[4]
-    await callback.message.answer("Введи новое время окончания в формате HH:MM:")
+    await Reply("Введи новое время окончания в формате HH:MM:").edit(callback)
     await state.update_data(tracking_id=tracking_id, date=date, start_time=start_time)
     await state.set_state("waiting_for_new_end_time")
 
 
 # Ожидание нового времени старта и окончания прошлого трекинга
-@dp.message(StateFilter("waiting_for_new_start_time"))
+@routes.state("waiting_for_new_start_time")
 async def process_new_start_time(message: types.Message, state: FSMContext):
     try:
         new_hour, new_minute = map(int, message.text.split(":"))
@@ -504,28 +457,26 @@ async def process_new_start_time(message: types.Message, state: FSMContext):
         date = data["date"]
         end_time = from_utc_iso(data["end_time"])
         new_start_time = datetime.strptime(date, "%Y-%m-%d").replace(hour=new_hour, minute=new_minute)
-        new_start_time = local_time_to_utc(new_start_time)
+        user_id = message.from_user.id
+        tz = storage.tz(user_id)
+        new_start_time = local_time_to_utc(new_start_time, tz)
         if end_time < new_start_time:
             await message.answer("Ошибка: Время финиша не может быть раньше старта! Попробуйте еще раз.")
         else:
             new_time_iso = new_start_time.isoformat()
-            duration = end_time - new_start_time
-            minutes = round(duration.total_seconds() / 60)
-            cursor.execute("UPDATE time_logs SET start_time = ?, duration = ? WHERE id = ?",
-                           (new_time_iso, minutes, tracking_id))
-            conn.commit()
-
-            new_time_str = from_utc_to_tz(new_start_time).strftime("%d.%m.%Y %H:%M")
-            await message.answer(f"✅ Время начала изменено на {new_time_str}.")
             await state.clear()
-            user_id = message.from_user.id
-            has_active_tracking = check_active_tracking(user_id)
-            await message.answer("Главное меню:", reply_markup=get_main_menu(has_active_tracking))
+            try:
+                saved = await storage.update_start_time(user_id, tracking_id, new_time_iso)
+                reply = Reply(f"✅ Время начала изменено на {format_ts(saved[0], tz)}." if saved else "Запись не найдена.")
+            except OverlapError as e:
+                reply = Reply(overlap_text(e, tz)).add("Время не изменено.")
+            has_active_tracking = await storage.check_active_tracking(user_id)
+            await reply.menu(main_menu(has_active_tracking)).send(message)
     except ValueError:
         await message.answer("Неверный формат! Попробуй еще раз (пример: 14:30).")
 
 
-@dp.message(StateFilter("waiting_for_new_end_time"))
+@routes.state("waiting_for_new_end_time")
 async def process_new_end_time(message: types.Message, state: FSMContext):
     try:
         new_hour, new_minute = map(int, message.text.split(":"))
@@ -534,34 +485,33 @@ async def process_new_end_time(message: types.Message, state: FSMContext):
         date = data["date"]
         start_time = from_utc_iso(data["start_time"])
         new_end_time = datetime.strptime(date, "%Y-%m-%d").replace(hour=new_hour, minute=new_minute)
-        new_end_time = local_time_to_utc(new_end_time)
+        user_id = message.from_user.id
+        tz = storage.tz(user_id)
+        new_end_time = local_time_to_utc(new_end_time, tz)
         if new_end_time < start_time:
             await message.answer("Ошибка: Время финиша не может быть раньше старта! Попробуйте еще раз.")
         else:
             new_time_iso = new_end_time.isoformat()
-            duration = new_end_time - start_time
-            minutes = round(duration.total_seconds() / 60)
-            cursor.execute("UPDATE time_logs SET end_time = ?, duration = ? WHERE id = ?",
-                           (new_time_iso, minutes, tracking_id))
-            conn.commit()
-            new_time_str = from_utc_to_tz(new_end_time).strftime("%d.%m.%Y %H:%M")
-            await message.answer(f"✅ Время окончания изменено на {new_time_str}.")
             await state.clear()
-            user_id = message.from_user.id
-            has_active_tracking = check_active_tracking(user_id)
-            await message.answer("Главное меню:", reply_markup=get_main_menu(has_active_tracking))
+            try:
+                saved = await storage.update_end_time(user_id, tracking_id, new_time_iso)
+                reply = Reply(f"✅ Время окончания изменено на {format_ts(saved[1], tz)}." if saved else "Запись не найдена.")
+            except OverlapError as e:
+                reply = Reply(overlap_text(e, tz)).add("Время не изменено.")
+            has_active_tracking = await storage.check_active_tracking(user_id)
+            await reply.menu(main_menu(has_active_tracking)).send(message)
 
     except ValueError:
         await message.answer("Неверный формат! Попробуй еще раз (пример: 15:45).")
 
 
 # Обработчик нажатия на кнопку 📅 Статистика за день
-@dp.message(lambda message: message.text == "📅 Статистика за день")
+@routes.text("📅 Статистика за день")
 async def show_stats_day(message: types.Message):
     user_id = message.from_user.id
 
     # Получаем статистику
-    daily_stats = get_daily_stats(user_id)
+    daily_stats = await storage.get_daily_stats(user_id)
     categories = []
     durations = []
 
@@ -574,52 +524,28 @@ async def show_stats_day(message: types.Message):
         await message.answer("Нет данных для построения графика.")
         return
 
-    # Создаем график
-    fig, ax = plt.subplots(figsize=(8, 8))
-    wedges, texts, autotexts = ax.pie(durations, autopct=lambda pct: autopct_func(pct, durations), startangle=90,
-                                      colors=plt.cm.Paired.colors)
-    # Добавляем легенду внизу графика
-    ax.legend(wedges, categories, title="Категории", loc="lower center", fontsize=10, bbox_to_anchor=(0.5, -0.3),
-              ncol=3)
-    # Равные оси для круга
-    ax.axis('equal')
-    ax.set_title('Распределение времени по категориям за день')
-
-    # Сохраняем график в буфер
-    buf = io.BytesIO()
-    try:
-        plt.savefig(buf, format='png', bbox_inches='tight')
-        buf.seek(0)  # Перемещаем курсор к началу буфера
-    except Exception as e:
-        await message.answer(f"Ошибка при создании графика: {e}")
-        return
-
-    # Создаем InputFile из буфера
-    image = BufferedInputFile(buf.getvalue(), filename="daily_stats.png")
-    # Отправляем изображение в Telegram
-    try:
-        await message.answer_photo(photo=image)
-    except Exception as e:
-        await message.answer(f"Ошибка при отправке изображения: {e}")
-    finally:
-        plt.close()  # Закрываем график, чтобы не занимать память
+    # Ключ кеша: пользователь, локальная дата, версия данных и прошедшие с полуночи
+    # минуты с шагом CHART_CACHE_STEP (растут «Без трекинга» и идущий трекинг). Пока ничего не изменилось, график отправляется по file_id.
+    today = datetime.now(storage.tz(user_id)).strftime("%Y-%m-%d")
+    cache_key = ("day", user_id, today, storage.data_version(user_id), sum(durations) // CHART_CACHE_STEP)
 
     # Форматируем вывод
     daily_text = "\n".join([f"📌 {cat}: {mins // 60} ч {mins % 60} мин" for cat, mins in daily_stats]) or "Нет данных"
 
     text = (f"📊 *Статистика за сегодня:*\n{daily_text}")
 
-    await message.answer(text, parse_mode="Markdown")
-    has_active_tracking = check_active_tracking(user_id)
-    await message.answer("Главное меню:", reply_markup=get_main_menu(has_active_tracking))
+    # График, статистика и клавиатура уходят одним сообщением: текст — подпись к фото
+    has_active_tracking = await storage.check_active_tracking(user_id)
+    reply = Reply(text, parse_mode="Markdown").menu(main_menu(has_active_tracking))
+    await send_with_chart(message, reply, cache_key, "render_daily_pie", categories, durations)
 
 
 # Обработчик нажатия на кнопку 📊 Статистика за неделю
-@dp.message(lambda message: message.text == "📊 Статистика за неделю")
+@routes.text("📊 Статистика за неделю")
 async def show_stats_week(message: types.Message):
     user_id = message.from_user.id
     # Получаем статистику
-    weekly_stats = get_weekly_stats(user_id)
+    weekly_stats = await storage.get_weekly_stats(user_id)
 
     # Форматируем вывод
     text = "📊 *Статистика за неделю:*\n"
@@ -628,15 +554,84 @@ async def show_stats_week(message: types.Message):
             [f"📌 {cat}: {mins // 60} ч {mins % 60} мин" for cat, mins in stats.items()]
         )
         text += day_text
-    await message.answer(text, parse_mode="Markdown")
-    has_active_tracking = check_active_tracking(user_id)
-    await message.answer("Главное меню:", reply_markup=get_main_menu(has_active_tracking))
+    has_active_tracking = await storage.check_active_tracking(user_id)
+    reply = Reply(text, parse_mode="Markdown").menu(main_menu(has_active_tracking))
+    if not weekly_stats:
+        await reply.send(message)
+        return
+    # Столбцы по дням недели; сегодняшний день растёт, поэтому в ключе шаг времени
+    today = datetime.now(storage.tz(user_id)).strftime("%Y-%m-%d")
+    cache_key = ("week", user_id, today, storage.data_version(user_id), cache_step())
+    await send_with_chart(message, reply, cache_key, "render_stacked_days", *day_series(list(weekly_stats.items())))
+
+
+# Кнопки 🗓 Статистика за месяц и 📈 Статистика за год
+@routes.text("🗓 Статистика за месяц", "📈 Статистика за год")
+async def show_stats_range(message: types.Message):
+    today = datetime.now(storage.tz(message.from_user.id)).date()
+    first_day, last_day = parse_period("month" if "месяц" in message.text else "year", today)
+    await send_range_stats(message, first_day, last_day)
 
 
-async def main():
+exporter = None
+warm_up_task = None
+
+
+async def auto_close_sessions():
+    await close_stale_sessions(bot, storage)
+
+
+async def daily_digests():
+    await send_digests(bot, storage)
+
+
+async def resync_active_sessions():
+    await storage.resync_active_sessions()
+
+
+scheduler.every(AUTO_CLOSE_INTERVAL, auto_close_sessions)
+scheduler.every(DIGEST_INTERVAL, daily_digests)
+scheduler.every(ACTIVE_RESYNC_INTERVAL, resync_active_sessions)
+
+
+async def on_startup():
+    global exporter, warm_up_task
+    renderer.start()  # Процессы отрисовки поднимаем до потоков хранилища
+    await storage.start()
+    fsm_storage.start()
+    outbox.start()
+    scheduler.start()
+    exporter = await metrics.start_exporter()
+    if CHART_WARMUP:
+        # matplotlib загружается в процессах отрисовки уже после того, как бот начал отвечать
+        warm_up_task = asyncio.create_task(renderer.warm_up())
+
+
+async def on_shutdown():
+    await scheduler.close()
+    if exporter is not None:
+        await metrics.stop_exporter(*exporter)
+    await fsm_storage.close()
+    await storage.close()
+    renderer.close()
+    await outbox.close()
+
+
+async def main(mode=BOT_MODE):
     logging.basicConfig(level=logging.INFO)
-    await dp.start_polling(bot)
+    await on_startup()
+    try:
+        if mode == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            await bot.delete_webhook()  # getUpdates не работает, пока установлен вебхук
+            await dp.start_polling(bot)
+    finally:
+        await on_shutdown()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Telegram-бот для трекинга времени")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default=BOT_MODE)
+    args = parser.parse_args()
+    asyncio.run(main(args.mode))
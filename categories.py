@@ -0,0 +1,39 @@
+import re
+
+# Категории трекинга: текст кнопки и короткий код для callback_data
+CATEGORIES = ["😴 Сон", "🛁 Уход за собой", "💼 Работа", "🏋️‍ Спорт и Здоровье", "👨‍👩‍👧‍👦 Семья и друзья",
+              "🚗 Логистика", "🏡 Домашние дела", "🎮 Развлечения", "📚 Личное развитие", "🐌 Прокрастинация"]
+
+CATEGORY_MAPPING = {
+    "selfcare": "🛁 Уход за собой",
+    "work": "💼 Работа",
+    "sport": "🏋️‍ Спорт и Здоровье",
+    "family": "👨‍👩‍👧‍👦 Семья и друзья",
+    "sleep": "😴 Сон",
+    "home": "🏡 Домашние дела",
+    "learning": "📚 Личное развитие",
+    "fun": "🎮 Развлечения",
+    "lazy": "🐌 Прокрастинация",
+    "logistics": "🚗 Логистика"
+}
+
+
+# Подпись категории на графике: без эмодзи, их нет в шрифте matplotlib
+def chart_label(category):
+    return re.sub(r'[^\w\s,]', '', category).strip()
+
+
+def _normalize(text):
+    return re.sub(r'[^\w\s]', '', text).strip().lower()
+
+
+# Категория по тексту из чужих файлов: полное название, код или название без эмодзи
+CATEGORY_LOOKUP = {}
+for _code, _category in CATEGORY_MAPPING.items():
+    CATEGORY_LOOKUP[_category] = _category
+    CATEGORY_LOOKUP[_code] = _category
+    CATEGORY_LOOKUP[_normalize(_category)] = _category
+
+
+def find_category(text):
+    return CATEGORY_LOOKUP.get(text) or CATEGORY_LOOKUP.get(_normalize(text))
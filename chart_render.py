@@ -0,0 +1,182 @@
+import io
+
+# Модуль импортируется только в процессах отрисовки (см. charts.ChartRenderer):
+# основной процесс бота matplotlib не загружает вовсе.
+import matplotlib
+
+matplotlib.use("Agg")  # Без GUI: выбор бэкенда не зависит от окружения
+
+import numpy as np  # noqa: E402
+from matplotlib import colormaps  # noqa: E402
+from matplotlib.backends.backend_agg import FigureCanvasAgg  # noqa: E402
+from matplotlib.figure import Figure  # noqa: E402
+from matplotlib.patches import Patch  # noqa: E402
+from PIL import Image  # noqa: E402  Pillow ставится вместе с matplotlib
+
+from categories import CATEGORIES, chart_label  # noqa: E402
+
+UNTRACKED_LABEL = "Без трекинга"
+BAR_SLOTS = 31  # Столбцов в шаблоне столбчатой диаграммы: до месяца по дням
+TREND_WINDOW = 7  # Скользящее среднее на графике динамики для периодов длиннее BAR_SLOTS дней
+PNG_COLORS = 128  # Цветов в палитре PNG: на графиках их немного, палитра в разы меньше RGBA
+WEBP_QUALITY = 80
+
+
+# Постоянный цвет у каждой категории на всех графиках; «Без трекинга» — серый
+LABELS = [chart_label(category) for category in CATEGORIES]
+COLORS = dict(zip(LABELS, colormaps["Paired"].colors))
+COLORS[UNTRACKED_LABEL] = "#d9d9d9"
+OTHER_COLOR = "#999999"
+
+
+def _color(label):
+    return COLORS.get(label.strip(), OTHER_COLOR)
+
+
+# Функция для форматирования процентов. Скрывает проценты < 1%
+def autopct_func(pct):
+    if pct < 1:
+        return ''
+    else:
+        return f'{pct:.0f}%'  # Округляем до целого числа
+
+
+# Кодирует отрисованную фигуру. png — палитровый PNG с optimize, webp — WebP
+# с потерями; оба в несколько раз меньше полноцветного PNG от savefig.
+def _encode(canvas, fmt):
+    canvas.draw()
+    image = Image.fromarray(np.asarray(canvas.buffer_rgba())).convert("RGB")
+    buf = io.BytesIO()
+    if fmt == "webp":
+        image.save(buf, format="WEBP", quality=WEBP_QUALITY, method=4)
+    else:
+        image.quantize(PNG_COLORS, method=Image.Quantize.FASTOCTREE).save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+# Общая часть шаблонов: фигура с холстом, заголовком и легендой всех категорий.
+# Раскладка задана заранее, поэтому при сохранении не нужен bbox_inches='tight',
+# который заново измеряет все надписи.
+class Template:
+    def __init__(self, size, dpi, title, labels, rect):
+        self.figure = Figure(figsize=size, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_axes(rect)
+        self.ax.set_title(title)
+        self.figure.legend([Patch(color=_color(label)) for label in labels], labels, loc="lower center", ncol=3,
+                           fontsize=10, frameon=False)
+
+
+# Круговая диаграмма за день. Клинья при каждом вызове рисуются заново (у pie нет
+# обновления данных), а фигура, оси, заголовок и легенда берутся из шаблона.
+class PieTemplate(Template):
+    def __init__(self, dpi):
+        super().__init__((8, 7.5), dpi, "Распределение времени по категориям за день",
+                         LABELS + [UNTRACKED_LABEL], (0.1, 0.18, 0.8, 0.74))
+        self.artists = []
+
+    def update(self, categories, durations):
+        for artist in self.artists:
+            artist.remove()
+        wedges, texts, autotexts = self.ax.pie(durations, autopct=autopct_func, startangle=90,
+                                               colors=[_color(category) for category in categories])
+        self.artists = wedges + texts + autotexts
+
+
+# Столбцы по дням, сложенные из категорий. Прямоугольники всех категорий
+# на BAR_SLOTS дней созданы заранее; обновляются только высоты и основания.
+class StackedTemplate(Template):
+    def __init__(self, dpi):
+        super().__init__((9, 7), dpi, "Время по категориям по дням", LABELS + [UNTRACKED_LABEL],
+                         (0.08, 0.25, 0.9, 0.68))
+        slots = np.arange(BAR_SLOTS)
+        self.bars = {label: self.ax.bar(slots, np.zeros(BAR_SLOTS), color=_color(label), width=0.8)
+                     for label in LABELS + [UNTRACKED_LABEL]}
+        self.ax.set_ylabel("Часы")
+        self.ax.grid(axis="y", alpha=0.3)
+
+    def update(self, days, categories, minutes):
+        count = len(days)
+        bottom = np.zeros(BAR_SLOTS)
+        values = dict(zip(categories, minutes))
+        for label, bars in self.bars.items():
+            hours = np.zeros(BAR_SLOTS)
+            if label in values:
+                hours[:count] = np.asarray(values[label], dtype=float) / 60
+            for rect, height, y in zip(bars.patches, hours, bottom):
+                rect.set_height(height)
+                rect.set_y(y)
+                rect.set_visible(height > 0)
+            bottom += hours
+        self.ax.set_xlim(-0.5, max(count, 7) - 0.5)  # Ширина столбцов как у полной недели
+        self.ax.set_ylim(0, max(24, bottom.max()))
+        self.ax.set_xticks(range(count), days, rotation=45 if count > 7 else 0, fontsize=9 if count > 7 else 10)
+
+
+# Динамика по дням: линия на категорию (без «Без трекинга»). Линии созданы
+# заранее, обновляются их данные, пределы осей и подписи дат.
+class TrendTemplate(Template):
+    def __init__(self, dpi):
+        super().__init__((9, 7), dpi, "Динамика по дням", LABELS, (0.08, 0.25, 0.9, 0.68))
+        self.lines = {label: self.ax.plot([], [], color=_color(label), linewidth=2)[0] for label in LABELS}
+        self.ax.set_ylabel("Часы в день")
+        self.ax.grid(alpha=0.3)
+
+    def update(self, days, categories, minutes):
+        count = len(days)
+        window = TREND_WINDOW if count > BAR_SLOTS else 1
+        values = dict(zip(categories, minutes))
+        top = 1
+        for label, line in self.lines.items():
+            if label not in values:
+                line.set_data([], [])
+                continue
+            hours = np.asarray(values[label], dtype=float) / 60
+            if window > 1:
+                hours = np.convolve(hours, np.ones(window) / window, mode="same")
+            line.set_data(np.arange(count), hours)
+            top = max(top, hours.max())
+        self.ax.set_xlim(0, max(count - 1, 1))
+        self.ax.set_ylim(0, top * 1.1)
+        step = max(1, -(-count // 10))
+        self.ax.set_xticks(range(0, count, step), days[::step], rotation=45, fontsize=9)
+
+
+# Шаблоны живут в процессе отрисовки и переиспользуются между вызовами
+_templates = {}
+
+
+def _template(cls, dpi):
+    template = _templates.get((cls, dpi))
+    if template is None:
+        template = _templates[(cls, dpi)] = cls(dpi)
+    return template
+
+
+# Рисует круговую диаграмму за день и возвращает картинку в байтах (fmt: png или webp)
+def render_daily_pie(categories, durations, fmt="png", dpi=80):
+    template = _template(PieTemplate, dpi)
+    template.update(categories, durations)
+    return _encode(template.canvas, fmt)
+
+
+# days — подписи дней, minutes[i] — минуты категории categories[i] по дням
+def render_stacked_days(days, categories, minutes, fmt="png", dpi=80):
+    template = _template(StackedTemplate, dpi)
+    template.update(days, categories, minutes)
+    return _encode(template.canvas, fmt)
+
+
+def render_trend(days, categories, minutes, fmt="png", dpi=80):
+    template = _template(TrendTemplate, dpi)
+    template.update(days, categories, minutes)
+    return _encode(template.canvas, fmt)
+
+
+# Прогрев процесса отрисовки: загружает шрифты и собирает шаблоны всех графиков,
+# чтобы первый настоящий график не платил за холодный старт
+def warm_up(fmt="png", dpi=80):
+    render_daily_pie(["Прогрев"], [1], fmt, dpi)
+    render_stacked_days(["Пн"], ["Прогрев"], [[1]], fmt, dpi)
+    render_trend(["01.01", "02.01"], ["Прогрев"], [[1, 1]], fmt, dpi)
+    return True
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from categories import CATEGORIES, chart_label
+from metrics import metrics
+from range_stats import UNTRACKED
+
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))  # Количество процессов отрисовки
+CHART_QUEUE_SIZE = int(os.getenv("CHART_QUEUE_SIZE", "16"))  # Сколько графиков может ждать отрисовки
+CHART_TIMEOUT = float(os.getenv("CHART_TIMEOUT", "10"))  # Секунд на один график
+CHART_CACHE_ENTRIES = int(os.getenv("CHART_CACHE_ENTRIES", "1000"))  # Максимум графиков в кеше
+CHART_CACHE_BYTES = int(os.getenv("CHART_CACHE_BYTES", str(32 * 1024 * 1024)))  # Максимум байт PNG в кеше
+# Шаг (в минутах), с которым прошедшее за день время попадает в ключ кеша: «Без трекинга»
+# и идущий трекинг растут даже без новых записей, и без шага кеш не срабатывал бы никогда.
+CHART_CACHE_STEP = int(os.getenv("CHART_CACHE_STEP", "15"))
+CHART_WARMUP = os.getenv("CHART_WARMUP", "1") == "1"  # Прогревать процессы отрисовки после запуска
+CHART_FORMAT = os.getenv("CHART_FORMAT", "png")  # Формат графиков: png (с палитрой) или webp
+CHART_DPI = int(os.getenv("CHART_DPI", "80"))  # Точек на дюйм: 80 — около 640–720 пикселей по ширине
+
+logger = logging.getLogger(__name__)
+
+
+# Выполняется в процессе отрисовки: функция из chart_render по имени.
+# Так основной процесс не импортирует matplotlib даже ради ссылки на функцию.
+def _render(name, fmt, dpi, *args):
+    import chart_render
+    return getattr(chart_render, name)(*args, fmt=fmt, dpi=dpi)
+
+
+def _ping():
+    return True
+
+
+# Сервис отрисовки графиков в пуле процессов.
+# Очередь ограничена: если она заполнена или график не успел отрисоваться за
+# CHART_TIMEOUT, render() возвращает None, и обработчик показывает только текст.
+# Повторные запросы с тем же ключом (например, двойное нажатие кнопки) ждут
+# уже запущенную отрисовку, а не ставят новую.
+class ChartRenderer:
+    def __init__(self, workers=CHART_WORKERS, queue_size=CHART_QUEUE_SIZE, timeout=CHART_TIMEOUT, fmt=CHART_FORMAT,
+                 dpi=CHART_DPI):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.fmt = fmt
+        self.dpi = dpi
+        self._pool = None
+        self._pending = {}
+        self.rejected = 0
+        self.timeouts = 0
+        self.coalesced = 0
+
+    # Поднимает процессы заранее, до запуска потоков хранилища
+    def start(self):
+        if self._pool is not None:
+            return
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        for future in [self._pool.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+
+    # Фоновый прогрев: каждый процесс импортирует matplotlib и рисует пробный
+    # график, пока бот уже отвечает. Ошибка прогрева не мешает работе.
+    async def warm_up(self):
+        if self._pool is None:
+            return
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(loop.run_in_executor(self._pool, _render, "warm_up", self.fmt, self.dpi)
+                                   for _ in range(self.workers)))
+            logger.info("Chart workers warmed up in %.2f s", time.perf_counter() - started)
+        except Exception:
+            logger.exception("Chart warm-up failed")
+
+    def close(self):
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+    # name — имя функции в chart_render, например "render_daily_pie"; key[0] — вид графика для метрик
+    async def render(self, key, name, *args):
+        if self._pool is None:
+            self.start()
+
+        task = self._pending.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            if len(self._pending) >= self.queue_size:
+                self.rejected += 1
+                logger.warning("Chart queue is full, falling back to text for %s", key)
+                return None
+            loop = asyncio.get_running_loop()
+            task = asyncio.ensure_future(loop.run_in_executor(self._pool, _render, name, self.fmt, self.dpi, *args))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), self.timeout)
+            metrics.render_seconds.observe(time.perf_counter() - started, chart=key[0])
+            return result
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning("Chart render timed out for %s", key)
+            return None
+        except Exception:
+            logger.exception("Chart render failed for %s", key)
+            return None
+
+
+# Имя файла для отправки готового графика
+def chart_filename(kind, fmt=CHART_FORMAT):
+    return f"{kind}_stats.{fmt}"
+
+
+# Данные для render_stacked_days / render_trend из [(подпись дня, {категория: минуты})]:
+# подписи дней, категории в порядке CATEGORIES (без эмодзи, «Без трекинга» последней)
+# и минуты каждой категории по дням
+def day_series(days):
+    present = {category for _, stats in days for category in stats}
+    order = {category: index for index, category in enumerate(CATEGORIES + [UNTRACKED])}
+    categories = sorted(present, key=lambda category: (order.get(category, len(CATEGORIES) - 0.5), category))
+    return ([label for label, _ in days], [chart_label(category) for category in categories],
+            [[stats.get(category, 0) for _, stats in days] for category in categories])
+
+
+class CachedChart:
+    __slots__ = ("data", "file_id")
+
+    def __init__(self, data):
+        self.data = data
+        self.file_id = None
+
+
+# LRU-кеш готовых графиков с ограничением по количеству и по памяти.
+# После первой отправки в Telegram сохраняем file_id и выбрасываем байты:
+# повторно тот же график отправляется по file_id без отрисовки и без загрузки.
+class ChartCache:
+    def __init__(self, max_entries=CHART_CACHE_ENTRIES, max_bytes=CHART_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, data):
+        old = self._entries.pop(key, None)
+        if old is not None and old.data is not None:
+            self.size -= len(old.data)
+        entry = CachedChart(data)
+        self._entries[key] = entry
+        self.size += len(data)
+        self._evict()
+        return entry
+
+    def set_file_id(self, key, file_id):
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        entry.file_id = file_id
+        if entry.data is not None:
+            self.size -= len(entry.data)
+            entry.data = None
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            if entry.data is not None:
+                self.size -= len(entry.data)
@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sqlite3
+
+from migrations import migrate
+from webhook import UpdateFeeder, serve_webhook, wait_for_stop_signal
+
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", "2"))  # Количество процессов-обработчиков
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", "30"))  # Long polling getUpdates, секунд
+RESHARD_CHUNK = 1000  # Строк за одну выборку при перешардировании
+
+# Таблицы, строки которых принадлежат одному пользователю (у fsm_states он в ключе)
+USER_TABLES = ["users", "time_logs", "time_tracking", "daily_rollup", "fsm_states"]
+
+logger = logging.getLogger(__name__)
+
+
+# Номер процесса (и шарда базы), которому принадлежит пользователь
+def shard_of(user_id, shards):
+    if user_id is None:
+        return 0
+    return int(user_id) % shards
+
+
+# Владелец строки при перешардировании: user_id или ключ FSM bot:chat:user:...
+def row_user_id(value):
+    if isinstance(value, str):
+        return int(value.split(":")[2])
+    return value
+
+
+# database.db -> database.0.db, database.1.db, ...
+def shard_path(path, index):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{index}{ext}"
+
+
+# user_id из сырого JSON обновления: у всех пользовательских событий есть поле "from"
+def raw_update_user_id(data):
+    for key, value in data.items():
+        if isinstance(value, dict):
+            user = value.get("from") or value.get("user")
+            if isinstance(user, dict):
+                return user.get("id")
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Процесс-обработчик: свой диспетчер, своё хранилище, своя очередь обновлений
+# ---------------------------------------------------------------------------
+
+def _worker_main(index, workers, jobs, db_path):
+    # Ctrl+C получает вся группа процессов; останавливает нас фронт через None в очереди
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=f"[worker {index}] %(levelname)s:%(name)s:%(message)s")
+    # У каждого процесса свой /metrics: METRICS_PORT + 1 + номер процесса
+    if int(os.getenv("METRICS_PORT", "0")):
+        os.environ["METRICS_PORT"] = str(int(os.environ["METRICS_PORT"]) + 1 + index)
+    # Лимит Telegram общий на бота — делим его между процессами
+    os.environ["SEND_GLOBAL_RATE"] = str(float(os.getenv("SEND_GLOBAL_RATE", "30")) / workers)
+    # Фоновые задачи (scheduler.py) каждый процесс выполняет только для своих пользователей
+    os.environ["SCHEDULER_SHARD"] = f"{index}/{workers}"
+    import bot as app
+    from storage import Storage
+    if isinstance(app.storage, Storage):  # PostgreSQL (DATABASE_URL) общий для всех процессов
+        app.storage.path = db_path
+    asyncio.run(_worker_loop(app, jobs))
+
+
+async def _worker_loop(app, jobs):
+    await app.on_startup()
+    feeder = UpdateFeeder(app.bot, app.dp)
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, jobs.get)
+            if raw is None:
+                break
+            try:
+                feeder.feed_raw(json.loads(raw))
+            except ValueError as e:  # Обновление не проходит проверку aiogram — пропускаем, процесс живёт дальше
+                logger.warning("Malformed update skipped: %s", e)
+        await feeder.drain()
+    finally:
+        await app.on_shutdown()
+        await app.bot.session.close()
+
+
+# Фронт: раскладывает обновления по процессам по хешу user_id.
+# У каждого пользователя свой постоянный процесс, поэтому порядок его
+# обновлений, FSM и кеши в памяти остаются согласованными.
+class ShardRouter:
+    def __init__(self, workers=CLUSTER_WORKERS, db_path=None, sharded=False):
+        from storage import DB_PATH
+        db_path = db_path or DB_PATH
+        context = multiprocessing.get_context("spawn")
+        self.queues = [context.Queue() for _ in range(workers)]
+        self.processes = [
+            context.Process(target=_worker_main, name=f"bot-worker-{index}",
+                            args=(index, workers, self.queues[index], shard_path(db_path, index) if sharded else db_path))
+            for index in range(workers)
+        ]
+        self.routed = [0] * workers
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    @property
+    def in_flight(self):
+        try:
+            return sum(queue.qsize() for queue in self.queues)
+        except NotImplementedError:  # macOS
+            return 0
+
+    def feed_raw(self, data):
+        index = shard_of(raw_update_user_id(data), len(self.queues))
+        self.routed[index] += 1
+        self.queues[index].put(json.dumps(data))
+
+    # Останавливает процессы: каждый доделывает свою очередь и завершается
+    async def drain(self, timeout=None):
+        for queue in self.queues:
+            queue.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self._join, timeout)
+        logger.info("Routed updates per worker: %s", self.routed)
+
+    def _join(self, timeout):
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("%s did not stop in time, terminating", process.name)
+                process.terminate()
+
+
+async def poll_updates(bot, router):
+    await bot.delete_webhook()  # getUpdates не работает, пока установлен вебхук
+    stop = asyncio.create_task(wait_for_stop_signal())
+    offset = None
+    try:
+        while not stop.done():
+            poll = asyncio.create_task(bot.get_updates(offset=offset, timeout=POLL_TIMEOUT))
+            await asyncio.wait([poll, stop], return_when=asyncio.FIRST_COMPLETED)
+            if not poll.done():
+                poll.cancel()
+                break
+            try:
+                updates = poll.result()
+            except Exception:
+                logger.exception("getUpdates failed")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                router.feed_raw(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+                offset = update.update_id + 1
+        if offset is not None:
+            # Подтверждаем уже разосланные обновления, чтобы они не пришли повторно
+            await bot.get_updates(offset=offset, timeout=0, limit=1)
+    finally:
+        stop.cancel()
+        await router.drain()
+        await bot.session.close()
+
+
+async def run(workers, mode, sharded):
+    from aiogram import Bot
+    from bot import TOKEN, session
+
+    router = ShardRouter(workers, sharded=sharded)
+    router.start()
+    bot = Bot(token=TOKEN, session=session)
+    if mode == "webhook":
+        await serve_webhook(bot, router)
+    else:
+        await poll_updates(bot, router)
+
+
+# ---------------------------------------------------------------------------
+# Перешардирование: раскладывает строки пользователей из источников по
+# новым файлам шардов. Бот на это время должен быть остановлен.
+# ---------------------------------------------------------------------------
+
+def reshard(sources, targets):
+    keep_ids = len(sources) == 1  # id из нескольких шардов могут совпадать
+    outputs = []
+    for target in targets:
+        new_path = target + ".new"
+        if os.path.exists(new_path):
+            os.remove(new_path)
+        conn = sqlite3.connect(new_path)
+        migrate(conn)
+        outputs.append(conn)
+
+    copied = 0
+    for source in sources:
+        src = sqlite3.connect(source)
+        migrate(src)
+        for table in USER_TABLES:
+            columns = [row[1] for row in src.execute(f"PRAGMA table_info({table})")]
+            if not keep_ids and "id" in columns:
+                columns.remove("id")
+            user_index = columns.index("user_id" if "user_id" in columns else "key")
+            insert = (f"INSERT INTO {table} ({', '.join(columns)}) "
+                      f"VALUES ({', '.join('?' for _ in columns)})")
+            cursor = src.execute(f"SELECT {', '.join(columns)} FROM {table}")
+            while True:
+                rows = cursor.fetchmany(RESHARD_CHUNK)
+                if not rows:
+                    break
+                by_shard = {}
+                for row in rows:
+                    by_shard.setdefault(shard_of(row_user_id(row[user_index]), len(targets)), []).append(row)
+                for index, shard_rows in by_shard.items():
+                    outputs[index].executemany(insert, shard_rows)
+                copied += len(rows)
+        src.close()
+
+    for target, conn in zip(targets, outputs):
+        conn.commit()
+        conn.close()
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(target + suffix):
+                os.remove(target + suffix)
+        os.replace(target + ".new", target)
+    return copied
+
+
+# python cluster.py run --workers 4 [--mode polling|webhook] [--sharded]
+# python cluster.py reshard --workers 4 [--from-shards 2] [--db database.db]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Запуск бота в нескольких процессах с разбиением по пользователям")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run")
+    run_parser.add_argument("--workers", type=int, default=CLUSTER_WORKERS)
+    run_parser.add_argument("--mode", choices=["polling", "webhook"], default=os.getenv("BOT_MODE", "polling"))
+    run_parser.add_argument("--sharded", action="store_true",
+                            help="у каждого процесса свой файл базы вместо общей базы в режиме WAL")
+    reshard_parser = sub.add_parser("reshard")
+    reshard_parser.add_argument("--workers", type=int, required=True, help="новое количество шардов")
+    reshard_parser.add_argument("--from-shards", type=int, default=0,
+                                help="текущее количество шардов (0 — одна общая база)")
+    reshard_parser.add_argument("--db", default=os.getenv("DB_PATH", "database.db"))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "run":
+        asyncio.run(run(args.workers, args.mode, args.sharded))
+    else:
+        if args.from_shards:
+            sources = [shard_path(args.db, index) for index in range(args.from_shards)]
+        else:
+            sources = [args.db]
+        targets = [shard_path(args.db, index) for index in range(args.workers)]
+        count = reshard(sources, targets)
+        logger.info("Copied %d rows from %d source(s) into %d shard(s)", count, len(sources), len(targets))
@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import itertools
+import time
+from collections import Counter
+from datetime import datetime
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, PhotoSize, User
+from aiohttp import ClientSession, web
+
+from webhook import SECRET_HEADER
+
+
+# Заглушка Bot API для локального запуска без сети.
+# Бот подключается к ней через TELEGRAM_API_URL=http://127.0.0.1:8081.
+# На send*/edit* отвечает правдоподобным Message, на остальное — True,
+# и считает вызовы по методам.
+class FakeBotAPI:
+    def __init__(self):
+        self.calls = {}
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+
+    def build_app(self):
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        form = await request.post()
+        return web.json_response({"ok": True, "result": self.result(method, form)})
+
+    def result(self, method, form):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        if not (method.startswith("send") or method.startswith("edit")):
+            return True
+        chat_id = int(form.get("chat_id", 0))
+        message = {
+            "message_id": int(form.get("message_id", 0)) or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": form.get("text", ""),
+        }
+        if method == "sendPhoto":
+            file_id = f"fake-photo-{next(self._file_ids)}"
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 800, "height": 800}]
+        return message
+
+
+# Сессия aiogram без сети: Bot(token, session=FakeSession()) отвечает сам себе.
+# Считает вызовы по методам и запоминает последнюю клавиатуру в каждом чате,
+# чтобы имитация пользователя могла «нажать» инлайн-кнопку.
+class FakeSession(BaseSession):
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency  # Имитация времени ответа Bot API, секунд
+        self.calls = Counter()
+        self.markups = {}
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        chat_id = getattr(method, "chat_id", None)
+        markup = getattr(method, "reply_markup", None)
+        if markup is not None:
+            self.markups[chat_id] = markup
+        returning = method.__returning__
+        if returning is Message:
+            photo = None
+            if type(method).__name__ == "SendPhoto":
+                file_id = f"fake-photo-{next(self._file_ids)}"
+                photo = [PhotoSize(file_id=file_id, file_unique_id=file_id, width=800, height=800)]
+            return Message(message_id=getattr(method, "message_id", None) or next(self._message_ids),
+                           date=datetime.now(), chat=Chat(id=int(chat_id or 0), type="private"),
+                           text=getattr(method, "text", None), photo=photo)
+        if returning is User:
+            return User(id=1, is_bot=True, first_name="FakeBot")
+        return True
+
+
+# Клиент, который изображает Telegram: собирает Update и отправляет его POST-запросом на вебхук
+class FakeTelegramClient:
+    def __init__(self, url=None, secret=None):
+        self.url = url
+        self.secret = secret
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._session = None
+
+    async def __aenter__(self):
+        self._session = ClientSession()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+
+    @staticmethod
+    def _user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def message_update(self, user_id, text):
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+            },
+        }
+
+    def callback_update(self, user_id, data, message_id=1):
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "FakeBot"},
+                    "text": "",
+                },
+            },
+        }
+
+    async def post(self, update):
+        headers = {SECRET_HEADER: self.secret} if self.secret else {}
+        async with self._session.post(self.url, json=update, headers=headers) as response:
+            return response.status
+
+    async def send_text(self, user_id, text):
+        return await self.post(self.message_update(user_id, text))
+
+    async def press_button(self, user_id, data):
+        return await self.post(self.callback_update(user_id, data))
+
+
+async def _serve_api(host, port):
+    api = FakeBotAPI()
+    runner = web.AppRunner(api.build_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Fake Bot API on http://{host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print(api.calls)
+        await runner.cleanup()
+
+
+async def _send(url, secret, user_id, texts):
+    async with FakeTelegramClient(url, secret) as client:
+        for text in texts:
+            print(text, "->", await client.send_text(user_id, text))
+
+
+# python fake_telegram.py api                          — заглушка Bot API
+# python fake_telegram.py send "📊 Статистика" ...     — отправить сообщения на вебхук
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальная имитация Telegram для проверки вебхука")
+    sub = parser.add_subparsers(dest="command", required=True)
+    api_parser = sub.add_parser("api")
+    api_parser.add_argument("--host", default="127.0.0.1")
+    api_parser.add_argument("--port", type=int, default=8081)
+    send_parser = sub.add_parser("send")
+    send_parser.add_argument("texts", nargs="+")
+    send_parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    send_parser.add_argument("--secret", default=None)
+    send_parser.add_argument("--user", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == "api":
+        asyncio.run(_serve_api(args.host, args.port))
+    else:
+        asyncio.run(_send(args.url, args.secret, args.user, args.texts))
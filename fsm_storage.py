@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+FSM_TTL = int(os.getenv("FSM_TTL", str(24 * 60 * 60)))  # Через сколько секунд брошенный сценарий забывается
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.5"))  # Как часто изменения пишутся в базу
+FSM_SWEEP_INTERVAL = float(os.getenv("FSM_SWEEP_INTERVAL", "600"))  # Как часто удаляются просроченные записи
+FSM_EMPTY_TTL = float(os.getenv("FSM_EMPTY_TTL", "60"))  # Сколько секунд помнить, что у пользователя нет сценария
+
+logger = logging.getLogger(__name__)
+
+
+# В данные FSM кладутся datetime (время начала трекинга), поэтому JSON с поддержкой datetime
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode(obj):
+    if "__datetime__" in obj and len(obj) == 1:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+def _key(key):
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id}:{key.business_connection_id}:{key.destiny}"
+
+
+class _Record:
+    __slots__ = ("state", "data", "expires_at")
+
+    def __init__(self, state=None, data=None, expires_at=0):
+        self.state = state
+        self.data = data or {}
+        self.expires_at = expires_at
+
+
+# Хранилище FSM в той же базе, что и трекинги (таблица fsm_states, методы fsm_*
+# хранилища storage_base.StorageBackend). Сценарии добавления/изменения трекинга
+# переживают перезапуск бота.
+# Изменения копятся в памяти и пишутся одной транзакцией раз в FSM_FLUSH_INTERVAL;
+# записи старше FSM_TTL считаются пустыми и периодически удаляются из базы и памяти.
+class DatabaseFSMStorage(BaseStorage):
+    def __init__(self, storage, ttl=FSM_TTL, flush_interval=FSM_FLUSH_INTERVAL, sweep_interval=FSM_SWEEP_INTERVAL,
+                 empty_ttl=FSM_EMPTY_TTL):
+        self.storage = storage
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self._records = {}
+        self._dirty = set()
+        self._tasks = []
+        self.flushes = 0
+        self.swept = 0
+
+    # Запускает фоновую запись и очистку; вызывать после storage.start()
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._flush_loop()), asyncio.create_task(self._sweep_loop())]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await self.flush()
+
+    async def _record(self, key):
+        record = self._records.get(key)
+        now = time.time()
+        if record is not None:
+            if record.expires_at > now:
+                return record
+            if key in self._dirty:  # Изменение ещё не записано: база о нём не знает
+                record.state, record.data = None, {}
+                return record
+        row = await self.storage.fsm_load(key, int(now))
+        if row:
+            # Срок — как у строки в базе, чтобы память и база истекали одновременно
+            record = _Record(row[0], json.loads(row[1], object_hook=_decode) if row[1] else {}, row[2])
+        else:
+            # Пустое состояние помним недолго: FSM спрашивает его на каждом сообщении,
+            # но держать запись на каждого, кто хоть раз написал боту, незачем
+            record = _Record(expires_at=now + self.empty_ttl)
+        self._records[key] = record
+        return record
+
+    def _touch(self, key, record):
+        record.expires_at = time.time() + self.ttl
+        self._dirty.add(key)
+
+    async def set_state(self, key, state=None):
+        key = _key(key)
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(key, record)
+
+    async def get_state(self, key):
+        return (await self._record(_key(key))).state
+
+    async def set_data(self, key, data):
+        key = _key(key)
+        record = await self._record(key)
+        record.data = dict(data)
+        self._touch(key, record)
+
+    async def get_data(self, key):
+        return dict((await self._record(_key(key))).data)
+
+    # Пишет накопленные изменения одной транзакцией
+    async def flush(self):
+        if not self._dirty:
+            return
+        upserts, deletes = [], []
+        for key in self._dirty:
+            record = self._records.get(key)
+            if record is None or (record.state is None and not record.data):
+                deletes.append(key)
+                self._records.pop(key, None)  # Пустую запись в памяти держать незачем
+            else:
+                upserts.append((key, record.state, json.dumps(record.data, default=_encode),
+                                int(record.expires_at)))
+        self._dirty.clear()
+        await self.storage.fsm_save(upserts, deletes)
+        self.flushes += 1
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("FSM flush failed")
+
+    # Удаляет просроченные записи из базы и из памяти
+    async def sweep(self):
+        now = time.time()
+        expired = [key for key, record in self._records.items() if record.expires_at <= now and key not in self._dirty]
+        for key in expired:
+            del self._records[key]
+        self.swept += await self.storage.fsm_delete_expired(int(now))
+        return len(expired)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("FSM sweep failed")
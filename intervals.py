@@ -0,0 +1,216 @@
+import bisect
+import os
+from collections import OrderedDict
+
+# Что делать, если новый или изменённый интервал пересекается с уже записанными:
+# reject — отказать; trim — занять только свободное время; merge — слить с
+# пересекающимися и соседними интервалами той же категории, остальное как trim
+OVERLAP_POLICY = os.getenv("OVERLAP_POLICY", "trim")
+INTERVAL_CACHE_USERS = int(os.getenv("INTERVAL_CACHE_USERS", "1000"))  # Пользователей с индексом в памяти
+
+POLICIES = ("reject", "trim", "merge")
+
+
+# Интервал не помещается: conflicts — [(категория, start_ts, end_ts или None для идущего трекинга)]
+class OverlapError(Exception):
+    def __init__(self, conflicts):
+        super().__init__(f"overlaps {len(conflicts)} intervals")
+        self.conflicts = conflicts
+
+
+# Части [start_ts, end_ts), не занятые интервалами busy
+def subtract(start_ts, end_ts, busy):
+    pieces = []
+    cursor = start_ts
+    for busy_start, busy_end in sorted(busy):
+        if busy_start > cursor:
+            pieces.append((cursor, min(busy_start, end_ts)))
+        cursor = max(cursor, busy_end)
+        if cursor >= end_ts:
+            break
+    if cursor < end_ts:
+        pieces.append((cursor, end_ts))
+    return pieces
+
+
+# Секунды внутри [start_ts, end_ts), покрытые хотя бы одним интервалом.
+# Пересечения считаются один раз, поэтому результат не больше длины отрезка.
+def covered_seconds(intervals, start_ts, end_ts):
+    total = 0
+    cursor = start_ts
+    for interval_start, interval_end in sorted(intervals):
+        interval_start, interval_end = max(interval_start, cursor), min(interval_end, end_ts)
+        if interval_end > interval_start:
+            total += interval_end - interval_start
+            cursor = interval_end
+    return total
+
+
+# Интервалы одного пользователя, отсортированные по началу. reach[k] — самый
+# поздний конец среди первых k + 1 интервалов: он не убывает, поэтому поиск
+# пересечений — два bisect, даже если в старой истории интервалы перекрываются.
+class UserIntervals:
+    def __init__(self, rows=()):
+        self.ids = []
+        self.categories = []
+        self.starts = []
+        self.ends = []
+        self.reach = []
+        for row_id, category, start_ts, end_ts in rows:
+            self.ids.append(row_id)
+            self.categories.append(category)
+            self.starts.append(start_ts)
+            self.ends.append(end_ts)
+            self.reach.append(max(self.reach[-1], end_ts) if self.reach else end_ts)
+
+    def __len__(self):
+        return len(self.starts)
+
+    # Номера интервалов, пересекающих [start_ts, end_ts); touching — считать и стыкующиеся
+    def overlapping(self, start_ts, end_ts, touching=False):
+        if touching:
+            lo = bisect.bisect_left(self.reach, start_ts)
+            hi = bisect.bisect_right(self.starts, end_ts)
+            return [k for k in range(lo, hi) if self.ends[k] >= start_ts]
+        lo = bisect.bisect_right(self.reach, start_ts)
+        hi = bisect.bisect_left(self.starts, end_ts)
+        return [k for k in range(lo, hi) if self.ends[k] > start_ts]
+
+    # Записи по номерам: [(id, категория, start_ts, end_ts)]
+    def rows(self, ks):
+        return [(self.ids[k], self.categories[k], self.starts[k], self.ends[k]) for k in ks]
+
+    def insert(self, row_id, category, start_ts, end_ts):
+        k = bisect.bisect_right(self.starts, start_ts)
+        self.ids.insert(k, row_id)
+        self.categories.insert(k, category)
+        self.starts.insert(k, start_ts)
+        self.ends.insert(k, end_ts)
+        self.reach.insert(k, None)
+        self._update_reach(k)
+
+    def remove(self, row_id, start_ts):
+        k = bisect.bisect_left(self.starts, start_ts)
+        while k < len(self.ids) and self.ids[k] != row_id:
+            k += 1
+        if k == len(self.ids):
+            return
+        for column in (self.ids, self.categories, self.starts, self.ends, self.reach):
+            del column[k]
+        self._update_reach(k)
+
+    # Пересчитывает reach начиная с k, пока значения не совпадут с прежними
+    def _update_reach(self, k):
+        reach = self.reach[k - 1] if k else -1
+        for i in range(k, len(self.ends)):
+            reach = max(reach, self.ends[i])
+            if self.reach[i] == reach:
+                break
+            self.reach[i] = reach
+
+
+# Индексы интервалов пользователей для проверки пересечений при записи.
+# Живёт в потоке записи Storage: индекс пользователя строится из time_logs
+# при первой записи (по idx_time_logs_user_start_ts) и дальше обновляется
+# вместе с таблицей. Давно не писавшие пользователи вытесняются (LRU).
+class IntervalStore:
+    def __init__(self, policy=OVERLAP_POLICY, max_users=INTERVAL_CACHE_USERS):
+        if policy not in POLICIES:
+            raise ValueError(f"OVERLAP_POLICY must be one of {', '.join(POLICIES)}")
+        self.policy = policy
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self.hydrations = 0
+
+    def __len__(self):
+        return len(self._users)
+
+    def user(self, conn, user_id):
+        user_id = int(user_id)
+        index = self._users.get(user_id)
+        if index is not None:
+            self._users.move_to_end(user_id)
+            return index
+        rows = conn.execute(
+            "SELECT id, category, start_ts, end_ts FROM time_logs "
+            "WHERE user_id = ? AND end_ts > start_ts ORDER BY start_ts", (user_id,)).fetchall()
+        index = self._users[user_id] = UserIntervals(rows)
+        self.hydrations += 1
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return index
+
+    # Изменения time_logs; для пользователей без индекса в памяти ничего не делают
+    def add(self, user_id, row_id, category, start_ts, end_ts):
+        index = self._users.get(int(user_id))
+        if index is not None and end_ts > start_ts:
+            index.insert(row_id, category, start_ts, end_ts)
+
+    def remove(self, user_id, row_id, start_ts):
+        index = self._users.get(int(user_id))
+        if index is not None:
+            index.remove(row_id, start_ts)
+
+    def clear(self):
+        self._users.clear()
+
+    # Куда можно записать интервал [start_ts, end_ts) категории category по политике
+    # (см. merge_span и settle). Идущий трекинг тоже занимает время.
+    # Возвращает (части [(start_ts, end_ts)], поглощённые записи [(id, start_ts, end_ts)]).
+    def place(self, conn, user_id, category, start_ts, end_ts, exclude_id=None, keep=None):
+        index = self.user(conn, user_id)
+        absorbed = []
+        if self.policy == "merge":
+            absorbed, start_ts, end_ts = merge_span(index.rows(index.overlapping(start_ts, end_ts, touching=True)),
+                                                    category, start_ts, end_ts, exclude_id)
+        active = conn.execute("SELECT category, start_ts FROM time_tracking WHERE user_id = ?",
+                              (user_id,)).fetchone()
+        return settle(self.policy, index.rows(index.overlapping(start_ts, end_ts)), active, start_ts, end_ts,
+                      absorbed, exclude_id, keep)
+
+
+# Покрывают ли записанные части pieces весь исходный интервал [start_ts, end_ts):
+# False — политика отрезала занятое время или отклонила часть
+def covers(pieces, start_ts, end_ts):
+    covered = sum(min(piece_end, end_ts) - max(piece_start, start_ts) for piece_start, piece_end in pieces)
+    return covered >= end_ts - start_ts
+
+
+# Политика merge: записи той же категории из rows [(id, категория, start_ts, end_ts)],
+# пересекающие [start_ts, end_ts] или стыкующиеся с ним, поглощаются, отрезок
+# расширяется до их границ. Возвращает (поглощённые [(id, start_ts, end_ts)], start_ts, end_ts).
+def merge_span(rows, category, start_ts, end_ts, exclude_id=None):
+    absorbed = [(row_id, row_start, row_end) for row_id, row_category, row_start, row_end in rows
+                if row_category == category and row_id != exclude_id]
+    for _, absorbed_start, absorbed_end in absorbed:
+        start_ts, end_ts = min(start_ts, absorbed_start), max(end_ts, absorbed_end)
+    return absorbed, start_ts, end_ts
+
+
+# Применяет политику к интервалу [start_ts, end_ts). rows — записи, пересекающие его,
+# по возрастанию начала; active — идущий трекинг (категория, start_ts) или None.
+# exclude_id — изменяемая запись (с собой она не пересекается); keep — граница,
+# которая при изменении остаётся на месте: из нескольких свободных частей
+# берётся та, что к ней примыкает. Общая для хранилищ SQLite и PostgreSQL.
+def settle(policy, rows, active, start_ts, end_ts, absorbed=(), exclude_id=None, keep=None):
+    absorbed_ids = {row_id for row_id, _, _ in absorbed}
+    conflicts = [(row_category, row_start, row_end) for row_id, row_category, row_start, row_end in rows
+                 if row_id != exclude_id and row_id not in absorbed_ids]
+    busy = [(conflict_start, conflict_end) for _, conflict_start, conflict_end in conflicts]
+    if active is not None and active[1] is not None and active[1] < end_ts:
+        conflicts.append((active[0], active[1], None))
+        busy.append((active[1], end_ts))
+
+    if not conflicts:
+        return [(start_ts, end_ts)], list(absorbed)
+    if policy == "reject":
+        raise OverlapError(conflicts)
+    pieces = subtract(start_ts, end_ts, busy)
+    if keep is not None:
+        pieces = [piece for piece in pieces if piece[0] <= keep <= piece[1]]
+    if not pieces:
+        raise OverlapError(conflicts)
+    # Поглощается только то, что целиком вошло в записываемые части
+    absorbed = [row for row in absorbed
+                if any(piece_start <= row[1] and row[2] <= piece_end for piece_start, piece_end in pieces)]
+    return pieces, absorbed
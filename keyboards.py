@@ -0,0 +1,103 @@
+import json
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+from aiohttp import FormData
+
+from categories import CATEGORIES, CATEGORY_MAPPING
+
+# Все постоянные клавиатуры бота собираются один раз при импорте.
+# Их JSON тоже считается заранее: KeyboardSession подставляет его в запрос
+# вместо model_dump + json.dumps на каждое сообщение.
+_payloads = {}
+
+
+def _compact(value):
+    # Так же, как aiogram: поля со значением None в запрос не попадают
+    if isinstance(value, dict):
+        return {key: _compact(item) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [_compact(item) for item in value]
+    return value
+
+
+def register(markup):
+    _payloads[id(markup)] = json.dumps(_compact(markup.model_dump(warnings=False)))
+    return markup
+
+
+# Готовый JSON клавиатуры из реестра или None
+def payload(markup):
+    return _payloads.get(id(markup))
+
+
+def _main_menu(has_active_tracking):
+    keyboard = []
+    if has_active_tracking:
+        keyboard.append([
+            KeyboardButton(text="⏺ Начать трекинг"), KeyboardButton(text="⏹ Завершить трекинг")
+        ])
+    else:
+        keyboard.append([
+            KeyboardButton(text="⏺ Начать трекинг")
+        ])
+    keyboard.append([
+        KeyboardButton(text="➕ Добавить трекинг"), KeyboardButton(text="✏ Изменить трекинг")
+    ])
+    keyboard.append([KeyboardButton(text="📊 Статистика")])
+    return register(ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True))
+
+
+def _category_menu(categories):
+    keyboard = []
+    # Группируем по две кнопки в ряд
+    for i in range(0, len(categories), 2):
+        keyboard.append([KeyboardButton(text=cat) for cat in categories[i:i + 2]])
+    # Добавляем кнопку "Назад" в отдельную строку
+    keyboard.append([KeyboardButton(text="⬅ Назад")])
+    return register(ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True))
+
+
+def _stats_menu():
+    keyboard = [[KeyboardButton(text="📅 Статистика за день"), KeyboardButton(text="📊 Статистика за неделю")],
+                [KeyboardButton(text="🗓 Статистика за месяц"), KeyboardButton(text="📈 Статистика за год")],
+                [KeyboardButton(text="⬅ Назад")]]
+    return register(ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True))
+
+
+# Выбор категории для трекинга в прошлом. В callback_data только код категории:
+# пользователя берём из callback.from_user, поэтому клавиатура общая для всех.
+def _track_category_menu():
+    buttons = [InlineKeyboardButton(text=category, callback_data=f"track_{code}")
+               for code, category in CATEGORY_MAPPING.items()]
+    return register(InlineKeyboardMarkup(inline_keyboard=[buttons[i:i + 2] for i in range(0, len(buttons), 2)]))
+
+
+MAIN_MENU = {False: _main_menu(False), True: _main_menu(True)}
+CATEGORY_MENU = _category_menu(CATEGORIES)
+STATS_MENU = _stats_menu()
+TRACK_CATEGORY_MENU = _track_category_menu()
+
+
+def main_menu(has_active_tracking):
+    return MAIN_MENU[bool(has_active_tracking)]
+
+
+# Сессия, которая берёт JSON клавиатур из реестра
+class KeyboardSession(AiohttpSession):
+    def build_form_data(self, bot, method):
+        markup = getattr(method, "reply_markup", None)
+        cached = payload(markup) if markup is not None else None
+        if cached is None:
+            return super().build_form_data(bot, method)
+        form = FormData(quote_fields=False)
+        files = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", cached)
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
@@ -0,0 +1,265 @@
+import asyncio
+import bisect
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 — HTTP-эндпоинт выключен
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "0"))  # Секунд между строками в лог, 0 — выключено
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "0.1"))  # Доля SQL-запросов, которые замеряются
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 13)
+GROUP_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+logger = logging.getLogger(__name__)
+
+
+def _labels_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+# Счётчики и гистограммы обновляются и из потоков SQLite (InstrumentedConnection),
+# а читаются в цикле событий: изменения и чтение идут под блокировкой метрики
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels_text(labels)} {value}")
+        return lines
+
+    def total(self):
+        with self._lock:
+            return sum(self.values.values())
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.values = {}  # labels -> [счётчики корзин..., сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    # Копия значений: серии меняются из других потоков
+    def _copy(self):
+        with self._lock:
+            return [(labels, list(series)) for labels, series in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in self._copy():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels_text(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels_text(labels + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels_text(labels)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_labels_text(labels)} {series[-1]}")
+        return lines
+
+    # Сумма и количество по каждому набору меток — для строк в лог
+    def totals(self):
+        return {",".join(f"{k}={v}" for k, v in labels): {"count": series[-1], "sum_ms": round(series[-2] * 1000, 1)}
+                for labels, series in self._copy()}
+
+
+# Реестр метрик процесса
+class Metrics:
+    def __init__(self, sample_rate=METRICS_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.handler_seconds = Histogram("bot_handler_seconds", "Handler execution time")
+        self.handler_errors = Counter("bot_handler_errors_total", "Handlers that raised")
+        self.sql_seconds = Histogram("bot_sql_seconds", "Sampled SQL statement time")
+        self.storage_seconds = Histogram("bot_storage_seconds", "Storage operation time including queueing")
+        self.commit_group_size = Histogram("bot_commit_group_size", "Storage writes committed in one transaction",
+                                           GROUP_BUCKETS)
+        self.render_seconds = Histogram("bot_chart_render_seconds", "Chart render time")
+        self.api_seconds = Histogram("bot_api_seconds", "Bot API request time")
+        self.api_calls_per_update = Histogram("bot_api_calls_per_update", "Outgoing Bot API calls per update",
+                                              COUNT_BUCKETS)
+        self.api_calls_saved = Counter("bot_api_calls_saved_total", "Messages merged into one reply")
+        self.send_wait_seconds = Histogram("bot_send_wait_seconds", "Time outgoing requests waited for a rate slot")
+        self.send_retries = Counter("bot_send_retries_total", "Requests retried after 429 Too Many Requests")
+        self.send_blocked = Counter("bot_send_blocked_total", "Sends that waited because the send queue was full")
+        self._gauges = {}
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    # Значение, которое вычисляется в момент чтения метрик (размер кеша и т.п.)
+    def gauge(self, name, fn):
+        self._gauges[name] = fn
+
+    def render(self):
+        lines = []
+        for metric in (self.handler_seconds, self.handler_errors, self.sql_seconds, self.storage_seconds,
+                       self.commit_group_size, self.render_seconds, self.api_seconds, self.api_calls_per_update, self.api_calls_saved,
+                       self.send_wait_seconds, self.send_retries, self.send_blocked):
+            lines.extend(metric.render())
+        for name, fn in self._gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {fn()}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        return {
+            "handlers": self.handler_seconds.totals(),
+            "storage": self.storage_seconds.totals(),
+            "commit_groups": self.commit_group_size.totals(),
+            "render": self.render_seconds.totals(),
+            "api": self.api_seconds.totals(),
+            "api_calls_saved": self.api_calls_saved.total(),
+            "send_wait": self.send_wait_seconds.totals(),
+            "gauges": {name: fn() for name, fn in self._gauges.items()},
+        }
+
+
+metrics = Metrics()
+
+# Счётчик вызовов Bot API в рамках текущего обновления
+_api_calls = contextvars.ContextVar("api_calls", default=None)
+
+
+# Внутренний middleware диспетчера: время каждого обработчика и число ответов на обновление
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        # Сообщения из таблицы маршрутов (routing.py) приходят в один общий обработчик
+        callback = data.get("route") or getattr(data.get("handler"), "callback", None)
+        name = getattr(callback, "__name__", "unknown")
+        calls = [0]
+        token = _api_calls.set(calls)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.handler_errors.inc(handler=name)
+            raise
+        finally:
+            metrics.handler_seconds.observe(time.perf_counter() - started, handler=name)
+            metrics.api_calls_per_update.observe(calls[0], handler=name)
+            _api_calls.reset(token)
+
+
+# Middleware сессии бота: время каждого запроса к Bot API (в т.ч. загрузки графиков)
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        calls = _api_calls.get()
+        if calls is not None:
+            calls[0] += 1
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            metrics.api_seconds.observe(time.perf_counter() - started, method=type(method).__name__)
+
+
+_SQL_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+(\w+)", re.IGNORECASE)
+_sql_labels = {}
+
+
+# "SELECT category, ... FROM time_logs ..." -> "SELECT time_logs"
+def _sql_label(sql):
+    label = _sql_labels.get(sql)
+    if label is None:
+        words = sql.split(None, 1)
+        verb = words[0].upper() if words else "?"
+        table = _SQL_TABLE.search(sql)
+        label = f"{verb} {table.group(1)}" if table else verb
+        _sql_labels[sql] = label
+    return label
+
+
+# Соединение SQLite, которое замеряет часть запросов (см. METRICS_SAMPLE_RATE)
+class InstrumentedConnection(sqlite3.Connection):
+    def execute(self, sql, *args):
+        if not metrics.sampled():
+            return super().execute(sql, *args)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            metrics.sql_seconds.observe(time.perf_counter() - started, statement=_sql_label(sql))
+
+    def executemany(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            metrics.sql_seconds.observe(time.perf_counter() - started, statement=_sql_label(sql))
+
+
+def setup(dp, bot):
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    bot.session.middleware(ApiMetricsMiddleware())
+
+
+async def _handle_metrics(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+
+async def _log_loop(interval):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info("metrics %s", json.dumps(metrics.snapshot(), ensure_ascii=False))
+
+
+# Поднимает /metrics на METRICS_HOST:METRICS_PORT и периодический вывод в лог
+async def start_exporter(host=METRICS_HOST, port=METRICS_PORT, log_interval=METRICS_LOG_INTERVAL):
+    runner = None
+    if port:
+        app = web.Application()
+        app.router.add_get("/metrics", _handle_metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info("Metrics on http://%s:%d/metrics", host, port)
+    task = asyncio.create_task(_log_loop(log_interval)) if log_interval else None
+    return runner, task
+
+
+async def stop_exporter(runner, task):
+    if task is not None:
+        task.cancel()
+    if runner is not None:
+        await runner.cleanup()
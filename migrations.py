@@ -0,0 +1,142 @@
+import logging
+
+import rollup
+
+logger = logging.getLogger(__name__)
+
+
+# 1: исходные таблицы. IF NOT EXISTS — чтобы миграция проходила на старой database.db
+def _create_tables(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS time_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        category TEXT,
+        date TEXT,
+        start_time TEXT,
+        end_time TEXT,
+        duration INTEGER  -- Длительность в минутах
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS time_tracking (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        category TEXT,
+        start_time TEXT
+    )
+    """)
+
+
+# 2: индексы под запросы статистики, последнего трекинга и активной сессии.
+# У пользователя может быть только одна активная сессия: старые дубликаты
+# удаляем так же, как это делал stop_tracking (остаётся последняя запись).
+def _add_indexes(conn):
+    conn.execute("""
+    DELETE FROM time_tracking
+    WHERE id NOT IN (SELECT MAX(id) FROM time_tracking GROUP BY user_id)
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_time_logs_user_date ON time_logs (user_id, date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_time_logs_user_start ON time_logs (user_id, start_time)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_time_tracking_user ON time_tracking (user_id)")
+
+
+# 3: время в секундах эпохи рядом со строками ISO, чтобы сравнивать и
+# суммировать интервалы без разбора строк
+def _add_epoch_columns(conn):
+    conn.execute("ALTER TABLE time_logs ADD COLUMN start_ts INTEGER")
+    conn.execute("ALTER TABLE time_logs ADD COLUMN end_ts INTEGER")
+    conn.execute("ALTER TABLE time_tracking ADD COLUMN start_ts INTEGER")
+    conn.execute("""
+    UPDATE time_logs SET start_ts = CAST(strftime('%s', start_time) AS INTEGER),
+                         end_ts = CAST(strftime('%s', end_time) AS INTEGER)
+    """)
+    conn.execute("UPDATE time_tracking SET start_ts = CAST(strftime('%s', start_time) AS INTEGER)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_time_logs_user_start_ts ON time_logs (user_id, start_ts)")
+
+
+# 4: предрасчитанные минуты по (пользователь, локальный день, категория).
+# Интервалы через полночь делятся между днями; заполняем из истории.
+def _add_daily_rollup(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS daily_rollup (
+        user_id INTEGER NOT NULL,
+        local_date TEXT NOT NULL,
+        category TEXT NOT NULL,
+        minutes INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, local_date, category)
+    ) WITHOUT ROWID
+    """)
+    rollup.rebuild(conn)
+
+
+# 5: состояния FSM (сценарии добавления и изменения трекинга), см. fsm_storage.py
+def _add_fsm_states(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        expires_at INTEGER NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_expires ON fsm_states (expires_at)")
+
+
+# 6: интервалы, заканчивающиеся после момента (сегодняшние для «Без трекинга»)
+def _add_end_ts_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_time_logs_user_end_ts ON time_logs (user_id, end_ts)")
+
+
+# 7: настройки пользователей (итоги дня) и индекс для закрытия забытых сессий
+def _add_users(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        digest_hour INTEGER,  -- Час отправки итогов дня по местному времени, NULL — не присылать
+        digest_date TEXT  -- Местная дата последних отправленных итогов
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_time_tracking_start_ts ON time_tracking (start_ts)")
+
+
+# 8: часовой пояс пользователя (/tz). Колонка date заполнялась то датой сервера,
+# то датой UTC; теперь это местная дата окончания в поясе пользователя.
+def _add_user_timezones(conn):
+    conn.execute("ALTER TABLE users ADD COLUMN tz TEXT")
+    rollup.recompute_dates(conn)
+
+
+# Порядок менять нельзя: номер миграции = её позиция в списке (PRAGMA user_version)
+MIGRATIONS = [
+    _create_tables,
+    _add_indexes,
+    _add_epoch_columns,
+    _add_daily_rollup,
+    _add_fsm_states,
+    _add_end_ts_index,
+    _add_users,
+    _add_user_timezones,
+]
+
+
+# Применяет все миграции новее PRAGMA user_version, каждую в своей транзакции.
+# BEGIN IMMEDIATE и повторное чтение версии внутри транзакции — чтобы несколько
+# процессов на общей базе не применили одну миграцию дважды.
+def migrate(conn):
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= len(MIGRATIONS):
+            conn.rollback()
+            return version
+        migration = MIGRATIONS[version]
+        logger.info("Applying migration %d: %s", version + 1, migration.__name__)
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
@@ -0,0 +1,228 @@
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from metrics import metrics
+
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))  # Сообщений в секунду на весь бот
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))  # Сообщений в секунду в один чат
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))  # Сколько сообщений в чат можно отправить подряд
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "1000"))  # Сколько отправок может ждать очереди
+SEND_RETRIES = int(os.getenv("SEND_RETRIES", "5"))  # Повторов после 429 Too Many Requests
+SEND_BACKOFF = float(os.getenv("SEND_BACKOFF", "1"))  # Добавка к retry_after при повторных 429, секунд
+
+# Приоритеты: ответы на действия пользователя уходят раньше рассылок
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+IDLE_CHATS_LIMIT = 10000  # После стольких чатов неиспользуемые корзины выбрасываются
+
+logger = logging.getLogger(__name__)
+
+_priority = contextvars.ContextVar("send_priority", default=INTERACTIVE)
+
+
+# Всё, что отправляется внутри блока, идёт с низким приоритетом:
+#     with outbox.bulk():
+#         await bot.send_message(...)
+@contextlib.contextmanager
+def bulk():
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    # Через сколько секунд появится токен (0 — есть сейчас)
+    def delay(self, now):
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds, now):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def idle(self, now):
+        return self.delay(now) == 0 and self.tokens >= self.burst
+
+
+# Очередь исходящих запросов к Bot API. Каждый запрос ждёт токен из общей
+# корзины (лимит бота) и из корзины своего чата; среди ожидающих первым
+# получает токен запрос с более высоким приоритетом, затем — более ранний.
+# У каждого чата своя очередь, а в общей куче лежат только их головы: чат без
+# токенов выходит из кучи до своего срока, поэтому выдача токена — O(log n)
+# и не перебирает запросы заторможенных чатов.
+# Пока очередь заполнена, новые отправки ждут свободного места.
+class SendScheduler:
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE, chat_burst=SEND_CHAT_BURST,
+                 queue_size=SEND_QUEUE_SIZE):
+        self.global_bucket = TokenBucket(global_rate, max(1, int(global_rate)))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chats = {}
+        self._queues = {}  # chat_id -> куча (приоритет, номер, chat_id, future) запросов чата
+        self._ready = []  # Куча голов очередей (приоритет, номер, chat_id) чатов, которые не ждут токена
+        self._timers = []  # Куча (когда, chat_id) чатов, ждущих токена своей корзины
+        self._sleeping = set()
+        self._depth = 0
+        self._seq = itertools.count()
+        self._slots = asyncio.Semaphore(queue_size)
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    @property
+    def depth(self):
+        return self._depth
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for queue in self._queues.values():
+            for _, _, _, future in queue:
+                future.cancel()
+        self._queues.clear()
+        self._ready.clear()
+        self._timers.clear()
+        self._sleeping.clear()
+        self._depth = 0
+
+    def _chat(self, chat_id):
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            bucket = self.chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    # Голова очереди чата попадает в общую кучу. Устаревшие записи кучи
+    # (голова с тех пор сменилась) отбрасываются при извлечении.
+    def _push_head(self, chat_id):
+        queue = self._queues.get(chat_id)
+        if queue and chat_id not in self._sleeping:
+            heapq.heappush(self._ready, queue[0][:3])
+
+    # Ждёт права отправить запрос в чат. Без запущенного планировщика
+    # (скрипты, бенчмарки) пропускает сразу.
+    async def acquire(self, chat_id, priority=INTERACTIVE):
+        if self._task is None:
+            return
+        if self._slots.locked():
+            metrics.send_blocked.inc(priority=PRIORITY_NAMES[priority])
+        async with self._slots:
+            future = asyncio.get_running_loop().create_future()
+            item = (priority, next(self._seq), chat_id, future)
+            queue = self._queues.setdefault(chat_id, [])
+            heapq.heappush(queue, item)
+            self._depth += 1
+            if queue[0] is item:
+                self._push_head(chat_id)
+            self._wakeup.set()
+            await future
+
+    # Telegram попросил подождать: чат не получает токенов seconds секунд, а весь
+    # бот — retry_after секунд (429 бывает и на общий лимит, тогда остальные
+    # чаты тоже получили бы отказ)
+    async def backoff(self, chat_id, seconds, retry_after=0):
+        if self._task is None:
+            await asyncio.sleep(seconds)
+        else:
+            now = time.monotonic()
+            self._chat(chat_id).block(seconds, now)
+            self.global_bucket.block(retry_after, now)
+
+    # Раздаёт токены ожидающим; возвращает, через сколько секунд пробовать снова
+    def _grant(self, now):
+        while self._timers and self._timers[0][0] <= now:
+            _, chat_id = heapq.heappop(self._timers)
+            self._sleeping.discard(chat_id)
+            self._push_head(chat_id)
+        while self._ready:
+            wait = self.global_bucket.delay(now)
+            if wait:
+                return wait if not self._timers else min(wait, self._timers[0][0] - now)
+            _, seq, chat_id = heapq.heappop(self._ready)
+            queue = self._queues.get(chat_id)
+            if not queue or queue[0][1] != seq or chat_id in self._sleeping:
+                continue
+            future = queue[0][3]
+            if not future.done():  # Отменённый отправитель токенов не тратит
+                chat_wait = self._chat(chat_id).delay(now)
+                if chat_wait:
+                    self._sleeping.add(chat_id)
+                    heapq.heappush(self._timers, (now + chat_wait, chat_id))
+                    continue
+                self.global_bucket.take()
+                self._chat(chat_id).take()
+                future.set_result(None)
+            heapq.heappop(queue)
+            self._depth -= 1
+            if queue:
+                self._push_head(chat_id)
+            else:
+                del self._queues[chat_id]
+        if len(self.chats) > IDLE_CHATS_LIMIT:
+            self.chats = {chat_id: bucket for chat_id, bucket in self.chats.items() if not bucket.idle(now)}
+        return self._timers[0][0] - now if self._timers else None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            wait = self._grant(time.monotonic())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+
+# Middleware сессии бота: все запросы с chat_id (send*, edit*, delete*)
+# проходят через SendScheduler; при 429 запрос повторяется после retry_after.
+class SendSchedulerMiddleware(BaseRequestMiddleware):
+    def __init__(self, scheduler, retries=SEND_RETRIES, backoff=SEND_BACKOFF):
+        self.scheduler = scheduler
+        self.retries = retries
+        self.backoff = backoff
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        priority = _priority.get()
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            await self.scheduler.acquire(chat_id, priority)
+            metrics.send_wait_seconds.observe(time.perf_counter() - started, priority=PRIORITY_NAMES[priority])
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.retries:
+                    raise
+                delay = e.retry_after + self.backoff * (2 ** attempt - 1)
+                logger.warning("Flood limit in chat %s, retrying %s in %.1f s", chat_id, type(method).__name__, delay)
+                metrics.send_retries.inc(method=type(method).__name__)
+                await self.scheduler.backoff(chat_id, delay, e.retry_after)
@@ -0,0 +1,501 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import asyncpg
+
+import range_stats
+from intervals import OVERLAP_POLICY, OverlapError, covers, merge_span, settle
+from metrics import metrics
+from storage_base import StorageBackend, daily_stats, weekly_stats
+from timeutils import local_date, local_midnight_ts, ts_to_utc_iso, utc_iso_to_ts
+
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "2"))  # Соединений в пуле сразу после старта
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))  # Больше соединений на реплику не открывается
+# Подготовленных запросов на соединение: asyncpg готовит каждый текст запроса
+# один раз и дальше только передаёт параметры
+PG_STATEMENT_CACHE = int(os.getenv("PG_STATEMENT_CACHE", "256"))
+PG_RECONNECT_DELAY = float(os.getenv("PG_RECONNECT_DELAY", "1"))  # Пауза перед переподключением слушателя
+
+MIGRATION_LOCK = (0x7462, 1)  # Ключи pg_advisory_lock: миграции применяет одна реплика
+
+logger = logging.getLogger(__name__)
+
+# Схема PostgreSQL. Время хранится только секундами эпохи: строки ISO и местные
+# даты получаются из них, поэтому смена пояса ничего не пересчитывает в таблицах.
+MIGRATIONS = [
+    """
+    CREATE TABLE time_logs (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        category TEXT NOT NULL,
+        start_ts BIGINT NOT NULL,
+        end_ts BIGINT NOT NULL,
+        duration INTEGER NOT NULL  -- Длительность в минутах
+    );
+    CREATE INDEX idx_time_logs_user_start ON time_logs (user_id, start_ts);
+    CREATE INDEX idx_time_logs_user_end ON time_logs (user_id, end_ts);
+
+    CREATE TABLE time_tracking (
+        user_id BIGINT PRIMARY KEY,
+        category TEXT NOT NULL,
+        start_ts BIGINT NOT NULL
+    );
+    CREATE INDEX idx_time_tracking_start ON time_tracking (start_ts);
+
+    CREATE TABLE users (
+        user_id BIGINT PRIMARY KEY,
+        digest_hour INTEGER,
+        digest_date DATE,
+        tz TEXT
+    );
+
+    CREATE TABLE fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        expires_at BIGINT NOT NULL
+    );
+    CREATE INDEX idx_fsm_states_expires ON fsm_states (expires_at);
+
+    -- Минуты из секунд с округлением как round() в Python (половина — к чётному)
+    CREATE FUNCTION round_minutes(seconds BIGINT) RETURNS BIGINT AS $$
+        SELECT CASE WHEN seconds % 60 = 30 AND (seconds / 60) % 2 = 0 THEN seconds / 60
+                    ELSE (seconds + 30) / 60 END
+    $$ LANGUAGE SQL IMMUTABLE;
+    """,
+]
+
+# Минуты по местным дням $3..$4 для пользователей $1 в поясах $2, считаются на
+# сервере: интервал режется по местным полуночам, часть дня получает разницу
+# округлённых накопленных минут, как в rollup.interval_minutes_by_day. Наружу
+# уходят только суммы (user_id, day, category, minutes).
+DAY_MINUTES = """
+    WITH zones AS (
+        SELECT * FROM unnest($1::bigint[], $2::text[]) AS z (user_id, tz)
+    ), bounds AS (
+        SELECT user_id, tz,
+               extract(epoch FROM $3::date::timestamp AT TIME ZONE tz)::bigint AS range_start,
+               extract(epoch FROM ($4::date + 1)::timestamp AT TIME ZONE tz)::bigint AS range_end
+        FROM zones
+    ), pieces AS (
+        SELECT l.user_id, l.category, l.start_ts, l.end_ts, d::date AS day,
+               extract(epoch FROM d AT TIME ZONE b.tz)::bigint AS day_start,
+               extract(epoch FROM (d + interval '1 day') AT TIME ZONE b.tz)::bigint AS day_end
+        FROM bounds b
+        JOIN time_logs l ON l.user_id = b.user_id AND l.end_ts > b.range_start AND l.start_ts < b.range_end
+        CROSS JOIN LATERAL generate_series((to_timestamp(l.start_ts) AT TIME ZONE b.tz)::date::timestamp,
+                                           (to_timestamp(l.end_ts - 1) AT TIME ZONE b.tz)::date::timestamp,
+                                           interval '1 day') AS d
+    )
+    SELECT user_id, day, category,
+           sum(round_minutes(least(end_ts, day_end) - start_ts)
+               - round_minutes(greatest(start_ts, day_start) - start_ts))::int AS minutes
+    FROM pieces
+    WHERE day BETWEEN $3 AND $4
+    GROUP BY user_id, day, category
+    HAVING sum(round_minutes(least(end_ts, day_end) - start_ts)
+               - round_minutes(greatest(start_ts, day_start) - start_ts)) > 0
+    ORDER BY user_id, day, category
+"""
+
+INSERT_LOG = "INSERT INTO time_logs (user_id, category, start_ts, end_ts, duration) VALUES ($1, $2, $3, $4, $5) " \
+             "RETURNING id"
+ACTIVE = "SELECT category, start_ts FROM time_tracking WHERE user_id = $1"
+# Записи, пересекающие [start_ts, end_ts) (или стыкующиеся с ним при touching), по возрастанию начала
+OVERLAPPING = "SELECT id, category, start_ts, end_ts FROM time_logs " \
+              "WHERE user_id = $1 AND start_ts < $3 AND end_ts > $2 AND end_ts > start_ts ORDER BY start_ts, id"
+TOUCHING = "SELECT id, category, start_ts, end_ts FROM time_logs " \
+           "WHERE user_id = $1 AND start_ts <= $3 AND end_ts >= $2 ORDER BY start_ts, id"
+
+
+def _minutes(start_ts, end_ts):
+    return round((end_ts - start_ts) / 60)
+
+
+def _count(status):
+    return int(status.rsplit(" ", 1)[-1])
+
+
+# Хранилище в PostgreSQL для нескольких реплик бота (DATABASE_URL=postgres://...).
+# Запросы идут через пул соединений asyncpg; записи одного пользователя
+# сериализуются pg_advisory_xact_lock(user_id), поэтому проверка пересечений
+# и запись интервала не перемешиваются между репликами. Статистика считается
+# на сервере запросом DAY_MINUTES — отдельная таблица daily_rollup не нужна.
+# Активная сессия не кешируется в памяти: её может начать или закончить другая
+# реплика. Пояса пользователей и версии данных реплики узнают друг от друга
+# через LISTEN/NOTIFY (каналы user_tz и user_data).
+class PostgresStorage(StorageBackend):
+    def __init__(self, dsn, min_size=PG_POOL_MIN, max_size=PG_POOL_MAX, statement_cache=PG_STATEMENT_CACHE,
+                 policy=OVERLAP_POLICY):
+        super().__init__()
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_cache = statement_cache
+        self.policy = policy
+        self._pool = None
+        self._listener = None
+        self._closing = False
+
+    async def start(self):
+        if self._pool is not None:
+            return
+        self._closing = False
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size,
+                                               statement_cache_size=self.statement_cache)
+        async with self._pool.acquire() as conn:
+            await _migrate(conn)
+        await self._listen()
+
+    async def close(self):
+        if self._pool is None:
+            return
+        self._closing = True
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+        await self._pool.close()
+        self._pool = None
+
+    # Отдельное соединение для уведомлений других реплик. Пояса перечитываются
+    # после подписки, чтобы не пропустить изменения, сделанные до неё.
+    async def _listen(self):
+        self._listener = await asyncpg.connect(self.dsn)
+        await self._listener.add_listener("user_tz", self._on_notify)
+        await self._listener.add_listener("user_data", self._on_notify)
+        self._listener.add_termination_listener(self._on_listener_lost)
+        rows = await self._listener.fetch("SELECT user_id, tz FROM users WHERE tz IS NOT NULL")
+        self._timezones = {row["user_id"]: row["tz"] for row in rows}
+
+    def _on_notify(self, conn, pid, channel, payload):
+        if channel == "user_tz":
+            user_id, _, name = payload.partition(":")
+            self._set_tz_name(user_id, name or None)
+            self._bump(user_id)
+        else:
+            self._bump(payload)
+
+    def _on_listener_lost(self, conn):
+        if not self._closing:
+            logger.warning("PostgreSQL listener connection lost, reconnecting")
+            asyncio.get_running_loop().create_task(self._relisten())
+
+    async def _relisten(self):
+        while not self._closing:
+            await asyncio.sleep(PG_RECONNECT_DELAY)
+            try:
+                await self._listen()
+                return
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("PostgreSQL listener reconnect failed: %s", e)
+
+    # Соединение из пула для чтения
+    @contextlib.asynccontextmanager
+    async def _read(self, op):
+        started = time.perf_counter()
+        try:
+            async with self._pool.acquire() as conn:
+                yield conn
+        finally:
+            metrics.storage_seconds.observe(time.perf_counter() - started, op=op, kind="read")
+
+    # Транзакция записи. С user_id берётся транзакционная блокировка пользователя,
+    # а после фиксации другие реплики получают user_data с его id.
+    @contextlib.asynccontextmanager
+    async def _write(self, op, user_id=None):
+        started = time.perf_counter()
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.transaction():
+                    if user_id is not None:
+                        await conn.execute("SELECT pg_advisory_xact_lock($1)", int(user_id))
+                    yield conn
+                    if user_id is not None:
+                        await conn.execute("SELECT pg_notify('user_data', $1)", str(user_id))
+        finally:
+            metrics.storage_seconds.observe(time.perf_counter() - started, op=op, kind="write")
+        if user_id is not None:
+            self._bump(user_id)
+
+    def gauges(self):
+        return {
+            "bot_db_pool_size": lambda: self._pool.get_size() if self._pool else 0,
+            "bot_db_pool_idle": lambda: self._pool.get_idle_size() if self._pool else 0,
+        }
+
+    # --- Трекинг ---
+
+    async def start_tracking(self, user_id, category):
+        async with self._write("start_tracking", user_id) as conn:
+            # Новая сессия заменяет незавершённую
+            await conn.execute("""
+                INSERT INTO time_tracking (user_id, category, start_ts) VALUES ($1, $2, $3)
+                ON CONFLICT (user_id) DO UPDATE SET category = excluded.category, start_ts = excluded.start_ts
+            """, user_id, category, int(time.time()))
+
+    async def stop_tracking(self, user_id):
+        async with self._write("stop_tracking", user_id) as conn:
+            row = await conn.fetchrow("DELETE FROM time_tracking WHERE user_id = $1 RETURNING category, start_ts",
+                                      user_id)
+            if row is None:
+                return None, None
+            end_ts = int(time.time())
+            minutes = _minutes(row["start_ts"], end_ts)
+            await conn.execute(INSERT_LOG, user_id, row["category"], row["start_ts"], end_ts, minutes)
+        return row["category"], minutes
+
+    async def check_active_tracking(self, user_id):
+        async with self._read("check_active_tracking") as conn:
+            return await conn.fetchval("SELECT EXISTS (SELECT 1 FROM time_tracking WHERE user_id = $1)", user_id)
+
+    # Забытые сессии шарда записываются длиной max_seconds через политику
+    # пересечений (как storage._close_stale_sessions). Пользователи блокируются
+    # по возрастанию id до удаления сессий, в том же порядке, что и везде.
+    async def close_stale_sessions(self, max_seconds, shard=(0, 1)):
+        index, count = shard
+        cutoff_ts = int(time.time()) - max_seconds
+        async with self._write("close_stale_sessions") as conn:
+            user_ids = [row["user_id"] for row in await conn.fetch(
+                "SELECT user_id FROM time_tracking WHERE start_ts < $1 AND user_id % $2 = $3 ORDER BY user_id",
+                cutoff_ts, count, index)]
+            if not user_ids:
+                return []
+            await conn.execute("SELECT pg_advisory_xact_lock(user_id) FROM unnest($1::bigint[]) AS user_id", user_ids)
+            # Сначала удаляем сессии, иначе каждая пересекалась бы сама с собой
+            rows = await conn.fetch("DELETE FROM time_tracking WHERE user_id = ANY($1::bigint[]) AND start_ts < $2 "
+                                    "RETURNING user_id, category, start_ts", user_ids, cutoff_ts)
+            closed = []
+            for user_id, category, start_ts in sorted(tuple(row) for row in rows):
+                pieces = await self._place_or_none(conn, user_id, category, start_ts, start_ts + max_seconds) or []
+                closed.append((user_id, category, sum(_minutes(piece_start, piece_end)
+                                                      for piece_start, piece_end in pieces)))
+            await conn.execute("SELECT pg_notify('user_data', user_id::text) FROM unnest($1::bigint[]) AS user_id",
+                               [user_id for user_id, _, _ in closed])
+        for user_id, _, _ in closed:
+            self._bump(user_id)
+        return closed
+
+    # --- История ---
+
+    # Куда записать интервал по политике пересечений: те же merge_span и settle,
+    # что у intervals.IntervalStore, только записи берутся запросом к базе
+    async def _place(self, conn, user_id, category, start_ts, end_ts, exclude_id=None, keep=None):
+        absorbed = []
+        if self.policy == "merge":
+            rows = await conn.fetch(TOUCHING, user_id, start_ts, end_ts)
+            absorbed, start_ts, end_ts = merge_span([tuple(row) for row in rows], category, start_ts, end_ts,
+                                                    exclude_id)
+        rows = await conn.fetch(OVERLAPPING, user_id, start_ts, end_ts)
+        active = await conn.fetchrow(ACTIVE, user_id)
+        pieces, absorbed = settle(self.policy, [tuple(row) for row in rows], active and tuple(active),
+                                  start_ts, end_ts, absorbed, exclude_id, keep)
+        if absorbed:
+            await conn.execute("DELETE FROM time_logs WHERE id = ANY($1::bigint[])", [row[0] for row in absorbed])
+        return pieces
+
+    # Записывает интервал по политике; записанные части или None, если он отклонён
+    async def _place_or_none(self, conn, user_id, category, start_ts, end_ts):
+        try:
+            pieces = await self._place(conn, user_id, category, start_ts, end_ts)
+        except OverlapError:
+            return None
+        await conn.executemany(INSERT_LOG, [(user_id, category, piece_start, piece_end,
+                                             _minutes(piece_start, piece_end)) for piece_start, piece_end in pieces])
+        return pieces
+
+    async def add_tracking(self, user_id, category, start_time_iso, end_time_iso):
+        async with self._write("add_tracking", user_id) as conn:
+            pieces = await self._place(conn, user_id, category, utc_iso_to_ts(start_time_iso), utc_iso_to_ts(end_time_iso))
+            await conn.executemany(INSERT_LOG, [(user_id, category, start_ts, end_ts, _minutes(start_ts, end_ts))
+                                                for start_ts, end_ts in pieces])
+        return pieces
+
+    async def get_last_tracking(self, user_id):
+        async with self._read("get_last_tracking") as conn:
+            row = await conn.fetchrow("SELECT id, category, start_ts, end_ts FROM time_logs WHERE user_id = $1 "
+                                      "ORDER BY start_ts DESC, id DESC LIMIT 1", user_id)
+        if row is None:
+            return None
+        return (row["id"], row["category"], ts_to_utc_iso(row["start_ts"]), ts_to_utc_iso(row["end_ts"]),
+                local_date(row["end_ts"], self.tz(user_id)))
+
+    # Меняет одну границу записи пользователя (как storage._update_interval)
+    async def _update_interval(self, op, user_id, tracking_id, column, time_iso):
+        tracking_id = int(tracking_id)
+        async with self._write(op, user_id) as conn:
+            row = await conn.fetchrow("SELECT category, start_ts, end_ts FROM time_logs WHERE id = $1 AND user_id = $2",
+                                      tracking_id, user_id)
+            if row is None:
+                return None
+            category, start_ts, end_ts = row
+            if column == "start":
+                new_start, new_end, keep = utc_iso_to_ts(time_iso), end_ts, end_ts
+            else:
+                new_start, new_end, keep = start_ts, utc_iso_to_ts(time_iso), start_ts
+            pieces = await self._place(conn, user_id, category, new_start, new_end, exclude_id=tracking_id, keep=keep)
+            new_start, new_end = pieces[0]
+            await conn.execute("UPDATE time_logs SET start_ts = $1, end_ts = $2, duration = $3 WHERE id = $4",
+                               new_start, new_end, _minutes(new_start, new_end), tracking_id)
+        return new_start, new_end
+
+    async def update_start_time(self, user_id, tracking_id, start_time_iso):
+        return await self._update_interval("update_start_time", user_id, tracking_id, "start", start_time_iso)
+
+    async def update_end_time(self, user_id, tracking_id, end_time_iso):
+        return await self._update_interval("update_end_time", user_id, tracking_id, "end", end_time_iso)
+
+    async def export_chunk(self, user_id, after_id, limit):
+        async with self._read("export_chunk") as conn:
+            rows = await conn.fetch("SELECT id, category, start_ts, end_ts, duration FROM time_logs "
+                                    "WHERE user_id = $1 AND id > $2 ORDER BY id LIMIT $3", user_id, after_id, limit)
+        return [(row["id"], row["category"], ts_to_utc_iso(row["start_ts"]), ts_to_utc_iso(row["end_ts"]), row["duration"])
+                for row in rows]
+
+    # Уже записанные интервалы и повторы внутри пачки пропускаются, остальные
+    # проходят через политику пересечений (как storage._import_logs)
+    async def import_logs(self, user_id, rows):
+        if not rows:
+            return 0, 0, 0
+        imported = trimmed = rejected = 0
+        async with self._write("import_logs", user_id) as conn:
+            existing = {tuple(row) for row in await conn.fetch(
+                "SELECT category, start_ts, end_ts FROM time_logs WHERE user_id = $1 AND start_ts BETWEEN $2 AND $3",
+                user_id, min(row[5] for row in rows), max(row[5] for row in rows))}
+            for row in rows:
+                category, start_ts, end_ts = row[0], row[5], row[6]
+                if (category, start_ts, end_ts) in existing:
+                    continue
+                existing.add((category, start_ts, end_ts))
+                pieces = await self._place_or_none(conn, user_id, category, start_ts, end_ts)
+                if pieces is None:
+                    rejected += 1
+                    continue
+                imported += 1
+                trimmed += not covers(pieces, start_ts, end_ts)
+        return imported, trimmed, rejected
+
+    # --- Статистика ---
+
+    async def get_daily_stats(self, user_id):
+        local_tz = self.tz(user_id)
+        now_local = datetime.now(local_tz)
+        today = now_local.date()
+        midnight_ts = local_midnight_ts(local_tz, today)
+        now_ts = int(now_local.timestamp())
+        async with self._read("get_daily_stats") as conn:
+            rows = await conn.fetch(DAY_MINUTES, [user_id], [local_tz.zone], today, today)
+            busy = await conn.fetch("SELECT start_ts, end_ts FROM time_logs "
+                                    "WHERE user_id = $1 AND end_ts > $2 AND start_ts < $3", user_id, midnight_ts, now_ts)
+            active = await conn.fetchrow(ACTIVE, user_id)
+        return daily_stats([(row["category"], row["minutes"]) for row in rows], [tuple(row) for row in busy],
+                           active and tuple(active), midnight_ts, now_ts)
+
+    async def get_weekly_stats(self, user_id):
+        local_tz = self.tz(user_id)
+        now_local = datetime.now(local_tz)
+        today = now_local.date()
+        async with self._read("get_weekly_stats") as conn:
+            rows = await conn.fetch(DAY_MINUTES, [user_id], [local_tz.zone], today - timedelta(days=6), today)
+        return weekly_stats([(row["day"].isoformat(), row["category"], row["minutes"]) for row in rows],
+                            now_local, local_tz)
+
+    async def get_range_stats(self, user_id, first_day, last_day):
+        return (await self.get_range_stats_bulk([user_id], first_day, last_day))[user_id]
+
+    # Суммы по дням всех пользователей одним запросом DAY_MINUTES
+    async def get_range_stats_bulk(self, user_ids, first_day, last_day):
+        rows = {user_id: [] for user_id in user_ids}
+        async with self._read("get_range_stats") as conn:
+            for row in await conn.fetch(DAY_MINUTES, list(user_ids), [self.tz(user_id).zone for user_id in user_ids],
+                                        first_day, last_day):
+                rows[row["user_id"]].append((row["day"].isoformat(), row["category"], row["minutes"]))
+            active = {row["user_id"]: (row["category"], row["start_ts"]) for row in await conn.fetch(
+                "SELECT user_id, category, start_ts FROM time_tracking WHERE user_id = ANY($1::bigint[])",
+                list(user_ids))}
+        now_ts = int(time.time())
+        return {user_id: range_stats.build(rows[user_id], first_day, last_day, active.get(user_id), now_ts,
+                                           self.tz(user_id))
+                for user_id in user_ids}
+
+    # --- Пользователи ---
+
+    # Местные даты не хранятся, пересчитывать нечего: меняется только users.tz
+    async def set_timezone(self, user_id, name):
+        async with self._write("set_timezone", user_id) as conn:
+            await conn.execute("INSERT INTO users (user_id, tz) VALUES ($1, $2) "
+                               "ON CONFLICT (user_id) DO UPDATE SET tz = excluded.tz", user_id, name)
+            await conn.execute("SELECT pg_notify('user_tz', $1)", f"{user_id}:{name or ''}")
+        self._set_tz_name(user_id, name)
+
+    async def set_digest(self, user_id, hour):
+        async with self._write("set_digest") as conn:
+            await conn.execute("INSERT INTO users (user_id, digest_hour) VALUES ($1, $2) "
+                               "ON CONFLICT (user_id) DO UPDATE SET digest_hour = excluded.digest_hour", user_id, hour)
+
+    async def digest_timezones(self, shard=(0, 1)):
+        index, count = shard
+        async with self._read("digest_timezones") as conn:
+            rows = await conn.fetch("SELECT DISTINCT tz FROM users WHERE digest_hour IS NOT NULL AND user_id % $1 = $2",
+                                    count, index)
+        return [row["tz"] for row in rows]
+
+    async def due_digests(self, tz, hour, today, shard=(0, 1), after_id=0, limit=500):
+        index, count = shard
+        async with self._read("due_digests") as conn:
+            rows = await conn.fetch("""
+                SELECT user_id FROM users
+                WHERE user_id > $1 AND tz IS NOT DISTINCT FROM $2 AND digest_hour <= $3
+                      AND (digest_date IS NULL OR digest_date < $4) AND user_id % $5 = $6
+                ORDER BY user_id LIMIT $7
+            """, after_id, tz, hour, today, count, index, limit)
+        return [row["user_id"] for row in rows]
+
+    async def mark_digests(self, user_ids, today, disabled=()):
+        async with self._write("mark_digests") as conn:
+            await conn.execute("UPDATE users SET digest_date = $1 WHERE user_id = ANY($2::bigint[])", today,
+                               list(user_ids))
+            await conn.execute("UPDATE users SET digest_hour = NULL WHERE user_id = ANY($1::bigint[])", list(disabled))
+
+    # --- Состояния FSM ---
+
+    async def fsm_load(self, key, now):
+        async with self._read("fsm_load") as conn:
+            row = await conn.fetchrow("SELECT state, data, expires_at FROM fsm_states WHERE key = $1 AND expires_at > $2",
+                                      key, now)
+        return row and tuple(row)
+
+    async def fsm_save(self, upserts, deletes):
+        async with self._write("fsm_save") as conn:
+            if upserts:
+                await conn.executemany("""
+                    INSERT INTO fsm_states (key, state, data, expires_at) VALUES ($1, $2, $3, $4)
+                    ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data,
+                                                    expires_at = excluded.expires_at
+                """, upserts)
+            if deletes:
+                await conn.execute("DELETE FROM fsm_states WHERE key = ANY($1::text[])", list(deletes))
+
+    async def fsm_delete_expired(self, now):
+        async with self._write("fsm_delete_expired") as conn:
+            return _count(await conn.execute("DELETE FROM fsm_states WHERE expires_at <= $1", now))
+
+
+# Применяет миграции новее schema_version, каждую в своей транзакции. Реплики
+# стартуют одновременно, поэтому миграции идут под pg_advisory_lock.
+async def _migrate(conn):
+    await conn.execute("SELECT pg_advisory_lock($1, $2)", *MIGRATION_LOCK)
+    try:
+        await conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        version = await conn.fetchval("SELECT max(version) FROM schema_version") or 0
+        for number, sql in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info("Applying PostgreSQL migration %d", number)
+            async with conn.transaction():
+                await conn.execute(sql)
+                await conn.execute("INSERT INTO schema_version (version) VALUES ($1)", number)
+        return len(MIGRATIONS)
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1, $2)", *MIGRATION_LOCK)
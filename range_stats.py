@@ -0,0 +1,182 @@
+import re
+from datetime import date, datetime, timedelta
+
+from timeutils import get_local_tz, local_midnight_ts, split_by_local_day
+
+UNTRACKED = "🕰 Без трекинга"
+DAILY_BREAKDOWN_DAYS = 31  # Разбивку по дням показываем только для коротких периодов
+MESSAGE_LIMIT = 4096
+
+# Названия периодов для /stats и кнопок
+PERIODS = {
+    "week": "week", "неделя": "week",
+    "month": "month", "месяц": "month",
+    "quarter": "quarter", "квартал": "quarter",
+    "year": "year", "год": "year",
+}
+
+_CUSTOM_RANGE = re.compile(r"^(\d{1,2})\.(\d{1,2})(?:\.(\d{4}))?\s*[-–]\s*(\d{1,2})\.(\d{1,2})(?:\.(\d{4}))?$")
+
+
+# Дата из частей DD.MM периода; несуществующий день — понятная ошибка вместо текста datetime
+def _date(year, month, day):
+    try:
+        return date(year, int(month), int(day))
+    except ValueError:
+        raise ValueError(f"Некорректная дата {day}.{month}") from None
+
+
+# Период -> (первый день, последний день) в локальных датах; последний — не позже сегодня.
+# Понимает week/month/quarter/year (и по-русски) и «01.01-31.03» / «01.12.2025-31.01.2026».
+# Период без года, который в этом году ещё не начался, — прошлогодний.
+def parse_period(text, today):
+    text = (text or "month").strip().lower()
+    period = PERIODS.get(text)
+    if period == "week":
+        return today - timedelta(days=6), today
+    if period == "month":
+        return today.replace(day=1), today
+    if period == "quarter":
+        return date(today.year, (today.month - 1) // 3 * 3 + 1, 1), today
+    if period == "year":
+        return date(today.year, 1, 1), today
+
+    match = _CUSTOM_RANGE.match(text)
+    if not match:
+        raise ValueError("Период: week, month, quarter, year или DD.MM-DD.MM")
+    d1, m1, y1, d2, m2, y2 = match.groups()
+    last = _date(int(y2 or today.year), m2, d2)
+    first = _date(int(y1 or last.year), m1, d1)
+    if not y1 and first > last:  # 01.12-31.01: начало в прошлом году
+        first = _date(first.year - 1, m1, d1)
+    if not y1 and not y2 and first > today:  # 01.11-30.11 в октябре: прошлогодний ноябрь
+        first, last = _date(first.year - 1, m1, d1), _date(last.year - 1, m2, d2)
+    if first > last:
+        raise ValueError("Начало периода позже окончания")
+    if first > today:
+        raise ValueError("Период ещё не начался")
+    return first, min(last, today)
+
+
+# Итоги за период. Минуты по дням берутся из daily_rollup, где интервалы уже
+# разрезаны по местной полуночи: интервал, начатый до периода или переходящий
+# через его границу, попадает в период ровно своей частью. Точно досчитывается
+# только край «сейчас»: незавершённый трекинг, которого ещё нет в daily_rollup.
+class RangeStats:
+    def __init__(self, first_day, last_day):
+        self.first_day = first_day
+        self.last_day = last_day
+        self.totals = {}  # категория -> минуты
+        self.days = {}  # дата -> {категория: минуты}
+        self.untracked_by_day = {}  # дата -> минуты без трекинга
+        self.elapsed = 0  # Минут в периоде до текущего момента
+
+    @property
+    def tracked(self):
+        return sum(self.totals.values())
+
+    @property
+    def untracked(self):
+        return sum(self.untracked_by_day.values())
+
+    # Все дни периода по порядку: [(дата, {категория: минуты, UNTRACKED: минуты})]
+    def by_day(self):
+        return [(day, {**self.days.get(day, {}), UNTRACKED: untracked})
+                for day, untracked in sorted(self.untracked_by_day.items())]
+
+    def add(self, day, category, minutes):
+        if minutes <= 0:
+            return
+        day_stats = self.days.setdefault(day, {})
+        day_stats[category] = day_stats.get(category, 0) + minutes
+        self.totals[category] = self.totals.get(category, 0) + minutes
+
+
+def _day_minutes(tz, day, now_ts):
+    start = local_midnight_ts(tz, day)
+    end = min(local_midnight_ts(tz, day + timedelta(days=1)), now_ts)  # 23 или 25 часов в дни перевода часов
+    return max(0, (end - start) // 60)
+
+
+# Синхронная операция для Storage.read: суммы по категориям и дням одним запросом.
+# Длинные периоды (год и больше) читаются так же, без отдельных месячных корзин:
+# daily_rollup уже сводка по дням, и год — это не больше 366 строк на категорию,
+# выбранных по первичному ключу (user_id, local_date, …). Вторая таблица сводок
+# требовала бы согласованной записи при каждом изменении истории ради долей миллисекунды.
+def load_range(conn, user_id, first_day, last_day):
+    return conn.execute("""
+        SELECT local_date, category, minutes FROM daily_rollup
+        WHERE user_id = ? AND local_date BETWEEN ? AND ?
+    """, (user_id, first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d"))).fetchall()
+
+
+# То же для многих пользователей одним запросом: user_id -> строки load_range
+def load_users(conn, user_ids, first_day, last_day):
+    result = {user_id: [] for user_id in user_ids}
+    placeholders = ",".join("?" * len(user_ids))
+    rows = conn.execute(f"""
+        SELECT user_id, local_date, category, minutes FROM daily_rollup
+        WHERE user_id IN ({placeholders}) AND local_date BETWEEN ? AND ?
+    """, (*user_ids, first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d"))).fetchall()
+    for user_id, local_date, category, minutes in rows:
+        result[user_id].append((local_date, category, minutes))
+    return result
+
+
+# Собирает RangeStats из строк load_range; active — незавершённый трекинг (категория, start_ts) или None
+def build(rows, first_day, last_day, active=None, now_ts=None, tz=None):
+    tz = tz or get_local_tz()
+    now_ts = int(now_ts if now_ts is not None else datetime.now(tz).timestamp())
+    stats = RangeStats(first_day, last_day)
+    for local_date, category, minutes in rows:
+        stats.add(date.fromisoformat(local_date), category, minutes)
+
+    if active is not None:
+        category, start_ts = active
+        range_start = local_midnight_ts(tz, first_day)
+        range_end = min(local_midnight_ts(tz, last_day + timedelta(days=1)), now_ts)
+        if start_ts is not None and start_ts < range_end:
+            for day, seconds in split_by_local_day(max(start_ts, range_start), range_end, tz):
+                stats.add(day, category, round(seconds / 60))
+
+    day = first_day
+    while day <= last_day:
+        minutes = _day_minutes(tz, day, now_ts)
+        stats.elapsed += minutes
+        tracked = sum(stats.days.get(day, {}).values())
+        stats.untracked_by_day[day] = max(0, minutes - tracked)
+        day += timedelta(days=1)
+    return stats
+
+
+def _duration(minutes):
+    return f"{minutes // 60} ч {minutes % 60} мин"
+
+
+def format_stats(stats):
+    days = (stats.last_day - stats.first_day).days + 1
+    if days == 1:
+        lines = [f"📊 *Статистика за {stats.first_day:%d.%m.%Y}*"]
+    else:
+        lines = [f"📊 *Статистика {stats.first_day:%d.%m.%Y}–{stats.last_day:%d.%m.%Y}* ({days} дн.)"]
+    if not stats.totals:
+        lines.append("Нет данных за этот период.")
+        return "\n".join(lines)
+    elapsed = stats.elapsed or 1
+    for category, minutes in sorted(stats.totals.items(), key=lambda item: -item[1]):
+        lines.append(f"📌 {category}: {_duration(minutes)} ({minutes * 100 // elapsed}%)")
+    lines.append(f"{UNTRACKED}: {_duration(stats.untracked)}")
+    if days > 1:
+        lines.append(f"В среднем за день отмечено: {_duration(stats.tracked // days)}")
+
+    if 1 < days <= DAILY_BREAKDOWN_DAYS:
+        lines.append("")
+        for day in sorted(stats.days):
+            parts = ", ".join(f"{category.split(' ', 1)[0]} {_duration(minutes)}"
+                              for category, minutes in sorted(stats.days[day].items(), key=lambda item: -item[1]))
+            line = f"*{day:%d.%m}*: {parts}"
+            if sum(len(text) + 1 for text in lines) + len(line) > MESSAGE_LIMIT - 100:
+                lines.append("…")
+                break
+            lines.append(line)
+    return "\n".join(lines)
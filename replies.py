@@ -0,0 +1,107 @@
+import html
+import logging
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup
+
+from metrics import metrics
+
+CAPTION_LIMIT = 1024  # Ограничение Telegram на подпись к фото
+
+logger = logging.getLogger(__name__)
+
+
+# Экранирует произвольный текст (например, текст исключения) для parse_mode ответа:
+# иначе «_», «*» или «[» из него ломают разметку и Telegram отклоняет всё сообщение
+def escape(text, parse_mode):
+    if parse_mode == "Markdown":
+        for char in "_*`[":
+            text = text.replace(char, "\\" + char)
+    elif parse_mode == "HTML":
+        text = html.escape(text, quote=False)
+    return text
+
+
+# Ответ на одно действие пользователя, собранный в одно сообщение.
+# Раньше обработчики слали 2–3 сообщения подряд (результат, статистика,
+# «Главное меню:» ради клавиатуры); теперь строки склеиваются, график
+# уходит с подписью, клавиатура цепляется к тому же сообщению.
+class Reply:
+    def __init__(self, text=None, parse_mode=None):
+        self.parts = []
+        self.parse_mode = None
+        self.photo = None
+        self.markup = None
+        self.menu_merged = False
+        if text:
+            self.add(text, parse_mode)
+
+    def add(self, text, parse_mode=None):
+        self.parts.append(text)
+        if parse_mode:
+            self.parse_mode = parse_mode
+        return self
+
+    def attach_photo(self, photo):
+        self.photo = photo
+        return self
+
+    def keyboard(self, markup):
+        self.markup = markup
+        return self
+
+    # Клавиатура главного меню, которая раньше уходила отдельным сообщением «Главное меню:»
+    def menu(self, markup):
+        self.menu_merged = True
+        return self.keyboard(markup)
+
+    @property
+    def text(self):
+        return "\n\n".join(self.parts)
+
+    # Сколько сообщений ушло бы без склейки: по одному на часть, фото
+    # и отдельное «Главное меню:» под клавиатуру
+    def _separate_calls(self):
+        return len(self.parts) + (self.photo is not None) + self.menu_merged
+
+    def _count(self, calls):
+        saved = self._separate_calls() - calls
+        if saved > 0:
+            metrics.api_calls_saved.inc(saved)
+
+    # Отправляет ответ новым сообщением; возвращает отправленное сообщение
+    async def send(self, message):
+        text = self.text
+        if self.photo is not None:
+            if len(text) <= CAPTION_LIMIT:
+                try:
+                    sent = await message.answer_photo(self.photo, caption=text or None, parse_mode=self.parse_mode,
+                                                      reply_markup=self.markup)
+                    self._count(1)
+                    return sent
+                except TelegramBadRequest as e:
+                    logger.warning("Photo reply failed, sending text only: %s", e)
+                    self.photo = None
+                    self.add(escape(f"Ошибка при отправке изображения: {e}", self.parse_mode))
+                    text = self.text
+            else:
+                # Длинная подпись не влезает: фото и текст отдельно, клавиатура у текста
+                sent = await message.answer_photo(self.photo)
+                await message.answer(text, parse_mode=self.parse_mode, reply_markup=self.markup)
+                self._count(2)
+                return sent
+        sent = await message.answer(text, parse_mode=self.parse_mode, reply_markup=self.markup)
+        self._count(1)
+        return sent
+
+    # Для инлайн-сценариев: заменяет текст сообщения с кнопками, на которое нажали.
+    # Обычную клавиатуру к редактируемому сообщению не прицепить — тогда шлём новое.
+    async def edit(self, callback):
+        if self.photo is None and (self.markup is None or isinstance(self.markup, InlineKeyboardMarkup)):
+            try:
+                await callback.message.edit_text(self.text, parse_mode=self.parse_mode, reply_markup=self.markup)
+                self._count(1)
+                return callback.message
+            except TelegramBadRequest as e:
+                logger.debug("Cannot edit message in place: %s", e)
+        return await self.send(callback.message)
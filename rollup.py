@@ -0,0 +1,136 @@
+import argparse
+import logging
+import sqlite3
+
+from timeutils import get_local_tz, get_tz, local_date, split_by_local_day
+
+logger = logging.getLogger(__name__)
+
+
+# Минуты интервала по локальным дням. Округляем накопленную сумму, а не
+# каждую часть, чтобы части в сумме давали round(длительность / 60).
+def interval_minutes_by_day(start_ts, end_ts, tz=None):
+    tz = tz or get_local_tz()
+    result = []
+    elapsed = 0
+    rounded = 0
+    for day, seconds in split_by_local_day(start_ts, end_ts, tz):
+        elapsed += seconds
+        minutes = round(elapsed / 60) - rounded
+        rounded += minutes
+        result.append((day.strftime("%Y-%m-%d"), minutes))
+    return result
+
+
+# Имена часовых поясов, выбранных пользователями (/tz): user_id -> имя.
+# Кого нет в словаре, считаются в поясе по умолчанию.
+def user_timezones(conn, user_ids=None):
+    try:
+        if user_ids is None:
+            rows = conn.execute("SELECT user_id, tz FROM users WHERE tz IS NOT NULL").fetchall()
+        else:
+            user_ids = list(set(user_ids))
+            rows = []
+            for i in range(0, len(user_ids), 500):
+                chunk = user_ids[i:i + 500]
+                rows += conn.execute(f"SELECT user_id, tz FROM users WHERE tz IS NOT NULL AND user_id IN "
+                                     f"({','.join('?' * len(chunk))})", chunk).fetchall()
+    except sqlite3.OperationalError:  # Таблица users появляется в миграции 7, rebuild вызывается и раньше
+        return {}
+    return dict(rows)
+
+
+def user_timezone(conn, user_id):
+    return get_tz(user_timezones(conn, [user_id]).get(user_id))
+
+
+# Добавляет (sign=1) или вычитает (sign=-1) интервал из daily_rollup.
+# Вызывается в той же транзакции, что и запись в time_logs; tz — пояс пользователя
+# (если не передан, берётся из users).
+def apply_interval(conn, user_id, category, start_ts, end_ts, sign=1, tz=None):
+    if start_ts is None or end_ts is None:
+        return
+    tz = tz or user_timezone(conn, user_id)
+    for day, minutes in interval_minutes_by_day(start_ts, end_ts, tz):
+        if not minutes:
+            continue
+        conn.execute("""
+            INSERT INTO daily_rollup (user_id, local_date, category, minutes) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, local_date, category) DO UPDATE SET minutes = minutes + excluded.minutes
+        """, (user_id, day, category, sign * minutes))
+        if sign < 0:
+            conn.execute("DELETE FROM daily_rollup WHERE user_id = ? AND local_date = ? AND category = ? AND minutes <= 0",
+                         (user_id, day, category))
+
+
+# Строки daily_rollup для интервалов (user_id, category, start_ts, end_ts) многих
+# пользователей: интервалы делятся по часовым поясам, каждая группа считается векторно
+def _rollup_rows(conn, intervals, user_ids=None):
+    import vectorized  # NumPy нужен только для пакетных операций, не при старте бота
+    timezones = user_timezones(conn, user_ids)
+    groups = {}
+    for interval in intervals:
+        groups.setdefault(timezones.get(interval[0]), []).append(interval)
+    rows = []
+    for name, group in groups.items():
+        rows.extend(vectorized.rollup_rows(vectorized.from_rows(group), get_tz(name)))
+    return rows
+
+
+# Добавляет в daily_rollup сразу много интервалов (user_id, category, start_ts, end_ts):
+# минуты считаются векторно (vectorized.py) и пишутся одним executemany
+def apply_intervals(conn, intervals):
+    conn.executemany("""
+        INSERT INTO daily_rollup (user_id, local_date, category, minutes) VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id, local_date, category) DO UPDATE SET minutes = minutes + excluded.minutes
+    """, _rollup_rows(conn, intervals, {interval[0] for interval in intervals}))
+
+
+# Пересчитывает daily_rollup из time_logs (для всех или для одного пользователя)
+def rebuild(conn, user_id=None):
+    if user_id is None:
+        conn.execute("DELETE FROM daily_rollup")
+        intervals = conn.execute("SELECT user_id, category, start_ts, end_ts FROM time_logs").fetchall()
+    else:
+        conn.execute("DELETE FROM daily_rollup WHERE user_id = ?", (user_id,))
+        intervals = conn.execute("SELECT user_id, category, start_ts, end_ts FROM time_logs WHERE user_id = ?",
+                                 (user_id,)).fetchall()
+    conn.executemany("INSERT INTO daily_rollup (user_id, local_date, category, minutes) VALUES (?, ?, ?, ?)",
+                     _rollup_rows(conn, intervals, None if user_id is None else [user_id]))
+    return len(intervals)
+
+
+# Пересчитывает time_logs.date — местную дату окончания в поясе пользователя
+def recompute_dates(conn, user_id=None):
+    timezones = user_timezones(conn, None if user_id is None else [user_id])
+    conn.create_function("local_date", 2, lambda ts, user: local_date(ts, get_tz(timezones.get(user))),
+                         deterministic=True)
+    if user_id is None:
+        return conn.execute("UPDATE time_logs SET date = local_date(end_ts, user_id) WHERE end_ts IS NOT NULL").rowcount
+    return conn.execute("UPDATE time_logs SET date = local_date(end_ts, user_id) WHERE end_ts IS NOT NULL "
+                        "AND user_id = ?", (user_id,)).rowcount
+
+
+# python rollup.py rebuild|dates [--db database.db] [--user USER_ID]
+if __name__ == "__main__":
+    from migrations import migrate
+    from storage import DB_PATH
+
+    parser = argparse.ArgumentParser(description="Пересчёт daily_rollup (rebuild) и time_logs.date (dates)")
+    parser.add_argument("command", choices=["rebuild", "dates"])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--user", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    conn = sqlite3.connect(args.db)
+    migrate(conn)
+    conn.execute("BEGIN")
+    if args.command == "rebuild":
+        count = rebuild(conn, args.user)
+        logger.info("Rebuilt daily_rollup from %d time_logs rows", count)
+    else:
+        count = recompute_dates(conn, args.user)
+        logger.info("Recomputed date for %d time_logs rows", count)
+    conn.commit()
+    conn.close()
@@ -0,0 +1,57 @@
+import inspect
+
+
+# Таблица маршрутов для текстовых сообщений: точный текст кнопки -> обработчик,
+# состояние FSM -> обработчик. Вместо цепочки lambda-фильтров, которые aiogram
+# проверяет по очереди, на каждое сообщение приходится один-два поиска в dict.
+#
+#     routes = MessageRoutes()
+#     dp.message.register(routes.handle, routes.resolve)
+#
+#     @routes.text("📊 Статистика")
+#     async def show_stats_menu(message): ...
+#
+#     @routes.state("waiting_for_new_start_time")
+#     async def process_new_start_time(message, state): ...
+class MessageRoutes:
+    def __init__(self):
+        self.texts = {}
+        self.states = {}
+        self._wants_state = {}
+
+    def _register(self, table, keys, handler):
+        for key in keys:
+            if key in table:
+                raise ValueError(f"Route {key!r} is already taken by {table[key].__name__}")
+            table[key] = handler
+        self._wants_state[handler] = "state" in inspect.signature(handler).parameters
+        return handler
+
+    def text(self, *texts):
+        return lambda handler: self._register(self.texts, texts, handler)
+
+    def state(self, *states):
+        return lambda handler: self._register(self.states, states, handler)
+
+    # Фильтр aiogram: находит обработчик и кладёт его в data["route"].
+    # Кнопки проверяются раньше состояния FSM — сознательно, хотя в цепочке
+    # фильтров порядок был смешанным (кнопки статистики за день и неделю стояли
+    # после StateFilter). Иначе из сценария не выйти: ввод времени принял бы
+    # кнопку меню за неверный формат, а импорт не увидел бы «⬅ Назад», которую
+    # сам предлагает нажать. Кнопка, нажатая посреди сценария, завершает его:
+    # data["leaves_state"] велит handle сбросить состояние до вызова обработчика.
+    def resolve(self, message, raw_state=None):
+        route = self.texts.get(message.text)
+        if route is not None:
+            return {"route": route, "leaves_state": raw_state is not None}
+        route = self.states.get(raw_state) if raw_state is not None else None
+        if route is None:
+            return False
+        return {"route": route}
+
+    async def handle(self, message, route, state, leaves_state=False):
+        if leaves_state:
+            await state.clear()
+        if self._wants_state[route]:
+            return await route(message, state)
+        return await route(message)
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+from aiogram.exceptions import TelegramForbiddenError
+
+from keyboards import main_menu
+from outbox import bulk
+from range_stats import format_stats
+from timeutils import get_tz
+
+SESSION_MAX_HOURS = float(os.getenv("SESSION_MAX_HOURS", "16"))  # Трекинг дольше этого закрывается сам
+AUTO_CLOSE_INTERVAL = float(os.getenv("AUTO_CLOSE_INTERVAL", "300"))  # Как часто искать забытые сессии, секунд
+ACTIVE_RESYNC_INTERVAL = float(os.getenv("ACTIVE_RESYNC_INTERVAL", "600"))  # Как часто сверять активные сессии в памяти с базой, секунд
+DIGEST_HOUR = int(os.getenv("DIGEST_HOUR", "22"))  # Час итогов дня по умолчанию, местное время
+DIGEST_INTERVAL = float(os.getenv("DIGEST_INTERVAL", "60"))  # Как часто проверять, кому пора прислать итоги
+DIGEST_BATCH = int(os.getenv("DIGEST_BATCH", "500"))  # Пользователей на один запрос статистики
+# Шард фоновых задач «номер/всего»: в cluster.py каждый процесс обслуживает своих пользователей
+SCHEDULER_SHARD = tuple(int(part) for part in os.getenv("SCHEDULER_SHARD", "0/1").split("/"))
+
+logger = logging.getLogger(__name__)
+
+
+# Периодические задачи внутри процесса бота. Задача — корутина без аргументов;
+# первый запуск сразу после старта, ошибки пишутся в лог и не останавливают расписание.
+class Scheduler:
+    def __init__(self):
+        self._jobs = []
+        self._tasks = []
+        self.runs = {}
+        self.failures = 0
+
+    def every(self, seconds, fn):
+        self._jobs.append((seconds, fn))
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._loop(seconds, fn)) for seconds, fn in self._jobs]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _loop(self, seconds, fn):
+        while True:
+            try:
+                await fn()
+                self.runs[fn.__name__] = self.runs.get(fn.__name__, 0) + 1
+            except Exception:
+                self.failures += 1
+                logger.exception("Scheduled job %s failed", fn.__name__)
+            await asyncio.sleep(seconds)
+
+
+# Закрывает забытые сессии одним запросом и сообщает об этом пользователям
+async def close_stale_sessions(bot, storage, max_hours=SESSION_MAX_HOURS, shard=SCHEDULER_SHARD):
+    closed = await storage.close_stale_sessions(int(max_hours * 3600), shard)
+    if not closed:
+        return 0
+    logger.info("Auto-closed %d sessions older than %s h", len(closed), max_hours)
+    with bulk():
+        await asyncio.gather(*(
+            bot.send_message(user_id, f"⏹ Трекинг {category} шёл дольше {max_hours:g} ч и завершён автоматически. "
+                                      f"Записано {minutes // 60} ч {minutes % 60} мин — поправь через ✏ Изменить трекинг.",
+                             reply_markup=main_menu(False))
+            for user_id, category, minutes in closed), return_exceptions=True)
+    return len(closed)
+
+
+def digest_text(stats):
+    return "🌙 Итоги дня\n\n" + format_stats(stats)
+
+
+# Итоги дня всем, у кого наступил выбранный час по их местному времени. Час и
+# дата считаются отдельно для каждого часового пояса подписчиков. Пользователи
+# берутся пачками по DIGEST_BATCH: статистика пачки считается одним запросом,
+# сообщения уходят через очередь отправки с низким приоритетом, ответы на действия идут первыми.
+async def send_digests(bot, storage, batch=DIGEST_BATCH, shard=SCHEDULER_SHARD):
+    sent = 0
+    for tz_name in await storage.digest_timezones(shard):
+        sent += await _send_zone_digests(bot, storage, tz_name, batch, shard)
+    if sent:
+        logger.info("Sent %d daily digests", sent)
+    return sent
+
+
+async def _send_zone_digests(bot, storage, tz_name, batch, shard):
+    now = datetime.now(get_tz(tz_name))
+    today = now.date()
+    sent = 0
+    after_id = 0
+    while True:
+        user_ids = await storage.due_digests(tz_name, now.hour, today, shard, after_id, batch)
+        if not user_ids:
+            break
+        after_id = user_ids[-1]
+        stats = await storage.get_range_stats_bulk(user_ids, today, today)
+        recipients = [user_id for user_id in user_ids if stats[user_id].totals]
+        with bulk():
+            results = await asyncio.gather(*(
+                bot.send_message(user_id, digest_text(stats[user_id]), parse_mode="Markdown")
+                for user_id in recipients), return_exceptions=True)
+        blocked = []
+        for user_id, result in zip(recipients, results):
+            if isinstance(result, TelegramForbiddenError):
+                blocked.append(user_id)
+            elif isinstance(result, Exception):
+                logger.warning("Digest for %s was not sent: %r", user_id, result)
+            else:
+                sent += 1
+        # Отмечаем всю пачку: неудачная отправка не должна повторяться каждую минуту
+        await storage.mark_digests(user_ids, today, blocked)
+    return sent
@@ -0,0 +1,650 @@
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytz
+
+import range_stats
+import rollup
+from intervals import OVERLAP_POLICY, IntervalStore, OverlapError, covers
+from metrics import InstrumentedConnection, metrics
+from migrations import migrate
+from storage_base import StorageBackend, daily_stats, weekly_stats
+from timeutils import to_utc_iso, from_utc_iso, get_tz, local_date, local_midnight_ts, ts_to_utc_iso, utc_iso_to_ts
+
+DB_PATH = os.getenv("DB_PATH", "database.db")
+DB_READERS = int(os.getenv("DB_READERS", "4"))  # Количество соединений только для чтения
+# FULL — каждая фиксация транзакции доходит до диска (fsync WAL) до ответа пользователю
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "FULL")
+WRITE_GROUP_SIZE = int(os.getenv("WRITE_GROUP_SIZE", "64"))  # Максимум записей в одной транзакции
+# Сколько секунд добирать записи в группу. 0 — группа из того, что уже в очереди:
+# под нагрузкой записи копятся, пока идёт предыдущий fsync, а одиночная запись не ждёт
+WRITE_GROUP_WAIT = float(os.getenv("WRITE_GROUP_WAIT", "0"))
+
+
+# ---------------------------------------------------------------------------
+# Синхронные операции. Каждая принимает соединение первым аргументом и
+# выполняется либо в потоке записи, либо в пуле читающих потоков.
+# ---------------------------------------------------------------------------
+
+def _start_tracking(conn, user_id, category):
+    now = to_utc_iso(datetime.now())  # Записываем текущее время в ISO формате
+    # Уникальный индекс по user_id: новая сессия заменяет незавершённую
+    conn.execute("INSERT OR REPLACE INTO time_tracking (user_id, category, start_time, start_ts) VALUES (?, ?, ?, ?)",
+                 (user_id, category, now, utc_iso_to_ts(now)))
+    return utc_iso_to_ts(now)
+
+
+def _stop_tracking(conn, intervals, user_id, tz):
+    row = conn.execute("SELECT category, start_time FROM time_tracking WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+                       (user_id,)).fetchone()  # Берём последнюю запись
+
+    if row:
+        category, start_time = row
+        start = start_time
+        start_time = from_utc_iso(start_time)
+        now = datetime.now().astimezone(pytz.utc)
+        end = to_utc_iso(now)
+        duration = now - start_time
+        minutes = round(duration.total_seconds() / 60)
+
+        # **Сохраняем в таблицу статистики**
+        date = local_date(utc_iso_to_ts(end), tz)  # Местная дата пользователя в формате YYYY-MM-DD
+        cursor = conn.execute(
+            "INSERT INTO time_logs (user_id, category, date, start_time, end_time, duration, start_ts, end_ts) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, category, date, start, end, minutes, utc_iso_to_ts(start), utc_iso_to_ts(end)))
+        rollup.apply_interval(conn, user_id, category, utc_iso_to_ts(start), utc_iso_to_ts(end), tz=tz)
+        intervals.add(user_id, cursor.lastrowid, category, utc_iso_to_ts(start), utc_iso_to_ts(end))
+
+        # Удаляем запись из `time_tracking`, чтобы активность считалась завершённой.
+        # Оба запроса попадают в одну транзакцию потока записи.
+        conn.execute("DELETE FROM time_tracking WHERE user_id = ?", (user_id,))
+
+        return category, minutes
+    return None, None
+
+
+# Проверяет наличие активного треккинга
+def _check_active_tracking(conn, user_id):
+    count = conn.execute("SELECT COUNT(*) FROM time_tracking WHERE user_id = ?", (user_id,)).fetchone()[0]
+    return count > 0
+
+
+def _load_active_sessions(conn):
+    return conn.execute("SELECT user_id, category, start_ts FROM time_tracking").fetchall()
+
+
+# Удаляет записи, поглощённые слиянием (intervals.IntervalStore.place)
+def _delete_absorbed(conn, intervals, user_id, category, absorbed, tz):
+    for row_id, start_ts, end_ts in absorbed:
+        conn.execute("DELETE FROM time_logs WHERE id = ?", (row_id,))
+        rollup.apply_interval(conn, user_id, category, start_ts, end_ts, sign=-1, tz=tz)
+        intervals.remove(user_id, row_id, start_ts)
+
+
+# Добавляет интервал в прошлом с учётом пересечений (политика intervals.OVERLAP_POLICY).
+# Возвращает записанные части [(start_ts, end_ts)] или бросает OverlapError.
+def _add_tracking(conn, intervals, user_id, category, start_time_iso, end_time_iso, tz):
+    pieces, absorbed = intervals.place(conn, user_id, category, utc_iso_to_ts(start_time_iso), utc_iso_to_ts(end_time_iso))
+    _delete_absorbed(conn, intervals, user_id, category, absorbed, tz)
+    for start_ts, end_ts in pieces:
+        cursor = conn.execute(
+            "INSERT INTO time_logs (user_id, category, date, start_time, end_time, duration, start_ts, end_ts) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, category, local_date(end_ts, tz), ts_to_utc_iso(start_ts), ts_to_utc_iso(end_ts), round((end_ts - start_ts) / 60),
+             start_ts, end_ts),
+        )
+        rollup.apply_interval(conn, user_id, category, start_ts, end_ts, tz=tz)
+        intervals.add(user_id, cursor.lastrowid, category, start_ts, end_ts)
+    return pieces
+
+
+# Порция истории пользователя для экспорта: постранично по id, без загрузки всего в память
+def _export_chunk(conn, user_id, after_id, limit):
+    return conn.execute(
+        "SELECT id, category, start_time, end_time, duration FROM time_logs WHERE user_id = ? AND id > ? "
+        "ORDER BY id LIMIT ?", (user_id, after_id, limit)).fetchall()
+
+
+# Записывает интервалы (user_id, category, start_ts, end_ts) по политике пересечений,
+# как _add_tracking, только минуты в daily_rollup добавляются одним пакетом в конце.
+# Возвращает для каждого интервала записанные части или None, если он отклонён.
+def _place_intervals(conn, intervals, rows):
+    timezones = rollup.user_timezones(conn, {row[0] for row in rows})
+    pending = {}  # id -> (user_id, category, start_ts, end_ts) записей, ещё не учтённых в daily_rollup
+    placed = []
+    for user_id, category, start_ts, end_ts in rows:
+        try:
+            pieces, absorbed = intervals.place(conn, user_id, category, start_ts, end_ts)
+        except OverlapError:
+            placed.append(None)
+            continue
+        tz = get_tz(timezones.get(user_id))
+        for row_id, absorbed_start, absorbed_end in absorbed:
+            conn.execute("DELETE FROM time_logs WHERE id = ?", (row_id,))
+            if pending.pop(row_id, None) is None:
+                rollup.apply_interval(conn, user_id, category, absorbed_start, absorbed_end, sign=-1, tz=tz)
+            intervals.remove(user_id, row_id, absorbed_start)
+        for piece_start, piece_end in pieces:
+            cursor = conn.execute(
+                "INSERT INTO time_logs (user_id, category, date, start_time, end_time, duration, start_ts, end_ts) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, category, local_date(piece_end, tz), ts_to_utc_iso(piece_start), ts_to_utc_iso(piece_end),
+                 round((piece_end - piece_start) / 60), piece_start, piece_end))
+            pending[cursor.lastrowid] = (user_id, category, piece_start, piece_end)
+            intervals.add(user_id, cursor.lastrowid, category, piece_start, piece_end)
+        placed.append(pieces)
+    rollup.apply_intervals(conn, list(pending.values()))
+    return placed
+
+
+# Вставляет пачку проверенных строк (category, date, start_iso, end_iso, duration, start_ts, end_ts)
+# одной транзакцией. Интервалы, которые уже есть у пользователя, пропускаются,
+# поэтому повторный импорт того же файла ничего не удваивает; остальные проходят
+# через политику пересечений, как добавленные вручную.
+# Возвращает (добавлено строк, из них обрезано, отклонено из-за пересечений).
+def _import_logs(conn, intervals, user_id, rows):
+    if not rows:
+        return 0, 0, 0
+    existing = set(conn.execute(
+        "SELECT category, start_ts, end_ts FROM time_logs WHERE user_id = ? AND start_ts BETWEEN ? AND ?",
+        (user_id, min(row[5] for row in rows), max(row[5] for row in rows))).fetchall())
+    new_rows = []
+    for row in rows:
+        key = (row[0], row[5], row[6])
+        if key not in existing:
+            existing.add(key)
+            new_rows.append((user_id, row[0], row[5], row[6]))
+    placed = _place_intervals(conn, intervals, new_rows)
+    imported = [(row, pieces) for row, pieces in zip(new_rows, placed) if pieces is not None]
+    trimmed = sum(not covers(pieces, row[2], row[3]) for row, pieces in imported)
+    return len(imported), trimmed, len(new_rows) - len(imported)
+
+
+def _get_last_tracking(conn, user_id):
+    return conn.execute(
+        "SELECT id, category, start_time, end_time, date FROM time_logs WHERE user_id = ? ORDER BY start_time DESC LIMIT 1",
+        (user_id,)).fetchone()
+
+
+# Меняет границу интервала в time_logs и переносит минуты в daily_rollup:
+# старый интервал вычитается, новый добавляется в той же транзакции. Новая
+# граница проверяется на пересечения так же, как при добавлении; вторая
+# граница остаётся на месте. Возвращает записанный (start_ts, end_ts) или None,
+# если записи нет или она чужая (устаревшая или подделанная кнопка edit_*).
+def _update_interval(conn, intervals, user_id, tracking_id, column, time_iso, tz):
+    tracking_id = int(tracking_id)
+    row = conn.execute("SELECT category, start_ts, end_ts FROM time_logs WHERE id = ? AND user_id = ?",
+                       (tracking_id, user_id)).fetchone()
+    if not row:
+        return None
+    category, start_ts, end_ts = row
+    if column == "start":
+        new_start, new_end, keep = utc_iso_to_ts(time_iso), end_ts, end_ts
+    else:
+        new_start, new_end, keep = start_ts, utc_iso_to_ts(time_iso), start_ts
+    pieces, absorbed = intervals.place(conn, user_id, category, new_start, new_end, exclude_id=tracking_id, keep=keep)
+    new_start, new_end = pieces[0]
+    _delete_absorbed(conn, intervals, user_id, category, absorbed, tz)
+    rollup.apply_interval(conn, user_id, category, start_ts, end_ts, sign=-1, tz=tz)
+    conn.execute("UPDATE time_logs SET date = ?, start_time = ?, start_ts = ?, end_time = ?, end_ts = ?, duration = ? "
+                 "WHERE id = ?", (local_date(new_end, tz), ts_to_utc_iso(new_start), new_start, ts_to_utc_iso(new_end), new_end,
+                                  round((new_end - new_start) / 60), tracking_id))
+    rollup.apply_interval(conn, user_id, category, new_start, new_end, tz=tz)
+    intervals.remove(user_id, tracking_id, start_ts)
+    intervals.add(user_id, tracking_id, category, new_start, new_end)
+    return new_start, new_end
+
+
+def _update_start_time(conn, intervals, user_id, tracking_id, start_time_iso, tz):
+    return _update_interval(conn, intervals, user_id, tracking_id, "start", start_time_iso, tz)
+
+
+def _update_end_time(conn, intervals, user_id, tracking_id, end_time_iso, tz):
+    return _update_interval(conn, intervals, user_id, tracking_id, "end", end_time_iso, tz)
+
+
+# статистика за день по категориям (из daily_rollup) вместе с идущим трекингом
+# (storage_base.daily_stats)
+def _get_daily_stats(conn, user_id, local_tz):
+    now_local = datetime.now(local_tz)
+    today = now_local.date()
+    midnight_ts = local_midnight_ts(local_tz, today)
+    now_ts = int(now_local.timestamp())
+    rows = conn.execute("""
+        SELECT category, minutes FROM daily_rollup
+        WHERE user_id = ? AND local_date = ?
+    """, (user_id, today.strftime("%Y-%m-%d"))).fetchall()
+    busy = conn.execute("SELECT start_ts, end_ts FROM time_logs WHERE user_id = ? AND end_ts > ? AND start_ts < ?",
+                        (user_id, midnight_ts, now_ts)).fetchall()
+    active = conn.execute("SELECT category, start_ts FROM time_tracking WHERE user_id = ?", (user_id,)).fetchone()
+    return daily_stats(rows, busy, active, midnight_ts, now_ts)
+
+
+# статистика за неделю по категориям (из daily_rollup, последние 7 локальных дней)
+def _get_weekly_stats(conn, user_id, local_tz):
+    now_local = datetime.now(local_tz)
+    first_day = (now_local.date() - timedelta(days=6)).strftime("%Y-%m-%d")
+    rows = conn.execute("""
+        SELECT local_date, category, minutes FROM daily_rollup
+        WHERE user_id = ? AND local_date >= ?
+        ORDER BY local_date
+    """, (user_id, first_day)).fetchall()
+    return weekly_stats(rows, now_local, local_tz)
+
+
+# Закрывает все сессии своего шарда (user_id % count == index), начатые раньше
+# now_ts - max_seconds. Забытый трекинг записывается длиной max_seconds, а не до
+# текущего момента, и проходит через политику пересечений: время, уже занятое
+# другими записями, не считается дважды. Возвращает [(user_id, category, minutes)].
+def _close_stale_sessions(conn, intervals, now_ts, max_seconds, shard):
+    index, count = shard
+    cutoff_ts = now_ts - max_seconds
+    rows = conn.execute("SELECT user_id, category, start_ts FROM time_tracking "
+                        "WHERE start_ts < ? AND user_id % ? = ?", (cutoff_ts, count, index)).fetchall()
+    if not rows:
+        return []
+    # Сначала удаляем сессии, иначе каждая пересекалась бы сама с собой
+    conn.execute("DELETE FROM time_tracking WHERE start_ts < ? AND user_id % ? = ?", (cutoff_ts, count, index))
+    placed = _place_intervals(conn, intervals, [(user_id, category, start_ts, start_ts + max_seconds)
+                                                for user_id, category, start_ts in rows])
+    return [(user_id, category, sum(round((end_ts - start_ts) / 60) for start_ts, end_ts in pieces or ()))
+            for (user_id, category, _), pieces in zip(rows, placed)]
+
+
+# Итоги дня: hour — час по местному времени или None, чтобы отписаться
+def _set_digest(conn, user_id, hour):
+    conn.execute("INSERT INTO users (user_id, digest_hour) VALUES (?, ?) "
+                 "ON CONFLICT (user_id) DO UPDATE SET digest_hour = excluded.digest_hour", (user_id, hour))
+
+
+# Часовые пояса подписчиков итогов дня (None — пояс по умолчанию)
+def _digest_timezones(conn, shard):
+    index, count = shard
+    return [tz for tz, in conn.execute("SELECT DISTINCT tz FROM users WHERE digest_hour IS NOT NULL AND user_id % ? = ?",
+                                       (count, index))]
+
+
+# Пользователи шарда из пояса tz с user_id > after_id, которым пора отправить
+# итоги за today (местные час и дата этого пояса), не больше limit
+def _due_digests(conn, tz, hour, today, shard, after_id, limit):
+    index, count = shard
+    rows = conn.execute("""
+        SELECT user_id FROM users
+        WHERE user_id > ? AND tz IS ? AND digest_hour <= ? AND (digest_date IS NULL OR digest_date < ?)
+              AND user_id % ? = ?
+        ORDER BY user_id LIMIT ?
+    """, (after_id, tz, hour, today.strftime("%Y-%m-%d"), count, index, limit)).fetchall()
+    return [user_id for user_id, in rows]
+
+
+# Часовой пояс пользователя (имя IANA или None — по умолчанию). Местные даты
+# в time_logs и daily_rollup пользователя пересчитываются в новом поясе.
+def _set_timezone(conn, user_id, name):
+    conn.execute("INSERT INTO users (user_id, tz) VALUES (?, ?) "
+                 "ON CONFLICT (user_id) DO UPDATE SET tz = excluded.tz", (user_id, name))
+    rollup.recompute_dates(conn, user_id)
+    rollup.rebuild(conn, user_id)
+
+
+def _load_timezones(conn):
+    return conn.execute("SELECT user_id, tz FROM users WHERE tz IS NOT NULL").fetchall()
+
+
+# Состояния FSM (fsm_storage.py), таблица fsm_states
+def _fsm_load(conn, key, now):
+    return conn.execute("SELECT state, data, expires_at FROM fsm_states WHERE key = ? AND expires_at > ?",
+                        (key, now)).fetchone()
+
+
+def _fsm_save(conn, upserts, deletes):
+    if upserts:
+        conn.executemany("""
+            INSERT INTO fsm_states (key, state, data, expires_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data,
+                                            expires_at = excluded.expires_at
+        """, upserts)
+    if deletes:
+        conn.executemany("DELETE FROM fsm_states WHERE key = ?", [(key,) for key in deletes])
+
+
+def _fsm_delete_expired(conn, now):
+    return conn.execute("DELETE FROM fsm_states WHERE expires_at <= ?", (now,)).rowcount
+
+
+# Отмечает итоги за today отправленными; disabled — заблокировавшие бота, им больше не пишем
+def _mark_digests(conn, user_ids, today, disabled):
+    conn.executemany("UPDATE users SET digest_date = ? WHERE user_id = ?",
+                     [(today.strftime("%Y-%m-%d"), user_id) for user_id in user_ids])
+    conn.executemany("UPDATE users SET digest_hour = NULL WHERE user_id = ?", [(user_id,) for user_id in disabled])
+
+
+# Активные сессии в памяти: user_id -> (категория, start_ts).
+# Загружается из time_tracking при старте и обновляется вместе с записью в базу,
+# так что для выбора клавиатуры не нужен запрос к базе.
+class ActiveSessions:
+    def __init__(self):
+        self._sessions = {}
+        self.hits = 0  # Ответов без обращения к базе
+        self.resyncs = 0  # Случаев, когда память разошлась с базой и была исправлена
+
+    def load(self, rows):
+        self._sessions = {int(user_id): (category, start_ts) for user_id, category, start_ts in rows}
+
+    # Сверяет память с базой; при расхождении берёт данные из базы
+    def resync(self, rows):
+        fresh = {int(user_id): (category, start_ts) for user_id, category, start_ts in rows}
+        if fresh != self._sessions:
+            self.resyncs += 1
+            self._sessions = fresh
+
+    def is_active(self, user_id):
+        self.hits += 1
+        return int(user_id) in self._sessions
+
+    def get(self, user_id):
+        return self._sessions.get(int(user_id))
+
+    def set(self, user_id, category, start_ts):
+        self._sessions[int(user_id)] = (category, start_ts)
+
+    # Убирает сессию после stop_tracking; found — нашлась ли сессия в базе
+    def discard(self, user_id, found):
+        session = self._sessions.pop(int(user_id), None)
+        if (session is not None) != found:
+            self.resyncs += 1
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+def _resolve(fut, result, error):
+    if fut.cancelled():
+        return
+    if error is not None:
+        fut.set_exception(error)
+    else:
+        fut.set_result(result)
+
+
+# Асинхронное хранилище поверх SQLite.
+# Все записи идут через один выделенный поток, чтения — через небольшой пул
+# соединений только для чтения в режиме WAL. Поток записи применяет групповую
+# фиксацию: записи, накопившиеся в очереди (до WRITE_GROUP_SIZE штук или за
+# WRITE_GROUP_WAIT секунд), выполняются в одной транзакции, каждая в своей
+# точке сохранения, и фиксируются одним fsync. Обработчик получает результат
+# только после фиксации, поэтому ответ пользователю уходит после записи на диск.
+# Журналом служит WAL: после сбоя SQLite при открытии базы восстанавливает все
+# зафиксированные группы в time_logs / time_tracking.
+class Storage(StorageBackend):
+    def __init__(self, path=DB_PATH, readers=DB_READERS, synchronous=DB_SYNCHRONOUS, group_size=WRITE_GROUP_SIZE,
+                 group_wait=WRITE_GROUP_WAIT, policy=OVERLAP_POLICY):
+        super().__init__()
+        self.path = path
+        self.readers = readers
+        self.synchronous = synchronous
+        self.group_size = group_size
+        self.group_wait = group_wait
+        self._jobs = queue.Queue()
+        self._writer = None
+        self._pool = None
+        self._local = threading.local()
+        self._read_conns = []
+        self._read_conns_lock = threading.Lock()
+        self.active = ActiveSessions()
+        self.intervals = IntervalStore(policy)  # Используется только в потоке записи
+        self.commits = 0
+        self.written = 0  # Записей, зафиксированных группами
+
+    def _connect(self, read_only=False):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, factory=InstrumentedConnection)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        if read_only:
+            conn.execute("PRAGMA query_only=1")
+        return conn
+
+    # Открывает поток записи, создаёт схему и поднимает пул читателей
+    async def start(self):
+        if self._writer is not None:
+            return
+        self._writer = threading.Thread(target=self._writer_loop, name="sqlite-writer", daemon=True)
+        self._writer.start()
+        await self.write(migrate, group=False)  # Миграции сами управляют транзакциями
+        self.active.load(await self.write(_load_active_sessions))
+        self._timezones = dict(await self.write(_load_timezones))
+        self._pool = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix="sqlite-reader")
+
+    async def close(self):
+        if self._writer is None:
+            return
+        self._jobs.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self._writer.join)
+        self._writer = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        with self._read_conns_lock:
+            for conn in self._read_conns:
+                conn.close()
+            self._read_conns.clear()
+
+    def _writer_loop(self):
+        conn = self._connect()
+        backlog = []  # Задача, которая не вошла в предыдущую группу
+        while True:
+            job = backlog.pop() if backlog else self._jobs.get()
+            if job is None:
+                break
+            if not job[4]:
+                self._run_alone(conn, job)
+                continue
+            group = [job]
+            deadline = time.monotonic() + self.group_wait
+            while len(group) < self.group_size:
+                try:
+                    job = self._jobs.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if job is None or not job[4]:
+                    backlog.append(job)
+                    break
+                group.append(job)
+            self._run_group(conn, group)
+        conn.close()
+
+    # Задача со своей транзакцией (миграции)
+    def _run_alone(self, conn, job):
+        fn, args, fut, loop, _ = job
+        try:
+            result = fn(conn, *args)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            self.intervals.clear()
+            loop.call_soon_threadsafe(_resolve, fut, None, e)
+        else:
+            loop.call_soon_threadsafe(_resolve, fut, result, None)
+
+    # Группа задач в одной транзакции. Ошибка одной задачи откатывает только её
+    # точку сохранения; ошибка фиксации — всю группу.
+    def _run_group(self, conn, group):
+        results = []
+        try:
+            conn.execute("BEGIN")
+            for fn, args, _, _, _ in group:
+                conn.execute("SAVEPOINT job")
+                try:
+                    results.append((fn(conn, *args), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    results.append((None, e))
+                conn.execute("RELEASE job")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            results = [(None, e)] * len(group)
+        self.commits += 1
+        self.written += len(group)
+        metrics.commit_group_size.observe(len(group))
+        if any(error is not None and not isinstance(error, OverlapError) for _, error in results):
+            # Индексы могли измениться до отката: строим заново из базы
+            self.intervals.clear()
+        for (_, _, fut, loop, _), (result, error) in zip(group, results):
+            loop.call_soon_threadsafe(_resolve, fut, result, error)
+
+    def _reader_conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect(read_only=True)
+            self._local.conn = conn
+            with self._read_conns_lock:
+                self._read_conns.append(conn)
+        return conn
+
+    def _run_read(self, fn, args):
+        return fn(self._reader_conn(), *args)
+
+    # Выполняет fn(conn, *args) в потоке записи и ждёт фиксации на диске.
+    # group=False — fn сама открывает и фиксирует транзакции, выполняется отдельно.
+    async def write(self, fn, *args, group=True):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        started = time.perf_counter()
+        self._jobs.put((fn, args, fut, loop, group))
+        try:
+            return await fut
+        finally:
+            metrics.storage_seconds.observe(time.perf_counter() - started, op=fn.__name__.lstrip("_"), kind="write")
+
+    # Выполняет fn(conn, *args) на одном из читающих соединений
+    async def read(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._pool, self._run_read, fn, args)
+        finally:
+            metrics.storage_seconds.observe(time.perf_counter() - started, op=fn.__name__.lstrip("_"), kind="read")
+
+    def gauges(self):
+        return {
+            "bot_active_sessions": lambda: len(self.active),
+            "bot_active_session_resyncs_total": lambda: self.active.resyncs,
+            "bot_db_commits_total": lambda: self.commits,
+            "bot_db_grouped_writes_total": lambda: self.written,
+            "bot_interval_index_users": lambda: len(self.intervals),
+            "bot_interval_index_loads_total": lambda: self.intervals.hydrations,
+        }
+
+    async def set_timezone(self, user_id, name):
+        await self.write(_set_timezone, user_id, name)
+        self._set_tz_name(user_id, name)
+        self._bump(user_id)
+
+    async def start_tracking(self, user_id, category):
+        start_ts = await self.write(_start_tracking, user_id, category)
+        self.active.set(user_id, category, start_ts)
+        self._bump(user_id)
+
+    async def stop_tracking(self, user_id):
+        result = await self.write(_stop_tracking, self.intervals, user_id, self.tz(user_id))
+        self.active.discard(user_id, found=result[0] is not None)
+        self._bump(user_id)
+        return result
+
+    # Отвечает из памяти, без запроса к базе
+    async def check_active_tracking(self, user_id):
+        return self.active.is_active(user_id)
+
+    # Перечитывает активные сессии из time_tracking и считает расхождения. Чтение
+    # идёт через поток записи, чтобы не вернуть в память снимок старше уже
+    # выполненных start/stop (scheduler.py, ACTIVE_RESYNC_INTERVAL)
+    async def resync_active_sessions(self):
+        self.active.resync(await self.write(_load_active_sessions))
+
+    # Возвращает записанные части [(start_ts, end_ts)]; при пересечении, которое
+    # политика не разрешает, бросает intervals.OverlapError
+    async def add_tracking(self, user_id, category, start_time_iso, end_time_iso):
+        pieces = await self.write(_add_tracking, self.intervals, user_id, category, start_time_iso, end_time_iso,
+                                  self.tz(user_id))
+        self._bump(user_id)
+        return pieces
+
+    async def export_chunk(self, user_id, after_id, limit):
+        return await self.read(_export_chunk, user_id, after_id, limit)
+
+    async def import_logs(self, user_id, rows):
+        imported, trimmed, rejected = await self.write(_import_logs, self.intervals, user_id, rows)
+        if imported:
+            self._bump(user_id)
+        return imported, trimmed, rejected
+
+    async def get_last_tracking(self, user_id):
+        return await self.read(_get_last_tracking, user_id)
+
+    # Возвращают записанный (start_ts, end_ts) или None, если записи нет
+    async def update_start_time(self, user_id, tracking_id, start_time_iso):
+        result = await self.write(_update_start_time, self.intervals, user_id, tracking_id, start_time_iso,
+                                  self.tz(user_id))
+        self._bump(user_id)
+        return result
+
+    async def update_end_time(self, user_id, tracking_id, end_time_iso):
+        result = await self.write(_update_end_time, self.intervals, user_id, tracking_id, end_time_iso,
+                                  self.tz(user_id))
+        self._bump(user_id)
+        return result
+
+    async def get_daily_stats(self, user_id):
+        return await self.read(_get_daily_stats, user_id, self.tz(user_id))
+
+    async def get_weekly_stats(self, user_id):
+        return await self.read(_get_weekly_stats, user_id, self.tz(user_id))
+
+    # Закрывает забытые сессии (см. _close_stale_sessions)
+    async def close_stale_sessions(self, max_seconds, shard=(0, 1)):
+        closed = await self.write(_close_stale_sessions, self.intervals, int(time.time()), max_seconds, shard)
+        for user_id, _, _ in closed:
+            self.active.discard(user_id, found=True)
+            self._bump(user_id)
+        return closed
+
+    async def set_digest(self, user_id, hour):
+        await self.write(_set_digest, user_id, hour)
+
+    async def digest_timezones(self, shard=(0, 1)):
+        return await self.read(_digest_timezones, shard)
+
+    async def due_digests(self, tz, hour, today, shard=(0, 1), after_id=0, limit=500):
+        return await self.read(_due_digests, tz, hour, today, shard, after_id, limit)
+
+    async def mark_digests(self, user_ids, today, disabled=()):
+        await self.write(_mark_digests, user_ids, today, list(disabled))
+
+    # Статистика за период сразу для многих пользователей: user_id -> RangeStats
+    async def get_range_stats_bulk(self, user_ids, first_day, last_day):
+        rows = await self.read(range_stats.load_users, user_ids, first_day, last_day)
+        now_ts = int(time.time())
+        return {user_id: range_stats.build(rows[user_id], first_day, last_day, self.active.get(user_id), now_ts,
+                                           self.tz(user_id))
+                for user_id in user_ids}
+
+    # Статистика за любой период локальных дат (range_stats.RangeStats)
+    async def get_range_stats(self, user_id, first_day, last_day):
+        rows = await self.read(range_stats.load_range, user_id, first_day, last_day)
+        return range_stats.build(rows, first_day, last_day, self.active.get(user_id), tz=self.tz(user_id))
+
+    async def fsm_load(self, key, now):
+        return await self.read(_fsm_load, key, now)
+
+    async def fsm_save(self, upserts, deletes):
+        await self.write(_fsm_save, upserts, deletes)
+
+    async def fsm_delete_expired(self, now):
+        return await self.write(_fsm_delete_expired, now)
@@ -0,0 +1,53 @@
+import asyncio
+import contextlib
+import os
+from urllib.parse import urlsplit, urlunsplit
+
+import pytest
+
+from storage import Storage
+
+# Случаи PostgreSQL идут, когда задан DATABASE_URL: на его сервере на время
+# каждого теста создаётся и удаляется отдельная база. Локально, например:
+#   docker run --rm -d -p 5432:5432 -e POSTGRES_HOST_AUTH_METHOD=trust postgres:16
+#   DATABASE_URL=postgresql://postgres@localhost/postgres python -m pytest
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+
+# Временная база на сервере из dsn: тесты не трогают существующие данные
+@contextlib.asynccontextmanager
+async def scratch_database(dsn):
+    import asyncpg
+    name = f"test_storage_{os.getpid()}"
+    admin = await asyncpg.connect(dsn)
+    await admin.execute(f'DROP DATABASE IF EXISTS "{name}"')
+    await admin.execute(f'CREATE DATABASE "{name}"')
+    try:
+        yield urlunsplit(urlsplit(dsn)._replace(path="/" + name))
+    finally:
+        await admin.execute(f'DROP DATABASE "{name}"')
+        await admin.close()
+
+
+# run(scenario, policy="trim") выполняет корутину scenario(storage) на каждом
+# хранилище: SQLite во временном файле и PostgreSQL (без DATABASE_URL — пропуск)
+@pytest.fixture(params=["sqlite", "postgres"])
+def run(request, tmp_path):
+    if request.param == "postgres" and not DATABASE_URL:
+        pytest.skip("PostgreSQL: DATABASE_URL не задан")
+
+    async def open_and_run(storage, scenario):
+        await storage.start()
+        try:
+            return await scenario(storage)
+        finally:
+            await storage.close()
+
+    async def main(scenario, policy):
+        if request.param == "sqlite":
+            return await open_and_run(Storage(str(tmp_path / "test.db"), policy=policy), scenario)
+        from pg_storage import PostgresStorage
+        async with scratch_database(DATABASE_URL) as dsn:
+            return await open_and_run(PostgresStorage(dsn, policy=policy), scenario)
+
+    return lambda scenario, policy="trim": asyncio.run(main(scenario, policy))
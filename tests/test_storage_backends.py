@@ -0,0 +1,209 @@
+import asyncio
+from datetime import datetime, time as dt_time, timedelta
+
+import pytest
+
+from categories import CATEGORIES
+from intervals import OverlapError
+from timeutils import get_tz, to_utc_iso
+from transfer import ImportReport, parse_record
+
+A, B, C = CATEGORIES[:3]
+TZ = get_tz()
+DAY = datetime.now(TZ).date() - timedelta(days=3)  # День сценария: целиком в прошлом
+
+
+# Момент DAY + days в hour:minute по поясу по умолчанию
+def at(hour, minute=0, days=0):
+    return TZ.localize(datetime.combine(DAY + timedelta(days=days), dt_time(hour, minute)))
+
+
+def ts(hour, minute=0, days=0):
+    return int(at(hour, minute, days).timestamp())
+
+
+# Строка UTC ISO 8601, как её передают обработчики бота
+def iso(hour, minute=0, days=0):
+    return to_utc_iso(at(hour, minute, days))
+
+
+def record(category, start, end, days=0):
+    day = DAY + timedelta(days=days)
+    return {"category": category, "start_time": f"{day:%d.%m.%Y} {start}", "end_time": f"{day:%d.%m.%Y} {end}"}
+
+
+def test_start_stop(run):
+    async def scenario(storage):
+        await storage.start_tracking(1, A)
+        assert await storage.check_active_tracking(1)
+        category, minutes = await storage.stop_tracking(1)
+        assert (category, minutes) == (A, 0)
+        assert tuple(await storage.stop_tracking(1)) == (None, None)
+        assert not await storage.check_active_tracking(1)
+        exported = await storage.export_chunk(1, 0, 10)
+        assert [row[1] for row in exported] == [A]
+
+    run(scenario)
+
+
+@pytest.mark.parametrize("policy, expected", [
+    ("trim", [(ts(10), ts(11))]),
+    ("merge", [(ts(10), ts(11))]),
+    ("reject", None),
+])
+def test_add_overlapping(run, policy, expected):
+    async def scenario(storage):
+        assert [tuple(piece) for piece in await storage.add_tracking(1, A, iso(9), iso(10))] == [(ts(9), ts(10))]
+        if expected is None:
+            with pytest.raises(OverlapError) as error:
+                await storage.add_tracking(1, B, iso(9, 30), iso(11))
+            assert [tuple(conflict) for conflict in error.value.conflicts] == [(A, ts(9), ts(10))]
+            return
+        added = await storage.add_tracking(1, B, iso(9, 30), iso(11))
+        assert [tuple(piece) for piece in added] == expected
+        stats = await storage.get_range_stats(1, DAY, DAY)
+        assert stats.totals == {A: 60, B: 60}
+
+    run(scenario, policy)
+
+
+@pytest.mark.parametrize("policy, expected", [
+    ("trim", {A: 120}),
+    ("merge", {A: 120}),
+])
+def test_merge_adjacent(run, policy, expected):
+    async def scenario(storage):
+        await storage.add_tracking(1, A, iso(9), iso(10))
+        added = await storage.add_tracking(1, A, iso(10), iso(11))
+        spans = [(ts(9), ts(11))] if policy == "merge" else [(ts(10), ts(11))]
+        assert [tuple(piece) for piece in added] == spans
+        assert (await storage.get_range_stats(1, DAY, DAY)).totals == expected
+        assert len(await storage.export_chunk(1, 0, 10)) == (1 if policy == "merge" else 2)
+
+    run(scenario, policy)
+
+
+def test_edit_moves_rollup(run):
+    async def scenario(storage):
+        await storage.add_tracking(1, A, iso(9), iso(10))
+        tracking_id, category, *_ = await storage.get_last_tracking(1)
+        assert category == A
+        assert tuple(await storage.update_start_time(1, tracking_id, iso(8, 30))) == (ts(8, 30), ts(10))
+        # Конец на следующий день: минуты делятся между двумя датами
+        assert tuple(await storage.update_end_time(1, tracking_id, iso(0, 30, days=1))) == (ts(8, 30), ts(0, 30, 1))
+        assert await storage.update_end_time(1, 10 ** 9, iso(11)) is None
+        stats = await storage.get_range_stats(1, DAY, DAY + timedelta(days=1))
+        assert stats.totals == {A: 960}
+        assert stats.days == {DAY: {A: 930}, DAY + timedelta(days=1): {A: 30}}
+
+    run(scenario)
+
+
+def test_edit_other_users_log(run):
+    async def scenario(storage):
+        await storage.add_tracking(1, A, iso(9), iso(10))
+        tracking_id = (await storage.get_last_tracking(1))[0]
+        assert await storage.update_start_time(2, tracking_id, iso(8)) is None
+        assert await storage.update_end_time(2, tracking_id, iso(11)) is None
+        assert (await storage.get_range_stats(1, DAY, DAY)).totals == {A: 60}
+
+    run(scenario)
+
+
+def test_edit_overlap_rejected(run):
+    async def scenario(storage):
+        await storage.add_tracking(1, A, iso(9), iso(10))
+        await storage.add_tracking(1, B, iso(11), iso(12))
+        tracking_id = (await storage.get_last_tracking(1))[0]
+        with pytest.raises(OverlapError):
+            await storage.update_start_time(1, tracking_id, iso(9, 30))
+        assert (await storage.get_range_stats(1, DAY, DAY)).totals == {A: 60, B: 60}
+
+    run(scenario, "reject")
+
+
+def test_import(run):
+    now = datetime.now(TZ)
+    rows = [parse_record(record(category, start, end), now, TZ)
+            for category, start, end in ((A, "07:00", "07:45"), (B, "08:00", "09:10"), (C, "23:00", "23:59"))]
+
+    async def scenario(storage):
+        assert tuple(await storage.import_logs(1, rows + rows[:2])) == (3, 0, 0)  # Повторы внутри файла
+        assert tuple(await storage.import_logs(1, rows)) == (0, 0, 0)
+        assert tuple(await storage.import_logs(1, [])) == (0, 0, 0)
+        stats = await storage.get_range_stats(1, DAY, DAY)
+        assert stats.totals == {A: 45, B: 70, C: 59}
+        exported = sorted(tuple(row[1:]) for row in await storage.export_chunk(1, 0, 10))
+        assert [(row[0], row[-1]) for row in exported] == sorted([(A, 45), (B, 70), (C, 59)])
+
+    run(scenario)
+
+
+@pytest.mark.parametrize("policy, expected, totals", [
+    ("trim", (1, 1, 0), {A: 60, B: 30}),
+    ("reject", (0, 0, 1), {A: 60}),
+])
+def test_import_overlapping(run, policy, expected, totals):
+    now = datetime.now(TZ)
+    rows = [parse_record(record(B, "09:30", "10:30"), now, TZ)]
+
+    async def scenario(storage):
+        await storage.add_tracking(1, A, iso(9), iso(10))
+        result = tuple(await storage.import_logs(1, rows))
+        assert result == expected
+        assert (await storage.get_range_stats(1, DAY, DAY)).totals == totals
+        return result
+
+    imported, trimmed, rejected = run(scenario, policy)
+    report = ImportReport()
+    report.rows = report.imported = imported + rejected
+    report.imported, report.trimmed, report.rejected = imported, trimmed, rejected
+    text = report.text()
+    assert ("⚠" in text) is bool(trimmed or rejected)
+
+
+def test_rollup_follows_timezone(run):
+    async def scenario(storage):
+        await storage.add_tracking(1, A, iso(22), iso(2, days=1))  # Через полночь
+        stats = await storage.get_range_stats(1, DAY, DAY + timedelta(days=1))
+        assert stats.days == {DAY: {A: 120}, DAY + timedelta(days=1): {A: 120}}
+        assert stats.totals == {A: 240}
+        # В поясе UTC-8 тот же интервал ложится на другие местные даты
+        other = get_tz("Etc/GMT+8")
+        start, end = at(22).astimezone(other), at(2, days=1).astimezone(other)
+        midnight = other.localize(datetime.combine(end.date(), dt_time(0)))
+        expected = ({start.date(): {A: 240}} if start.date() == end.date() else
+                    {start.date(): {A: (midnight - start).seconds // 60}, end.date(): {A: (end - midnight).seconds // 60}})
+        await storage.set_timezone(1, "Etc/GMT+8")
+        shifted = await storage.get_range_stats(1, DAY - timedelta(days=1), DAY + timedelta(days=1))
+        assert shifted.totals == {A: 240}
+        assert {day: minutes for day, minutes in shifted.days.items() if minutes} == expected
+        await storage.set_timezone(1, None)
+        assert (await storage.get_range_stats(1, DAY, DAY + timedelta(days=1))).days == stats.days
+
+    run(scenario)
+
+
+def test_range_bulk(run):
+    async def scenario(storage):
+        await storage.add_tracking(1, A, iso(9), iso(10))
+        await storage.add_tracking(2, B, iso(9), iso(9, 30))
+        await storage.add_tracking(2, B, iso(20), iso(21))
+        bulk = await storage.get_range_stats_bulk([1, 2, 3], DAY, DAY)
+        assert {user_id: stats.totals for user_id, stats in bulk.items()} == {1: {A: 60}, 2: {B: 90}, 3: {}}
+
+    run(scenario)
+
+
+def test_close_stale_sessions(run):
+    async def scenario(storage):
+        await storage.start_tracking(1, A)
+        await storage.start_tracking(2, B)
+        await asyncio.sleep(2.1)  # start_ts — целые секунды
+        closed = sorted(tuple(row) for row in await storage.close_stale_sessions(1))
+        assert closed == [(1, A, 0), (2, B, 0)]
+        assert not await storage.check_active_tracking(1)
+        assert [row[1] for row in await storage.export_chunk(1, 0, 10)] == [A]
+        assert await storage.close_stale_sessions(1) == []
+
+    run(scenario)
@@ -0,0 +1,98 @@
+import functools
+import os
+from datetime import datetime, time, timedelta
+import pytz
+
+DEFAULT_TZ = os.getenv("TZ", "Asia/Dubai")  # Часовой пояс пользователей, которые не выбрали свой (/tz)
+
+# Словарь для перевода дней недели
+DAYS_TRANSLATION = {
+    "Monday": "Понедельник",
+    "Tuesday": "Вторник",
+    "Wednesday": "Среда",
+    "Thursday": "Четверг",
+    "Friday": "Пятница",
+    "Saturday": "Суббота",
+    "Sunday": "Воскресенье",
+}
+
+
+# Переводит datetime Python в строку UTC ISO 8601
+def to_utc_iso(dt):
+    dt_utc = dt.astimezone(pytz.utc)  # Приводим к UTC
+    return dt_utc.isoformat()  # Преобразуем в ISO формат
+
+
+# Переводит строку UTC ISO 8601 в datetime UTC
+def from_utc_iso(utc_str):
+    dt_utc = datetime.fromisoformat(utc_str).replace(tzinfo=pytz.utc)  # Приводим к UTC
+    return dt_utc
+
+
+# Секунды эпохи для строки UTC ISO 8601
+def utc_iso_to_ts(utc_str):
+    return int(from_utc_iso(utc_str).timestamp())
+
+
+# Строка UTC ISO 8601 для секунд эпохи
+def ts_to_utc_iso(ts):
+    return to_utc_iso(datetime.fromtimestamp(ts, pytz.utc))
+
+
+# Объект часового пояса по имени IANA; None — пояс по умолчанию.
+# pytz.timezone разбирает имя при каждом вызове, поэтому объекты кешируются.
+@functools.lru_cache(maxsize=None)
+def get_tz(name=None):
+    return pytz.timezone(name or DEFAULT_TZ)
+
+
+# Имя часового пояса IANA по вводу пользователя без учёта регистра («europe/moscow»,
+# «utc»); None, если такого пояса нет
+def find_tz(text):
+    return _TZ_NAMES.get(text.strip().lower().replace(" ", "_"))
+
+
+_TZ_NAMES = {name.lower(): name for name in pytz.all_timezones}
+
+
+# Переводит datetime UTC в datetime с локальным часовым поясом (пользователя или по умолчанию)
+def from_utc_to_tz(dt, tz=None):
+    return dt.astimezone(tz or get_tz())
+
+
+# Переводит местное время в UTC
+def local_time_to_utc(dt, tz=None):
+    dt = (tz or get_tz()).localize(dt)
+    # Переводим в UTC
+    return dt.astimezone(pytz.utc)
+
+
+# Часовой пояс по умолчанию
+def get_local_tz():
+    return get_tz()
+
+
+# Локальная полночь даты day в секундах эпохи. Запоминается для пары (пояс, дата):
+# границы суток нужны при каждом разбиении интервалов и подсчёте «Без трекинга».
+@functools.lru_cache(maxsize=65536)
+def local_midnight_ts(tz, day):
+    return int(tz.localize(datetime.combine(day, time())).timestamp())
+
+
+# Местная дата момента ts в виде YYYY-MM-DD (колонка time_logs.date)
+def local_date(ts, tz=None):
+    return datetime.fromtimestamp(ts, tz or get_tz()).strftime("%Y-%m-%d")
+
+
+# Разбивает интервал [start_ts, end_ts) по локальным суткам.
+# Возвращает список (дата, секунды) для каждого дня, который задевает интервал.
+def split_by_local_day(start_ts, end_ts, tz):
+    parts = []
+    day = datetime.fromtimestamp(start_ts, tz).date()
+    while start_ts < end_ts:
+        next_midnight = local_midnight_ts(tz, day + timedelta(days=1))
+        part_end = min(end_ts, next_midnight)
+        parts.append((day, part_end - start_ts))
+        start_ts = part_end
+        day += timedelta(days=1)
+    return parts
@@ -0,0 +1,188 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+import pytz
+
+from categories import find_category
+from timeutils import local_date, local_time_to_utc, to_utc_iso
+
+EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", "1000"))  # Строк за одну выборку при экспорте
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "1000"))  # Строк в одной транзакции при импорте
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(20 * 1024 * 1024)))  # Больше Bot API не отдаёт
+
+FORMATS = ("csv", "json")
+FIELDS = ["category", "start_time", "end_time", "duration"]
+REPORTED_ERRORS = 5  # Сколько ошибок показывать пользователю
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------
+# Экспорт: история пишется во временный файл порциями по EXPORT_CHUNK строк
+# ---------------------------------------------------------------------------
+
+# Пишет историю пользователя в path; возвращает число записей. Файл создаёт и
+# удаляет вызывающий — так он удаляется и тогда, когда выгрузка оборвалась.
+async def export_to_file(storage, user_id, path, fmt):
+    count = 0
+    after_id = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+        else:
+            f.write("[")
+        while True:
+            rows = await storage.export_chunk(user_id, after_id, EXPORT_CHUNK)
+            if not rows:
+                break
+            for row_id, category, start_time, end_time, duration in rows:
+                if fmt == "csv":
+                    writer.writerow((category, start_time, end_time, duration))
+                else:
+                    f.write(",\n" if count else "\n")
+                    f.write(json.dumps(dict(zip(FIELDS, (category, start_time, end_time, duration))),
+                                       ensure_ascii=False))
+                count += 1
+            after_id = rows[-1][0]
+        if fmt == "json":
+            f.write("\n]\n")
+    return count
+
+
+# ---------------------------------------------------------------------------
+# Импорт: файл читается построчно, строки проверяются и пишутся пачками
+# ---------------------------------------------------------------------------
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.trimmed = 0  # Добавлены без времени, уже занятого другими записями
+        self.rejected = 0  # Не добавлены: пересекаются с другими записями (OVERLAP_POLICY)
+        self.failed = 0
+        self.errors = []  # Первые REPORTED_ERRORS ошибок
+        self.seconds = 0.0
+
+    @property
+    def rate(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def text(self):
+        lines = [
+            f"📥 Импорт завершён: добавлено {self.imported} из {self.rows} строк "
+            f"за {self.seconds:.1f} с ({self.rate:.0f} строк/с).",
+        ]
+        if self.duplicates:
+            lines.append(f"Уже были в истории: {self.duplicates}.")
+        if self.trimmed:
+            lines.append(f"⚠ Время, которое уже было занято другими записями, пропущено в {self.trimmed} стр.")
+        if self.rejected:
+            lines.append(f"⚠ Пересекаются с другими записями и не добавлены: {self.rejected}.")
+        if self.failed:
+            lines.append(f"С ошибками: {self.failed}.")
+            lines.extend(f"• {error}" for error in self.errors)
+        return "\n".join(lines)
+
+
+# ISO 8601 (как в экспорте) или DD.MM.YYYY HH:MM по местному времени пользователя
+def _parse_time(value, tz=None):
+    value = value.strip()
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        dt = datetime.strptime(value, "%d.%m.%Y %H:%M")
+    if dt.tzinfo is None:
+        return local_time_to_utc(dt, tz)
+    return dt.astimezone(pytz.utc)
+
+
+# Проверяет запись из файла; возвращает строку для Storage.import_logs.
+# tz — часовой пояс пользователя: в нём время без пояса и дата записи.
+def parse_record(record, now, tz=None):
+    category = find_category(str(record.get("category") or "").strip())
+    if category is None:
+        raise ValueError(f"неизвестная категория {record.get('category')!r}")
+    try:
+        start = _parse_time(str(record["start_time"]), tz)
+        end = _parse_time(str(record["end_time"]), tz)
+    except (KeyError, ValueError):
+        raise ValueError("время должно быть в формате ISO 8601 или DD.MM.YYYY HH:MM")
+    if end <= start:
+        raise ValueError("окончание раньше начала")
+    if end > now:
+        raise ValueError("время в будущем")
+    start_iso, end_iso = to_utc_iso(start), to_utc_iso(end)
+    duration = round((end - start).total_seconds() / 60)  # Длительность из файла не доверяем
+    start_ts, end_ts = int(start.timestamp()), int(end.timestamp())
+    return category, local_date(end_ts, tz), start_iso, end_iso, duration, start_ts, end_ts
+
+
+# Записи файла по одной: (номер строки или записи, dict). Файл, который не
+# читается целиком (не UTF-8, битый CSV или JSON), — ValueError с понятным текстом
+def read_records(path, fmt):
+    try:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            if fmt == "csv":
+                reader = csv.DictReader(f)
+                for record in reader:
+                    yield reader.line_num, record
+            else:
+                data = json.load(f)
+                if not isinstance(data, list):
+                    raise ValueError("JSON должен быть списком записей")
+                for index, record in enumerate(data, 1):
+                    yield index, record
+    except UnicodeDecodeError:
+        raise ValueError("файл должен быть в кодировке UTF-8")
+    except csv.Error as e:
+        raise ValueError(f"повреждённый CSV: {e}")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"повреждённый JSON, строка {e.lineno}")
+
+
+# Следующая пачка проверенных строк; ошибки копятся в report
+def _next_batch(records, report, now, tz):
+    batch = []
+    for number, record in records:
+        report.rows += 1
+        try:
+            if not isinstance(record, dict):
+                raise ValueError("запись должна быть объектом")
+            batch.append(parse_record(record, now, tz))
+        except ValueError as e:
+            report.failed += 1
+            if len(report.errors) < REPORTED_ERRORS:
+                report.errors.append(f"строка {number}: {e}")
+        if len(batch) >= IMPORT_BATCH:
+            break
+    return batch
+
+
+# Импортирует файл в историю пользователя. Разбор идёт в отдельном потоке,
+# каждая пачка пишется своей транзакцией, чтобы не задерживать остальные записи.
+async def import_file(storage, user_id, path, fmt):
+    report = ImportReport()
+    started = time.perf_counter()
+    now = datetime.now(pytz.utc)
+    tz = storage.tz(user_id)
+    records = read_records(path, fmt)
+    while True:
+        batch = await asyncio.to_thread(_next_batch, records, report, now, tz)
+        if not batch:
+            break
+        imported, trimmed, rejected = await storage.import_logs(user_id, batch)
+        report.imported += imported
+        report.trimmed += trimmed
+        report.rejected += rejected
+        report.duplicates += len(batch) - imported - rejected
+    report.seconds = time.perf_counter() - started
+    logger.info("Imported %d/%d rows for user %s in %.2f s (%.0f rows/s)",
+                report.imported, report.rows, user_id, report.seconds, report.rate)
+    return report
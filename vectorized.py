@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from timeutils import get_local_tz, local_midnight_ts
+
+# Векторный путь агрегации: интервалы пользователя — это массивы секунд
+# эпохи (start, end) и кодов категорий, а разбиение по местной полуночи и
+# суммирование по дням делаются операциями NumPy без цикла по интервалам.
+# Округление то же, что в rollup.interval_minutes_by_day: округляется
+# накопленная сумма секунд внутри интервала, поэтому результаты совпадают.
+# Бот использует rollup_rows (пакетная запись daily_rollup, rollup.py);
+# minutes_by_day и untracked_by_day сравниваются с циклом в benchmarks/aggregation.py.
+
+
+class Intervals:
+    def __init__(self, user_ids, starts, ends, codes, categories):
+        self.user_ids = user_ids
+        self.starts = starts
+        self.ends = ends
+        self.codes = codes
+        self.categories = categories  # код -> название категории
+
+    def __len__(self):
+        return len(self.starts)
+
+
+# Интервалы из строк (user_id, category, start_ts, end_ts); пустые и без времени отбрасываются
+def from_rows(rows):
+    categories = []
+    index = {}
+    user_ids, starts, ends, codes = [], [], [], []
+    for user_id, category, start_ts, end_ts in rows:
+        if start_ts is None or end_ts is None or end_ts <= start_ts:
+            continue
+        code = index.get(category)
+        if code is None:
+            code = index[category] = len(categories)
+            categories.append(category)
+        user_ids.append(user_id)
+        starts.append(start_ts)
+        ends.append(end_ts)
+        codes.append(code)
+    return Intervals(np.array(user_ids, dtype=np.int64), np.array(starts, dtype=np.int64),
+                     np.array(ends, dtype=np.int64), np.array(codes, dtype=np.int64), categories)
+
+
+# Местные полуночи с first_day по last_day + 1 включительно: границы суток,
+# в дни перевода часов сутки получаются 23 или 25 часов
+def day_edges(first_day, last_day, tz=None):
+    tz = tz or get_local_tz()
+    days = (last_day - first_day).days + 2
+    return np.array([local_midnight_ts(tz, first_day + timedelta(days=i)) for i in range(days)], dtype=np.int64)
+
+
+# Границы суток, покрывающие все интервалы; возвращает (первый день, границы)
+def covering_edges(intervals, tz=None):
+    tz = tz or get_local_tz()
+    first_day = datetime.fromtimestamp(int(intervals.starts.min()), tz).date()
+    last_day = datetime.fromtimestamp(int(intervals.ends.max()), tz).date()
+    return first_day, day_edges(first_day, last_day, tz)
+
+
+# Режет интервалы по границам суток. Возвращает для каждого куска номер
+# интервала, номер дня (индекс в edges) и минуты куска.
+def split_minutes(starts, ends, edges):
+    first = np.searchsorted(edges, starts, side="right") - 1
+    last = np.searchsorted(edges, ends, side="left") - 1  # Конец ровно в полночь — это ещё прошлый день
+    counts = last - first + 1
+    total = int(counts.sum())
+    group_start = np.cumsum(counts) - counts
+    interval = np.repeat(np.arange(len(starts)), counts)
+    day = first[interval] + (np.arange(total) - group_start[interval])
+
+    seconds = np.minimum(ends[interval], edges[day + 1]) - np.maximum(starts[interval], edges[day])
+    # Накопленная сумма секунд внутри каждого интервала
+    cumulative = np.cumsum(seconds)
+    elapsed = cumulative - (cumulative[group_start] - seconds[group_start])[interval]
+    rounded = np.round(elapsed / 60).astype(np.int64)
+    previous = np.concatenate(([0], rounded[:-1]))
+    previous[group_start] = 0
+    return interval, day, rounded - previous
+
+
+# Матрица минут [день, категория] для интервалов одного пользователя
+def minutes_by_day(intervals, edges):
+    matrix = np.zeros((len(edges) - 1, len(intervals.categories)), dtype=np.int64)
+    if len(intervals):
+        # Всё, что до и после периода, — по одному «дню» с каждой стороны: накопленная
+        # сумма на границе периода та же, значит и минуты внутри те же, что в daily_rollup
+        padded = np.concatenate(([min(int(intervals.starts.min()), int(edges[0]))], edges,
+                                 [max(int(intervals.ends.max()), int(edges[-1])) + 1]))
+        interval, day, minutes = split_minutes(intervals.starts, intervals.ends, padded)
+        day -= 1
+        inside = (day >= 0) & (day < len(edges) - 1)
+        np.add.at(matrix, (day[inside], intervals.codes[interval[inside]]), minutes[inside])
+    return matrix
+
+
+# Минуты без трекинга по дням: длина суток (до now_ts для сегодня) минус отмеченное
+def untracked_by_day(matrix, edges, now_ts):
+    day_minutes = np.clip(np.minimum(edges[1:], now_ts) - edges[:-1], 0, None) // 60
+    return np.clip(day_minutes - matrix.sum(axis=1), 0, None)
+
+
+# Строки daily_rollup (user_id, local_date, category, minutes) для всех интервалов.
+# Нулевые куски (интервалы короче полуминуты) не записываются.
+def rollup_rows(intervals, tz=None):
+    if not len(intervals):
+        return []
+    first_day, edges = covering_edges(intervals, tz)
+    interval, day, minutes = split_minutes(intervals.starts, intervals.ends, edges)
+    # Ключ (пользователь, день, категория) упаковывается в одно целое: так уникальные
+    # ключи и суммы по ним считаются одной сортировкой
+    users, user_codes = np.unique(intervals.user_ids, return_inverse=True)
+    days = len(edges) - 1
+    categories = len(intervals.categories)
+    keys = (user_codes[interval] * days + day) * categories + intervals.codes[interval]
+    unique, inverse = np.unique(keys, return_inverse=True)
+    sums = np.bincount(inverse, weights=minutes, minlength=len(unique)).astype(np.int64)
+    dates = [(first_day + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+    users = users.tolist()
+    return [(users[key // categories // days], dates[key // categories % days], intervals.categories[key % categories],
+             total) for key, total in zip(unique.tolist(), sums.tolist()) if total]
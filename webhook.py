@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import signal
+
+from aiogram.types import Update
+from aiohttp import web
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Публичный адрес бота, например https://example.herokuapp.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", "8080")))
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "25"))  # Секунд на завершение обработчиков при остановке
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+logger = logging.getLogger(__name__)
+
+
+# Пользователь, от которого пришло обновление (None для служебных обновлений)
+def update_user_id(update):
+    user = getattr(update.event, "from_user", None)
+    return user.id if user else None
+
+
+# Передаёт обновления в диспетчер в фоне. Обновления одного пользователя
+# обрабатываются строго по очереди (старт после стопа и т.п.), разных — параллельно.
+# Запущенные обработчики запоминаются, чтобы при остановке дождаться их завершения.
+class UpdateFeeder:
+    def __init__(self, bot, dp):
+        self.bot = bot
+        self.dp = dp
+        self._tasks = set()
+        self._last_by_user = {}
+
+    @property
+    def in_flight(self):
+        return len(self._tasks)
+
+    # Принимает обновление в виде JSON-словаря, как его присылает Telegram
+    def feed_raw(self, data):
+        return self.feed(Update.model_validate(data, context={"bot": self.bot}))
+
+    def feed(self, update):
+        user_id = update_user_id(update)
+        task = asyncio.create_task(self._process(update, self._last_by_user.get(user_id)))
+        self._tasks.add(task)
+        self._last_by_user[user_id] = task
+        task.add_done_callback(lambda t: self._forget(user_id, t))
+        return task
+
+    # Ошибка обработчика пишется в лог здесь: задачу никто не ждёт, и без этого
+    # исключение всплыло бы только как «Task exception was never retrieved»
+    async def _process(self, update, previous):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logger.exception("Update %s failed", update.update_id)
+
+    def _forget(self, user_id, task):
+        self._tasks.discard(task)
+        if self._last_by_user.get(user_id) is task:
+            del self._last_by_user[user_id]
+
+    # Ждёт уже запущенные обработчики, по истечении таймаута отменяет оставшиеся
+    async def drain(self, timeout=DRAIN_TIMEOUT):
+        if not self._tasks:
+            return
+        logger.info("Draining %d in-flight updates", len(self._tasks))
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            logger.warning("%d updates did not finish in %.0f s, cancelling", len(pending), timeout)
+            for task in pending:
+                task.cancel()
+
+
+# aiohttp-приложение, принимающее обновления от Telegram.
+# Ответ 200 отдаётся сразу, обработка идёт в фоне: feeder — это UpdateFeeder
+# или любой объект с feed_raw(data), in_flight и drain(timeout).
+class WebhookServer:
+    def __init__(self, feeder, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+        self.feeder = feeder
+        self.path = path
+        self.secret = secret
+        self.accepting = True
+        self.received = 0
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/health", self.handle_health)
+        return app
+
+    async def handle_update(self, request):
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=401)
+        if not self.accepting:
+            # Telegram повторит доставку позже, уже в новый процесс
+            return web.Response(status=503)
+        # Битое тело — 400: на 5xx Telegram повторял бы его снова и снова
+        try:
+            data = await request.json()
+            if not isinstance(data, dict):
+                raise ValueError("update is not a JSON object")
+            self.feeder.feed_raw(data)
+        except ValueError as e:  # json.JSONDecodeError и pydantic.ValidationError — подклассы ValueError
+            logger.warning("Malformed update rejected: %s", e)
+            return web.Response(status=400)
+        self.received += 1
+        return web.json_response({})
+
+    async def handle_health(self, request):
+        return web.json_response({
+            "status": "ok" if self.accepting else "draining",
+            "in_flight": self.feeder.in_flight,
+            "received": self.received,
+        })
+
+    # Перестаёт принимать обновления и ждёт уже запущенные обработчики
+    async def drain(self, timeout=DRAIN_TIMEOUT):
+        self.accepting = False
+        await self.feeder.drain(timeout)
+
+
+# Ждёт SIGTERM/SIGINT
+async def wait_for_stop_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+# Запускает веб-сервер с данным feeder и работает до SIGTERM/SIGINT
+async def serve_webhook(bot, feeder, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+    server = WebhookServer(feeder)
+    runner = web.AppRunner(server.build_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info("Webhook server listening on %s:%d%s", host, port, server.path)
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL.rstrip("/") + server.path, secret_token=WEBHOOK_SECRET)
+
+    try:
+        await wait_for_stop_signal()
+    finally:
+        await server.drain()
+        await runner.cleanup()
+        await bot.session.close()
+
+
+async def run_webhook(bot, dp, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+    await serve_webhook(bot, UpdateFeeder(bot, dp), host, port)